@@ -0,0 +1,220 @@
+"""Check the direct pixel downloads of download_direct against a local fake of the GEE pixel urls
+
+Usage:
+    python -m benchmark.direct_download [--width 0.5] [--height 0.4] [--max-bytes 1]
+
+A http.server renders the GeoTIFF of any window of a synthetic (bands, rows, cols) array and
+rejects the requests larger than a size limit as getDownloadURL does. The script checks that:
+- the tiles of tile_grid stay under the size limit, for the default limit too,
+- the mosaic written by download_direct is identical to the synthetic array,
+- a tile failing a few times is retried with the backoff and the mosaic is still identical,
+- a grid split in tiles larger than the limit raises instead of writing a partial mosaic.
+"""
+
+import argparse
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import rasterio as rio
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+
+from component import parameter as pm
+from component.scripts.direct_download import aoi_profile, download_direct, tile_grid
+
+# the size limit of a getDownloadURL request (the computePixels limit is 48 MB)
+ee_request_bytes = 32 * 2**20
+
+
+class FakePixels(ThreadingHTTPServer):
+    """Local server answering the GeoTIFF pixel requests of the windows of an array
+
+    Args:
+        array (np.ndarray): the (bands, rows, cols) pixels of the grid
+        profile (dict): the rasterio profile of the grid
+        max_bytes (int): the size limit of a request
+        failures (dict): the number of times each (col, row) tile answers an error first
+    """
+
+    daemon_threads = True
+
+    def __init__(self, array, profile, max_bytes, failures=None):
+        super().__init__(("127.0.0.1", 0), PixelHandler)
+        self.array = array
+        self.profile = profile
+        self.max_bytes = max_bytes
+        self.failures = dict(failures or {})
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/"
+
+    def tile_url(self, window):
+        """Return the url of a window, used as the url_function of download_direct"""
+
+        return f"{self.url}tiles/{window.col_off}_{window.row_off}_{window.width}_{window.height}.tif"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class PixelHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send(self, status, body=b"", content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Render the GeoTIFF of a window of the array"""
+
+        match = re.fullmatch(r"/tiles/(\d+)_(\d+)_(\d+)_(\d+)\.tif", self.path)
+        if not match:
+            return self.send(404)
+
+        col, row, width, height = map(int, match.groups())
+        server = self.server
+        with server.lock:
+            server.requests.append((col, row, width, height))
+            failures = server.failures.get((col, row), 0)
+            server.failures[(col, row)] = max(0, failures - 1)
+
+        if failures:
+            return self.send(500, b'{"error": {"message": "Internal error"}}')
+
+        size = width * height * server.array.shape[0] * server.array.itemsize
+        if size > server.max_bytes:
+            msg = f"Total request size ({size} bytes) must be less than or equal to {server.max_bytes} bytes."
+            return self.send(400, f'{{"error": {{"message": "{msg}"}}}}'.encode())
+
+        window = Window(col, row, width, height)
+        data = server.array[(slice(None), *window.toslices())]
+        profile = {
+            "driver": "GTiff",
+            "count": data.shape[0],
+            "height": height,
+            "width": width,
+            "dtype": data.dtype,
+            "crs": server.profile["crs"],
+            "transform": window_transform(window, server.profile["transform"]),
+        }
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as dst:
+                dst.write(data)
+            body = memfile.read()
+
+        self.send(200, body, "image/tiff")
+
+    def log_message(self, *args):
+        pass
+
+
+def check_direct(bounds=(0, 0, 0.5, 0.4), max_bytes=2**20, workers=4):
+    """Download a synthetic grid from the fake pixel urls and check the results
+
+    Returns:
+        (dict): the duration (s) of the downloads
+    """
+
+    # the default limit keeps the tiles of the layers under the getDownloadURL limit
+    for count, dtype in [(1, np.uint8), (4, np.uint8), (3, np.int16), (2, np.float32)]:
+        profile = aoi_profile((0, 0, 10, 10), 30, count, dtype)
+        size = max(w.width * w.height for w in tile_grid(profile))
+        assert size * count * np.dtype(dtype).itemsize <= ee_request_bytes
+
+    rng = np.random.default_rng(0)
+    profile = aoi_profile(bounds, 30, 3, np.int16)
+    array = rng.integers(1, 2**15, (3, profile["height"], profile["width"]), np.int16)
+    windows = tile_grid(profile, max_bytes)
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as d:
+        tmp_dir = Path(d)
+
+        # the mosaic of the tiles
+        with FakePixels(array, profile, max_bytes) as server:
+            start = time.perf_counter()
+            dst = download_direct(
+                server.tile_url, profile, tmp_dir / "mosaic.tif", workers, 1, max_bytes
+            )
+            timings[f"{len(windows)} tiles"] = time.perf_counter() - start
+
+            assert sorted(server.requests) == sorted(
+                (w.col_off, w.row_off, w.width, w.height) for w in windows
+            ), "the requests are not the tiles of the grid"
+        with rio.open(dst) as src:
+            assert np.array_equal(src.read(), array), "the mosaic is corrupted"
+
+        # a tile failing twice before answering
+        failing = (windows[1].col_off, windows[1].row_off)
+        with FakePixels(array, profile, max_bytes, {failing: 2}) as server:
+            start = time.perf_counter()
+            dst = download_direct(
+                server.tile_url, profile, tmp_dir / "retry.tif", workers, 3, max_bytes
+            )
+            timings["2 retries"] = time.perf_counter() - start
+
+            attempts = [r for r in server.requests if r[:2] == failing]
+            assert (
+                len(attempts) == 3
+            ), f"the failing tile was requested {len(attempts)} times"
+            assert timings["2 retries"] >= 1 + 2, "the retries did not back off"
+        with rio.open(dst) as src:
+            assert np.array_equal(src.read(), array), "the retried mosaic is corrupted"
+
+        # tiles larger than the limit of the server
+        with FakePixels(array, profile, max_bytes) as server:
+            try:
+                download_direct(
+                    server.tile_url,
+                    profile,
+                    tmp_dir / "large.tif",
+                    workers,
+                    1,
+                    4 * max_bytes,
+                )
+            except Exception as e:
+                print(f"oversized request raised: {e}")
+            else:
+                raise AssertionError("the oversized requests did not raise")
+
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--width", type=float, default=0.5, help="AOI width (deg)")
+    parser.add_argument("--height", type=float, default=0.4, help="AOI height (deg)")
+    parser.add_argument(
+        "--max-bytes", type=float, default=1, help="size limit of a request (MiB)"
+    )
+    parser.add_argument("--workers", type=int, default=pm.direct_workers)
+    args = parser.parse_args(argv)
+
+    bounds = (0, 0, args.width, args.height)
+    timings = check_direct(bounds, int(args.max_bytes * 2**20), args.workers)
+
+    print("tiled, retried and oversized direct downloads are correct")
+    for name, duration in timings.items():
+        print(f"{name}: {duration:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Local stand-in of the few Google Drive API endpoints used by GDrive
+
+Point GDrive(api_endpoint=server.url) at a running FakeDrive to use it.
+"""
+
+import re
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeDrive(ThreadingHTTPServer):
+    """Local server answering the Drive media, delete and batch requests
+
+    Args:
+        files (dict): the content of each file id
+        broken (list): the file ids whose connection is cut in the middle of the second chunk
+        latency (float): the time (s) waited before answering each http request, to emulate
+            the round trip to the Google servers
+    """
+
+    daemon_threads = True
+
+    def __init__(self, files, broken=(), latency=0):
+        super().__init__(("127.0.0.1", 0), DriveHandler)
+        self.files = files
+        self.broken = set(broken)
+        self.latency = latency
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/"
+
+    def record(self, *request):
+        with self.lock:
+            self.requests.append(request)
+
+    def delete(self, file_id):
+        """Delete a file and return the http status of the call"""
+
+        with self.lock:
+            return 204 if self.files.pop(file_id, None) is not None else 404
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class DriveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Serve the byte range of a file, the range header is set by MediaIoBaseDownload"""
+
+        time.sleep(self.server.latency)
+
+        match = re.search(r"/files/([^/?]+)\?.*alt=media", self.path)
+        content = self.server.files.get(match and match.group(1))
+        if content is None:
+            return self.send(404)
+
+        file_id = match.group(1)
+        start, end = 0, len(content) - 1
+        range_ = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("range", ""))
+        if range_:
+            start, end = int(range_.group(1)), min(int(range_.group(2)), end)
+        body = content[start : end + 1]
+        self.server.record("GET", file_id, start, end)
+
+        headers = {
+            "Content-Type": "image/tiff",
+            "Content-Range": f"bytes {start}-{end}/{len(content)}",
+        }
+
+        # cut the connection in the middle of the second chunk
+        if file_id in self.server.broken and start > 0:
+            self.send_response(206)
+            [self.send_header(name, value) for name, value in headers.items()]
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+
+        self.send(206 if range_ else 200, body, headers)
+
+    def do_DELETE(self):
+        """Delete a single file"""
+
+        time.sleep(self.server.latency)
+
+        file_id = self.path.split("?")[0].rsplit("/", 1)[-1]
+        self.server.record("DELETE", file_id)
+        self.send(self.server.delete(file_id))
+
+    def do_POST(self):
+        """Answer a multipart/mixed batch of delete calls in a single response"""
+
+        time.sleep(self.server.latency)
+
+        if not self.path.startswith("/batch/"):
+            return self.send(404)
+
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        message = BytesParser().parsebytes(header + body)
+        self.server.record("BATCH", len(message.get_payload()))
+
+        boundary = "fake_drive_batch"
+        parts = []
+        for part in message.get_payload():
+            method, path, _ = part.get_payload().splitlines()[0].split(" ", 2)
+            file_id = path.split("?")[0].rsplit("/", 1)[-1]
+            status = self.server.delete(file_id) if method == "DELETE" else 405
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:]}\r\n\r\n"
+                f"HTTP/1.1 {status} {self.responses[status][0]}\r\n"
+                "Content-Length: 0\r\n\r\n\r\n"
+            )
+        content = "".join(parts) + f"--{boundary}--\r\n"
+
+        headers = {"Content-Type": f"multipart/mixed; boundary={boundary}"}
+        self.send(200, content.encode(), headers)
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,83 @@
+"""Time the batched Drive deletes of GDrive against one call per file on a local fake Drive
+
+Usage:
+    python -m benchmark.gdrive_batch [--files 300] [--latency 0.05]
+
+A http.server answers the files/<id> delete calls and the multipart/mixed batch endpoint as
+Drive does, waiting --latency seconds before each http response to emulate the round trip to
+the Google servers. The script checks that:
+- delete_files sends one batch request per pm.drive_batch_size files,
+- all the files are deleted and the index no longer lists them,
+- a file that does not exist is returned in the errors and is the only one left in the index.
+"""
+
+import argparse
+import time
+
+from google.auth.credentials import AnonymousCredentials
+
+from component import parameter as pm
+from component.scripts.gdrive import GDrive
+from .fake_drive import FakeDrive
+
+
+def check_delete(n_files=300, latency=0.05):
+    """Delete files one call at a time and in batches from the fake endpoint
+
+    Returns:
+        (dict): the duration (s) of each way of deleting the files
+    """
+    names = [f"id{i}" for i in range(n_files)]
+    items = [{"id": id_, "name": f"{id_}.tif"} for id_ in names]
+
+    timings = {}
+    with FakeDrive({}, latency=latency) as server:
+        drive = GDrive(AnonymousCredentials(), api_endpoint=server.url)
+
+        # one call per file, as the files were deleted before the batches
+        server.files.update({id_: b"" for id_ in names})
+        start = time.perf_counter()
+        for item in items:
+            drive.service.files().delete(fileId=item["id"]).execute()
+        timings["one call per file"] = time.perf_counter() - start
+        assert not server.files, f"{len(server.files)} files are left"
+
+        # the batched deletes, with a missing file
+        server.files.update({id_: b"" for id_ in names})
+        server.requests.clear()
+        drive._index = [(item["name"], item["id"]) for item in items]
+        missing = {"id": "missing", "name": "missing.tif"}
+        drive._index.append((missing["name"], missing["id"]))
+
+        start = time.perf_counter()
+        errors = drive.delete_files(items + [missing])
+        timings["batched"] = time.perf_counter() - start
+
+        batches = [r for r in server.requests if r[0] == "BATCH"]
+        n_batches = -(-(n_files + 1) // min(pm.drive_batch_size, 100))
+        assert len(batches) == n_batches, f"{len(batches)} batch requests"
+        assert len(server.requests) == len(batches), "some calls are not batched"
+        assert not server.files, f"{len(server.files)} files are left"
+        assert list(errors) == ["missing"], f"unexpected errors {list(errors)}"
+        assert drive._index == [("missing.tif", "missing")], "the index is outdated"
+
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="delay of each response (s)"
+    )
+    args = parser.parse_args(argv)
+
+    timings = check_delete(args.files, args.latency)
+
+    print("batched deletes are correct")
+    for name, duration in timings.items():
+        print(f"{name}: {duration:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Check the Drive downloads of GDrive against a local fake of the Drive media endpoint
+
+Usage:
+    python -m benchmark.gdrive_download [--size 64] [--chunk 4] [--files 4]
+
+A http.server serves the files/<id>?alt=media requests with byte ranges as Drive does. The
+script checks that:
+- a file larger than the chunk size is streamed in several range requests and is identical,
+- several files are downloaded at the same time on the thread pool of download_files,
+- a download interrupted in the middle of a chunk raises and leaves neither the final file nor
+  the .part file.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from google.auth.credentials import AnonymousCredentials
+
+from component.scripts.gdrive import GDrive
+from .fake_drive import FakeDrive
+
+
+def check_download(size=64 * 2**20, chunk_size=4 * 2**20, n_files=4):
+    """Download random files from the fake endpoint and check the results
+
+    Returns:
+        (dict): the duration (s) of the single and threaded downloads
+    """
+    rng = np.random.default_rng(0)
+    files = {f"id{i}": rng.bytes(size) for i in range(n_files)}
+    files["cut"] = rng.bytes(size)
+    items = [{"id": id_, "name": f"{id_}.tif"} for id_ in files if id_ != "cut"]
+
+    timings = {}
+    with FakeDrive(files, broken=["cut"]) as server, tempfile.TemporaryDirectory() as d:
+        tmp_dir = Path(d)
+        drive = GDrive(AnonymousCredentials(), api_endpoint=server.url)
+
+        # a single file streamed in several chunks
+        start = time.perf_counter()
+        dst = drive.download_file(items[0], tmp_dir, chunk_size)
+        timings["1 file"] = time.perf_counter() - start
+
+        ranges = [r for r in server.requests if r[:2] == ("GET", items[0]["id"])]
+        assert dst.read_bytes() == files[items[0]["id"]], "the file is corrupted"
+        assert len(ranges) == -(-size // chunk_size), f"{len(ranges)} range requests"
+        assert not list(tmp_dir.glob(".*.part")), "a .part file is left"
+
+        # all the files on the thread pool
+        (tmp_dir / "pool").mkdir()
+        start = time.perf_counter()
+        dsts = drive.download_files(items, tmp_dir / "pool", chunk_size, n_files)
+        timings[f"{n_files} files"] = time.perf_counter() - start
+        for item, dst in zip(items, dsts):
+            assert dst.read_bytes() == files[item["id"]], f"{dst} is corrupted"
+
+        # an interrupted download
+        try:
+            drive.download_file({"id": "cut", "name": "cut.tif"}, tmp_dir, chunk_size)
+        except Exception as e:
+            print(f"interrupted download raised {type(e).__name__}")
+        else:
+            raise AssertionError("the interrupted download did not raise")
+        assert not (tmp_dir / "cut.tif").exists(), "the interrupted file is left"
+        assert not (tmp_dir / ".cut.tif.part").exists(), "the .part file is left"
+
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=64, help="file size (MiB)")
+    parser.add_argument("--chunk", type=int, default=4, help="chunk size (MiB)")
+    parser.add_argument("--files", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    timings = check_download(args.size * 2**20, args.chunk * 2**20, args.files)
+
+    print("chunked, threaded and interrupted downloads are correct")
+    for name, duration in timings.items():
+        print(f"{name}: {duration:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Compare the look up table combinations with the where() chains they replaced
+
+Usage:
+    python -m benchmark.lookup_table [--pixels 10000000]
+
+The where() chains of productivity_final, productivity_final_GPG1 and indicator_15_3_1 are
+replayed with NumPy, ee.Image(0).where(condition, value) being np.where(condition, value, image).
+The script checks that the remap lists of ee_combine and the dense tables of np_combine give the
+same classes on every combination of inputs, then times np_combine against the where() chain.
+"""
+
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from component.scripts.lookup_table import (
+    ee_lookup_tables,
+    indicator_15_3_1_local,
+    np_combine,
+    np_remap_table,
+)
+
+# the where() calls of productivity_final and productivity_final_GPG1, in their order
+# (trajectory, state, performance, value)
+where_gpgv2 = [
+    (1, 1, 1, 1),
+    (1, 1, 2, 1),
+    (1, 2, 1, 1),
+    (1, 2, 2, 2),
+    (1, 3, 1, 1),
+    (1, 3, 2, 1),
+    (2, 1, 1, 1),
+    (2, 1, 2, 2),
+    (2, 2, 1, 1),
+    (2, 2, 2, 2),
+    (2, 3, 1, 2),
+    (2, 3, 2, 2),
+    (3, 1, 1, 1),
+    (3, 1, 2, 3),
+    (3, 2, 1, 3),
+    (3, 2, 2, 3),
+    (3, 3, 1, 3),
+    (3, 3, 2, 3),
+]
+
+where_gpgv1 = [
+    (1, 1, 1, 1),
+    (1, 1, 2, 1),
+    (1, 2, 1, 1),
+    (1, 2, 2, 1),
+    (1, 3, 1, 1),
+    (1, 3, 2, 1),
+    (2, 1, 1, 1),
+    (2, 1, 2, 2),
+    (2, 2, 1, 2),
+    (2, 2, 2, 2),
+    (2, 3, 1, 2),
+    (2, 3, 2, 2),
+    (3, 1, 1, 1),
+    (3, 1, 2, 3),
+    (3, 2, 1, 3),
+    (3, 2, 2, 3),
+    (3, 3, 1, 3),
+    (3, 3, 2, 3),
+]
+
+# the where() calls of indicator_15_3_1 (productivity, land cover, soc, value), "lt1" stands
+# for .lt(1) in the last 3 conditions
+where_indicator = [
+    (3, 3, 3, 3),
+    (3, 3, 2, 3),
+    (3, 3, 1, 1),
+    (3, 2, 3, 3),
+    (3, 2, 2, 3),
+    (3, 2, 1, 1),
+    (3, 1, 3, 1),
+    (3, 1, 2, 1),
+    (3, 1, 1, 1),
+    (2, 3, 3, 3),
+    (2, 3, 2, 3),
+    (2, 3, 1, 1),
+    (2, 2, 3, 3),
+    (2, 2, 2, 2),
+    (2, 2, 1, 1),
+    (2, 1, 3, 1),
+    (2, 1, 2, 1),
+    (2, 1, 1, 1),
+    (1, 3, 3, 1),
+    (1, 3, 2, 1),
+    (1, 3, 1, 1),
+    (1, 2, 3, 1),
+    (1, 2, 2, 1),
+    (1, 2, 1, 1),
+    (1, 1, 3, 1),
+    (1, 1, 2, 1),
+    (1, 1, 1, 1),
+    (1, "lt1", "lt1", 1),
+    ("lt1", 1, "lt1", 1),
+    ("lt1", "lt1", 1, 1),
+]
+
+
+def condition(image, value):
+    """image.eq(value) or image.lt(1)"""
+
+    return image < 1 if value == "lt1" else image == value
+
+
+def where_chain(rules, a, b, c):
+    """Replay ee.Image(0).where(a.eq(x).And(b.eq(y)).And(c.eq(z)), value)... with NumPy"""
+
+    image = np.zeros(a.shape, dtype=np.uint8)
+    for x, y, z, value in rules:
+        mask = condition(a, x) & condition(b, y) & condition(c, z)
+        image = np.where(mask, value, image).astype(np.uint8)
+
+    return image
+
+
+def ee_combine_emulation(name, a, b, c):
+    """Replay ee_combine: a single remap of a*100 + b*10 + c with 0 as default"""
+
+    from_, to_ = ee_lookup_tables[name]
+    table = np_remap_table(from_, to_, size=1000)
+    code = a.astype(np.int64) * 100 + b.astype(np.int64) * 10 + c
+
+    return table[code]
+
+
+def check_equivalence():
+    """Compare the 3 implementations on every combination of classes 0 to 3
+
+    Returns:
+        (dict): the number of combinations checked by look up table
+    """
+    combinations = np.array(list(itertools.product(range(4), repeat=3)), np.uint8)
+    a, b, c = combinations.T
+    checked = {}
+
+    for name, rules in [("GPGv2", where_gpgv2), ("GPGv1", where_gpgv1)]:
+        # productivity_final(trajectory, performance, state) combines (trajectory, state,
+        # performance)
+        expected = where_chain(rules, a, b, c)
+        np.testing.assert_array_equal(np_combine(name, a, b, c), expected, name)
+        np.testing.assert_array_equal(
+            ee_combine_emulation(name, a, b, c), expected, name
+        )
+        checked[name] = len(combinations)
+
+    # the indicator, with and without water
+    for water in (np.zeros_like(a), np.ones_like(a)):
+        expected = np.where(water, 0, where_chain(where_indicator, a, b, c))
+        local = indicator_15_3_1_local(a, b, c, water)
+        remote = np.where(water, 0, ee_combine_emulation("indicator", a, b, c))
+        np.testing.assert_array_equal(local, expected, "indicator")
+        np.testing.assert_array_equal(remote, expected, "indicator")
+    checked["indicator"] = 2 * len(combinations)
+
+    return checked
+
+
+def timeit(function, *args, repeat=3):
+    """Return the best time (s) of a few calls of a function"""
+
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - t0)
+
+    return min(times)
+
+
+def benchmark(pixels=10_000_000, seed=0):
+    """Time np_combine against the GPGv2 where() chain on random classes
+
+    Returns:
+        (dict): the best time (s) of each implementation
+    """
+    rng = np.random.default_rng(seed)
+    a, b, c = rng.integers(0, 4, (3, pixels), dtype=np.uint8)
+
+    return {
+        "where": timeit(where_chain, where_gpgv2, a, b, c),
+        "look up table": timeit(np_combine, "GPGv2", a, b, c),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pixels", type=int, default=10_000_000)
+    args = parser.parse_args(argv)
+
+    for name, count in check_equivalence().items():
+        print(f"{name}: {count} combinations identical to the where() chain")
+
+    for name, duration in benchmark(args.pixels).items():
+        print(f"{name}: {duration:.3f} s for {args.pixels} pixels")
+
+
+if __name__ == "__main__":
+    main()
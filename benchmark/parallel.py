@@ -0,0 +1,81 @@
+"""Time the local productivity trajectory of a synthetic stack with different process pool sizes
+
+Usage:
+    python -m benchmark.parallel [--years 20] [--size 2048] [--workers 1 2 4 8]
+
+The stack is split in 64 blocks so that every worker gets several of them. The script checks
+that every pool size gives the same bands as a single process, then prints the time of each pool
+size and its speedup over the first one (a single process by default). The speedup is bounded by
+the number of cores of the machine, printed first.
+"""
+
+import argparse
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from component.scripts.local_productivity import (
+    productivity_trajectory_local,
+    trend_bytes_per_pixel,
+)
+
+
+def benchmark_scaling(
+    shape=(20, 2048, 2048), workers=(1, 2, 4, 8), trajectory="ndvi_trend"
+):
+    """Time the local productivity trajectory of a synthetic stack with different pool sizes
+
+    Args:
+        shape (tuple): the (years, rows, cols) shape of the synthetic stack
+        workers (list): the numbers of processes to test
+        trajectory (str): the trajectory method
+
+    Returns:
+        (dict): the elapsed seconds for each number of processes
+    """
+    model = SimpleNamespace(trajectory=trajectory)
+    climate = trajectory != "ndvi_trend"
+
+    rng = np.random.default_rng(0)
+    vi_stack = rng.random(shape, dtype=np.float32)
+    clim_stack = rng.random(shape, dtype=np.float32) * 1000 if climate else None
+
+    # 64 blocks so that every worker gets several of them
+    bytes_per_pixel = trend_bytes_per_pixel(shape[0], climate)
+    memory_budget = shape[1] * shape[2] // 64 * bytes_per_pixel
+
+    timings, expected = {}, None
+    for nb in workers:
+        start = time.perf_counter()
+        bands = productivity_trajectory_local(
+            model, vi_stack, clim_stack, workers=nb, memory_budget=memory_budget
+        )
+        timings[nb] = time.perf_counter() - start
+
+        expected = bands if expected is None else expected
+        assert np.array_equal(bands, expected), f"{nb} workers changed the bands"
+
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--size", type=int, default=2048, help="side of the grid (px)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--trajectory", default="ndvi_trend")
+    args = parser.parse_args(argv)
+
+    shape = (args.years, args.size, args.size)
+    timings = benchmark_scaling(shape, args.workers, args.trajectory)
+
+    print(f"{len(os.sched_getaffinity(0))} cores available")
+    reference = timings[args.workers[0]]
+    for nb, duration in timings.items():
+        print(f"{nb} workers: {duration:.2f} s, speedup {reference / duration:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
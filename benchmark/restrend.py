@@ -0,0 +1,151 @@
+"""Compare the local RESTREND engine with an emulation of the GEE restrend on synthetic stacks
+
+Usage:
+    python -m benchmark.restrend [--years 20] [--size 60]
+
+The GEE restrend is replayed pixel by pixel with the semantics of its reducers:
+- ee.Reducer.linearFit fits vi = offset + scale * clim by least squares on the years where
+  both bands are unmasked (np.polyfit here),
+- the residuals are the observed VI minus offset + scale * clim, masked where a band is masked,
+- ee.Reducer.kendallsCorrelation(2) computes the Kendall tau-b of the (year, residual) pairs,
+  counted pair by pair here, and the tau is multiplied by pm.z_coefficient(years).
+The script checks that restrend_local and an appended TrendState give the same z-scores within
+tolerance, then times restrend_local against the per-pixel emulation.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from component import parameter as pm
+from component.scripts.local_productivity import TrendState, restrend_local
+
+
+def kendall_tau_b(values):
+    """Return the Kendall tau-b of the (year, value) pairs of a series, NaN values left out"""
+
+    values = values[~np.isnan(values)]
+    concordant = discordant = tied = 0
+    for i in range(len(values)):
+        for j in range(i + 1, len(values)):
+            diff = values[j] - values[i]
+            concordant += diff > 0
+            discordant += diff < 0
+            tied += diff == 0
+
+    # the years are never tied
+    n_pairs = len(values) * (len(values) - 1) / 2
+    if n_pairs == 0 or n_pairs == tied:
+        return np.nan
+
+    return (concordant - discordant) / np.sqrt(n_pairs * (n_pairs - tied))
+
+
+def restrend_emulation(vi_stack, clim_stack):
+    """Replay the GEE restrend on every pixel of local stacks
+
+    Returns:
+        (np.ndarray): the float64 z-score of each pixel
+    """
+    n_years, rows, cols = vi_stack.shape
+    z_score = np.full((rows, cols), np.nan)
+
+    for row in range(rows):
+        for col in range(cols):
+            vi = vi_stack[:, row, col].astype(np.float64)
+            clim = clim_stack[:, row, col].astype(np.float64)
+
+            # linearFit only uses the years where both bands are unmasked
+            valid = ~(np.isnan(vi) | np.isnan(clim))
+            if np.count_nonzero(valid) < 2 or np.ptp(clim[valid]) == 0:
+                continue
+            scale, offset = np.polyfit(clim[valid], vi[valid], 1)
+
+            residuals = vi - (offset + scale * clim)
+            tau = kendall_tau_b(residuals)
+            z_score[row, col] = tau * pm.z_coefficient(n_years)
+
+    return z_score
+
+
+def synthetic_stacks(years=20, size=60, seed=0):
+    """Return VI and climate stacks with a climate response, a trend, noise and missing years"""
+
+    rng = np.random.default_rng(seed)
+    shape = (years, size, size)
+
+    clim = rng.uniform(200, 1200, shape)
+    response = rng.uniform(0, 1e-3, shape[1:])
+    trend = rng.normal(0, 5e-3, shape[1:]) * np.arange(years)[:, None, None]
+    vi = 0.2 + response * clim + trend + rng.normal(0, 0.02, shape)
+
+    vi[rng.random(shape) < 0.05] = np.nan
+    clim[rng.random(shape) < 0.05] = np.nan
+
+    return vi.astype(np.float32), clim.astype(np.float32)
+
+
+def check_equivalence(years=20, size=60, atol=1e-4):
+    """Compare the local z-scores with the emulation of the GEE restrend
+
+    Returns:
+        (dict): the largest absolute difference of each local computation
+    """
+    vi_stack, clim_stack = synthetic_stacks(years, size)
+    expected = restrend_emulation(vi_stack, clim_stack)
+
+    # the state is extended with the last years as in a new monitoring run
+    state = TrendState(pm.trajectories[1]["value"], 2000, (size, size))
+    state.update(vi_stack[: years // 2], clim_stack[: years // 2])
+    state.update(vi_stack, clim_stack)
+
+    results = {
+        "restrend_local": restrend_local(vi_stack, clim_stack),
+        "TrendState": state.z_score(),
+    }
+
+    differences = {}
+    for name, z_score in results.items():
+        assert np.array_equal(np.isnan(z_score), np.isnan(expected)), f"{name} mask"
+        differences[name] = np.nanmax(np.abs(z_score - expected))
+        assert differences[name] <= atol, f"{name} differs by {differences[name]}"
+
+    return differences
+
+
+def benchmark(years=20, size=60):
+    """Time restrend_local against the per-pixel emulation
+
+    Returns:
+        (dict): the time (s) of each implementation
+    """
+    vi_stack, clim_stack = synthetic_stacks(years, size, seed=1)
+    timings = {}
+
+    for name, function in [
+        ("restrend_local", restrend_local),
+        ("per-pixel emulation", restrend_emulation),
+    ]:
+        start = time.perf_counter()
+        function(vi_stack, clim_stack)
+        timings[name] = time.perf_counter() - start
+
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--size", type=int, default=60, help="side of the grid (px)")
+    args = parser.parse_args(argv)
+
+    for name, difference in check_equivalence(args.years, args.size).items():
+        print(f"{name}: z-scores within {difference:.1e} of the GEE emulation")
+
+    for name, duration in benchmark(args.years, args.size).items():
+        print(f"{name}: {duration:.3f} s for {args.size}x{args.size} pixels")
+
+
+if __name__ == "__main__":
+    main()
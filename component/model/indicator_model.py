@@ -30,6 +30,8 @@ class IndicatorModel(model.Model):
     ## Soil organic carbon
     soc_t_start = Any(None).tag(sync=True)
     soc_t_end = Any(None).tag(sync=True)
+    # asset of a previous soc state to resume from (see export_soc_checkpoint)
+    soc_checkpoint = Any(None).tag(sync=True)
 
     # sensors
     sensors = Any(None).tag(sync=True)
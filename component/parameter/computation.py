@@ -8,3 +8,30 @@ int_16_min = np.iinfo(np.int16).min
 def z_coefficient(n):
     z = (3 * sqrt(n * (n - 1))) / (sqrt(2 * (2 * n + 5)))
     return z
+
+
+# memory budget (in bytes) of a single block in the local engines
+local_memory_budget = 256 * 2**20
+
+# number of processes used by the local raster processing of the interface, the app runs in
+# a shared kernel so the blocks are processed in the kernel itself by default
+local_workers = 1
+
+# size (in bytes) of the chunks streamed from Google Drive
+drive_chunk_size = 64 * 2**20
+
+# number of files downloaded at the same time from Google Drive
+drive_workers = 4
+
+# number of calls grouped in a Google Drive batch request (100 at most)
+drive_batch_size = 100
+
+# maximum number of bytes of a direct pixel request, getDownloadURL rejects the requests larger
+# than 32 MB (48 MB is the computePixels limit) so this value can't be raised
+direct_request_bytes = 32 * 2**20
+
+# number of direct pixel requests sent at the same time
+direct_workers = 8
+
+# number of attempts of a direct pixel request
+direct_retries = 5
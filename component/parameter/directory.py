@@ -10,3 +10,7 @@ result_dir = module_dir / "sdg_indicators" / "degraded_land"
 result_dir.mkdir(exist_ok=True, parents=True)
 
 utils_dir = Path(__file__).parents[2] / "utils"
+
+# memory-mapped annual stacks of the local runs
+stack_dir = module_dir / "sdg_indicators" / "stacks"
+stack_dir.mkdir(exist_ok=True, parents=True)
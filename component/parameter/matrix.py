@@ -468,3 +468,82 @@ input_factor = [
     1,
     1,
 ]
+
+# productivity look up tables
+# [trajectory, state, performance, productivity], any other combination is nodata (0)
+productivity_gpgv2_matrix = [
+    [1, 1, 1, 1],
+    [1, 1, 2, 1],
+    [1, 2, 1, 1],
+    [1, 2, 2, 2],
+    [1, 3, 1, 1],
+    [1, 3, 2, 1],
+    [2, 1, 1, 1],
+    [2, 1, 2, 2],
+    [2, 2, 1, 1],
+    [2, 2, 2, 2],
+    [2, 3, 1, 2],
+    [2, 3, 2, 2],
+    [3, 1, 1, 1],
+    [3, 1, 2, 3],
+    [3, 2, 1, 3],
+    [3, 2, 2, 3],
+    [3, 3, 1, 3],
+    [3, 3, 2, 3],
+]
+
+productivity_gpgv1_matrix = [
+    [1, 1, 1, 1],
+    [1, 1, 2, 1],
+    [1, 2, 1, 1],
+    [1, 2, 2, 1],
+    [1, 3, 1, 1],
+    [1, 3, 2, 1],
+    [2, 1, 1, 1],
+    [2, 1, 2, 2],
+    [2, 2, 1, 2],
+    [2, 2, 2, 2],
+    [2, 3, 1, 2],
+    [2, 3, 2, 2],
+    [3, 1, 1, 1],
+    [3, 1, 2, 3],
+    [3, 2, 1, 3],
+    [3, 2, 2, 3],
+    [3, 3, 1, 3],
+    [3, 3, 2, 3],
+]
+
+# one out all out rule
+# [productivity, land cover, soc, indicator], any other combination is nodata (0)
+indicator_matrix = [
+    [3, 3, 3, 3],
+    [3, 3, 2, 3],
+    [3, 3, 1, 1],
+    [3, 2, 3, 3],
+    [3, 2, 2, 3],
+    [3, 2, 1, 1],
+    [3, 1, 3, 1],
+    [3, 1, 2, 1],
+    [3, 1, 1, 1],
+    [2, 3, 3, 3],
+    [2, 3, 2, 3],
+    [2, 3, 1, 1],
+    [2, 2, 3, 3],
+    [2, 2, 2, 2],
+    [2, 2, 1, 1],
+    [2, 1, 3, 1],
+    [2, 1, 2, 1],
+    [2, 1, 1, 1],
+    [1, 3, 3, 1],
+    [1, 3, 2, 1],
+    [1, 3, 1, 1],
+    [1, 2, 3, 1],
+    [1, 2, 2, 1],
+    [1, 2, 1, 1],
+    [1, 1, 3, 1],
+    [1, 1, 2, 1],
+    [1, 1, 1, 1],
+    [1, 0, 0, 1],
+    [0, 1, 0, 1],
+    [0, 0, 1, 1],
+]
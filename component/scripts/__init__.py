@@ -2,3 +2,4 @@ from .run_15_3_1 import *
 from .sankey import *
 from .bar_plot import *
 from .download import export_legend
+from .sweep import parameter_sweep
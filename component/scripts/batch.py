@@ -0,0 +1,314 @@
+"""Headless batch run of the 15.3.1 indicator over many AOIs
+
+Usage:
+    python -m component.scripts.batch config.json [--workers 4] [--manifest manifest.json]
+
+The config is a json file:
+    {
+        "workers": 4,
+        "download": true,
+        "stacked": false,
+        "packed": false,
+        "direct": false,
+        "parameters": {
+            "start": 2015, "end": 2019, "sensors": ["Landsat 8"], "conversion_coef": 0.8, ...
+        },
+        "aois": [
+            {"admin": "959"},
+            {"asset": "users/me/aoi", "parameters": {"lceu": "aez"}}
+        ]
+    }
+
+"parameters" are the IndicatorModel traits of every AOI, they can be overwritten in each AOI. They
+are validated as in the interface before the computation (see check_parameters).
+The other keys of an AOI are the arguments of sepal_ui.aoi.AoiModel.
+"""
+
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import ee
+from sepal_ui import aoi
+from sepal_ui.scripts import utils as su
+
+from component import parameter as pm
+from component.message import cm
+from component.model import IndicatorModel
+
+from .run_15_3_1 import (
+    compute_indicator_maps,
+    compute_lc_transition_stats,
+    compute_stats_by_lc,
+    custom_lc_values,
+    download_maps,
+    indicator_graph,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LogOutput:
+    """Replacement of the sepal_ui Alert writing the messages in a logger
+
+    Args:
+        name (str): the prefix of the messages, usually the AOI
+    """
+
+    levels = {
+        "success": logging.INFO,
+        "warning": logging.WARNING,
+        "error": logging.ERROR,
+    }
+
+    def __init__(self, name):
+        self.name = name
+
+    def add_live_msg(self, msg, type_="info"):
+        logger.log(self.levels.get(type_, logging.INFO), f"{self.name}: {msg}")
+
+        return self
+
+    def add_msg(self, msg, type_="info"):
+        return self.add_live_msg(msg, type_)
+
+
+def check_parameters(aoi_model, model):
+    """Raise an error if the parameters are not valid
+
+    The same checks as the interface (see InputTile.start_process), the climate regime
+    coefficient is also required as the results folder is named after it.
+    """
+
+    checks = [
+        (aoi_model.name, cm.error.no_aoi),
+        (model.start, cm.error.no_start),
+        (model.end, cm.error.no_end),
+        (model.vegetation_index, cm.error.no_vi),
+        (model.trajectory, cm.error.no_traj),
+        (model.lceu, cm.error.no_lceu),
+        (model.sensors, cm.error.no_sensors),
+        (model.conversion_coef, cm.error.no_conversion_coef),
+    ]
+    for value, msg in checks:
+        if not value:
+            raise Exception(msg)
+
+    # the custom land covers need to be different
+    if (model.start_lc or model.end_lc) and model.start_lc == model.end_lc:
+        raise Exception(cm.select_lc.diff_land_cover)
+
+    # the pixel values of the land covers need to be in the transition matrix, all of them if
+    # lc_pixel_check is set
+    if model.start_lc and model.end_lc:
+        start_values = set(custom_lc_values(model.start_lc))
+        end_values = set(custom_lc_values(model.end_lc))
+        start_codes, end_codes = set(model.lc_codelist_start), set(
+            model.lc_codelist_end
+        )
+
+        if model.lc_pixel_check:
+            if start_values != start_codes or end_values != end_codes:
+                raise Exception(cm.select_lc.not_proper_code)
+        elif not (start_values <= start_codes and end_values <= end_codes):
+            raise Exception(cm.select_lc.not_proper_code_subset)
+
+    # the custom transition matrix needs proper codes and classes
+    if model.start_lc and model.end_lc and model.custom_matrix_file:
+        checks = [
+            (
+                10 <= min(model.lc_codelist_start)
+                and max(model.lc_codelist_start) <= 99,
+                cm.select_lc.min_max_error,
+            ),
+            (
+                {1, 0, -1} == set(model.trans_matrix_flatten),
+                cm.select_lc.transition_code_error,
+            ),
+            (
+                set(model.lc_classlist_start) == set(model.lc_classlist_end),
+                cm.select_lc.lc_class_mismatch,
+            ),
+        ]
+        for value, msg in checks:
+            if not value:
+                raise Exception(msg)
+
+    return model
+
+
+def run_aoi(
+    aoi_params, parameters, download=True, stacked=False, packed=False, direct=False
+):
+    """Compute the maps, the stats and optionally download the maps of a single AOI
+
+    Args:
+        aoi_params (dict): the arguments of AoiModel
+        parameters (dict): the IndicatorModel traits
+        download (bool): whether to export and download the maps
+        stacked (bool): export the maps in a single stacked image (see download_maps)
+        packed (bool): export the core layers in a single packed layer (see download_maps)
+        direct (bool): download the pixels without the Gdrive (see download_maps)
+
+    Returns:
+        (dict): the name, status, timing (s) of each step and outputs of the AOI
+    """
+    record = {"aoi": aoi_params, "status": "running", "timing": {}, "outputs": []}
+    start = time.perf_counter()
+
+    def step(name, function, *args):
+        t0 = time.perf_counter()
+        result = function(*args)
+        record["timing"][name] = round(time.perf_counter() - t0, 3)
+        return result
+
+    try:
+        aoi_model = step("aoi", lambda: aoi.AoiModel(**aoi_params))
+        record["name"] = aoi_model.name
+        output = LogOutput(aoi_model.name)
+
+        model = IndicatorModel()
+        [setattr(model, name, value) for name, value in parameters.items()]
+        check_parameters(aoi_model, model)
+
+        # a graph per AOI as the runs are concurrent
+        step(
+            "maps", compute_indicator_maps, aoi_model, model, output, indicator_graph()
+        )
+
+        # save the stats next to the maps of the interactive app
+        result_dir = pm.result_dir / su.normalize_str(aoi_model.name)
+        result_dir = result_dir / model.folder_name()
+        result_dir.mkdir(parents=True, exist_ok=True)
+        pattern = result_dir / f"{aoi_model.name}_{model.folder_name()}"
+
+        transition = step(
+            "transition_stats", compute_lc_transition_stats, aoi_model, model
+        )
+        by_lc = step("lc_stats", compute_stats_by_lc, aoi_model, model)
+        transition_file = Path(f"{pattern}_lc_transition.csv")
+        by_lc_file = Path(f"{pattern}_area_by_lc.csv")
+        transition.to_csv(transition_file, index=False)
+        by_lc.to_csv(by_lc_file, index=False)
+        record["outputs"] += [str(transition_file), str(by_lc_file)]
+
+        if download:
+            files = step(
+                "download",
+                download_maps,
+                aoi_model,
+                model,
+                output,
+                stacked,
+                packed,
+                direct,
+            )
+            record["outputs"] += [str(f) for f in files]
+
+        record["status"] = "done"
+
+    except Exception as e:
+        logger.exception(f"{aoi_params} failed")
+        record["status"] = "error"
+        record["error"] = str(e)
+
+    record["duration"] = round(time.perf_counter() - start, 3)
+
+    return record
+
+
+def write_manifest(manifest, file):
+    """Write the manifest at once so that a reader never sees a partial file"""
+
+    tmp_file = file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(manifest, indent=2, default=str))
+    tmp_file.replace(file)
+
+    return file
+
+
+def run_batch(config, manifest_file, workers=None):
+    """Run the indicator over all the AOIs of a config with a bounded pool of threads
+
+    The Earth Engine and Drive requests are IO bound so the AOIs are run in threads. The manifest
+    is rewritten each time an AOI is finished.
+
+    Args:
+        config (dict): the batch config (see the module documentation)
+        manifest_file (pathlib.Path): the json file recording the status of each AOI
+        workers (int, optional): the number of AOIs run at the same time, overwrites the config
+
+    Returns:
+        (dict): the manifest
+    """
+    workers = workers or config.get("workers", 1)
+    download = config.get("download", True)
+    stacked = config.get("stacked", False)
+    packed = config.get("packed", False)
+    direct = config.get("direct", False)
+    aois = config["aois"]
+
+    manifest = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "workers": workers,
+        "aois": [{"aoi": a, "status": "pending"} for a in aois],
+    }
+    write_manifest(manifest, manifest_file)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for i, aoi_config in enumerate(aois):
+            aoi_params = {k: v for k, v in aoi_config.items() if k != "parameters"}
+            parameters = {**config.get("parameters", {})}
+            parameters.update(aoi_config.get("parameters", {}))
+            future = executor.submit(
+                run_aoi, aoi_params, parameters, download, stacked, packed, direct
+            )
+            futures[future] = i
+
+        for future in as_completed(futures):
+            manifest["aois"][futures[future]] = future.result()
+            write_manifest(manifest, manifest_file)
+
+    manifest["finished"] = datetime.now().isoformat(timespec="seconds")
+    write_manifest(manifest, manifest_file)
+
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compute the SDG 15.3.1 indicator over a list of AOIs"
+    )
+    parser.add_argument("config", type=Path, help="the json config file")
+    parser.add_argument("--workers", type=int, help="the number of AOIs run at once")
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        help="the json file recording the status of each AOI",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    ee.Initialize()
+
+    config = json.loads(args.config.read_text())
+    manifest_file = args.manifest or args.config.with_name(
+        f"{args.config.stem}_manifest.json"
+    )
+    manifest = run_batch(config, manifest_file, args.workers)
+
+    failed = [a for a in manifest["aois"] if a["status"] != "done"]
+    logger.info(
+        f"{len(manifest['aois']) - len(failed)} AOIs done, {len(failed)} failed"
+    )
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,180 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from math import floor, sqrt
+from urllib.request import urlopen
+
+import numpy as np
+import rasterio as rio
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+
+from component import parameter as pm
+from .windowed import output_profile, tile_size
+
+# size of a degree at the equator (m), used to convert the export scale in EPSG:4326
+degree = 111319.49079327357
+
+
+def aoi_profile(bounds, scale, count=1, dtype=np.uint8):
+    """Return the EPSG:4326 grid covering some bounds at the export scale
+
+    Args:
+        bounds (list): the (minx, miny, maxx, maxy) bounds in EPSG:4326
+        scale (float): the resolution in meters
+        count (int): the number of bands
+        dtype (np.dtype): the type of the bands
+
+    Returns:
+        (dict): the rasterio profile of the grid
+    """
+    minx, miny, maxx, maxy = bounds
+    res = scale / degree
+
+    # round before ceil so that the floating point errors don't add a pixel
+    return {
+        "driver": "GTiff",
+        "width": max(1, int(np.ceil(round((maxx - minx) / res, 6)))),
+        "height": max(1, int(np.ceil(round((maxy - miny) / res, 6)))),
+        "count": count,
+        "dtype": dtype,
+        "crs": rio.crs.CRS.from_epsg(4326),
+        "transform": rio.Affine(res, 0, minx, 0, -res, maxy),
+    }
+
+
+def tile_grid(profile, max_bytes=pm.direct_request_bytes):
+    """Split a grid in square tiles small enough for a single pixel request
+
+    The tiles are multiples of the internal tiles of the output so each request fills
+    complete blocks of the GeoTIFF.
+
+    Args:
+        profile (dict): the rasterio profile of the grid
+        max_bytes (int): the maximum number of bytes of a request
+
+    Returns:
+        (list): the windows of the tiles, row by row
+    """
+    pixel_bytes = profile["count"] * np.dtype(profile["dtype"]).itemsize
+    size = floor(sqrt(max_bytes / pixel_bytes))
+    size = max(tile_size, size - size % tile_size)
+
+    rows, cols = profile["height"], profile["width"]
+
+    return [
+        Window(col, row, min(size, cols - col), min(size, rows - row))
+        for row in range(0, rows, size)
+        for col in range(0, cols, size)
+    ]
+
+
+def ee_tile_url(image, profile, window):
+    """Return the url of the pixels of a window of the grid as a GeoTIFF
+
+    Args:
+        image (ee.Image): the image to download
+        profile (dict): the rasterio profile of the grid
+        window (Window): the tile
+
+    Returns:
+        (str): the download url
+    """
+    transform = window_transform(window, profile["transform"])
+
+    return image.getDownloadURL(
+        {
+            "format": "GEO_TIFF",
+            "crs": profile["crs"].to_string(),
+            "crs_transform": list(transform)[:6],
+            "dimensions": f"{int(window.width)}x{int(window.height)}",
+        }
+    )
+
+
+def fetch_tile(url_function, window, retries=pm.direct_retries, timeout=300):
+    """Download and decode a tile, retrying with an exponential backoff
+
+    Args:
+        url_function (callable): return the url of a window
+        window (Window): the tile
+        retries (int): the number of attempts
+        timeout (float): the timeout of a single request (s)
+
+    Returns:
+        (tuple): the window and the (bands, rows, cols) array of the tile
+    """
+    for attempt in range(retries):
+        try:
+            with urlopen(url_function(window), timeout=timeout) as response:
+                content = response.read()
+
+            with MemoryFile(content) as memfile, memfile.open() as src:
+                data = src.read()
+
+            if data.shape[1:] != (window.height, window.width):
+                raise Exception(f"The tile {window} has a {data.shape} shape")
+
+            return window, data
+
+        except Exception as e:
+            if attempt == retries - 1:
+                raise Exception(f"The tile {window} failed {retries} times: {e}")
+            time.sleep(2**attempt)
+
+
+def download_direct(
+    url_function,
+    profile,
+    dst,
+    workers=pm.direct_workers,
+    retries=pm.direct_retries,
+    max_bytes=pm.direct_request_bytes,
+    nodata=0,
+    colormap=None,
+):
+    """Download a grid tile by tile with direct pixel requests, bypassing the Gdrive
+
+    The tiles are fetched on a pool of threads with a bounded number of tiles in flight and
+    written in their window of the output, in order, by this single writer.
+
+    Args:
+        url_function (callable): return the GeoTIFF url of a window of the grid, e.g.
+            functools.partial(ee_tile_url, image, profile)
+        profile (dict): the rasterio profile of the grid
+        dst (pathlib.Path): the output tiled GeoTIFF
+        workers (int): the number of requests at the same time
+        retries (int): the number of attempts of each tile
+        max_bytes (int): the maximum number of bytes of a request
+        nodata: the nodata value of the output
+        colormap (dict, optional): the colormap of the first band
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    windows = tile_grid(profile, max_bytes)
+    out_profile = output_profile(profile, profile["count"], profile["dtype"], nodata)
+
+    def write(future):
+        window, data = future.result()
+        dest.write(data.astype(out_profile["dtype"], copy=False), window=window)
+
+    with rio.open(dst, "w", **out_profile) as dest:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # keep a bounded number of tiles in flight
+            futures = deque()
+            for window in windows:
+                futures.append(
+                    executor.submit(fetch_tile, url_function, window, retries)
+                )
+                if len(futures) >= 2 * workers:
+                    write(futures.popleft())
+
+            while futures:
+                write(futures.popleft())
+
+        if colormap:
+            dest.write_colormap(1, colormap)
+
+    return dst
@@ -1,22 +1,32 @@
 import time
 
+import numpy as np
 import rasterio as rio
-from rasterio.merge import merge
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.windows import Window
 from matplotlib.colors import to_rgba
 from matplotlib import pyplot as plt
 
 from component.message import cm
 from component import parameter as pm
 from .gdrive import GDrive
+from .windowed import block_windows, output_profile, tile_size
 
 
-def digest_tiles(filename, result_dir, output, tmp_file):
-    if tmp_file.is_file():
-        output.add_live_msg(cm.download.file_exist.format(tmp_file), "warning")
-        time.sleep(2)
-        return
+def download_tiles(filename, result_dir, drive_handler=None):
+    """Download the tiles of an export from the Gdrive
+
+    Args:
+        filename (str): the prefix of the tiles
+        result_dir (pathlib.Path): the destination folder
+        drive_handler (GDrive, optional): the handler holding the listing of the Gdrive
 
-    drive_handler = GDrive()
+    Returns:
+        (list): the local tiles
+    """
+    # reuse the listing of the caller if any
+    drive_handler = drive_handler or GDrive()
     files = drive_handler.get_files(filename)
 
     # if no file, it means that the download had failed
@@ -27,25 +37,11 @@ def digest_tiles(filename, result_dir, output, tmp_file):
 
     pathname = f"{filename}*.tif"
 
-    files = [file for file in result_dir.glob(pathname)]
+    return [file for file in result_dir.glob(pathname)]
 
-    # run the merge process
-    output.add_live_msg(cm.download.merge_tile)
 
-    # manual open and close because I don't know how many file there are
-    sources = [rio.open(file) for file in files]
-
-    data, output_transform = merge(sources)
-
-    out_meta = sources[0].meta.copy()
-    out_meta.update(nodata=0)
-    out_meta.update(
-        driver="GTiff",
-        height=data.shape[1],
-        width=data.shape[2],
-        transform=output_transform,
-        compress="lzw",
-    )
+def legend_colormap():
+    """Return the colormap of the legend classes"""
 
     # create a colormap
     colormap = {}
@@ -53,12 +49,28 @@ def digest_tiles(filename, result_dir, output, tmp_file):
         color = tuple(int(c * 255) for c in to_rgba(color))
         colormap[i + 1] = color
 
-    with rio.open(tmp_file, "w", **out_meta) as dest:
-        dest.write(data)
-        dest.write_colormap(1, colormap)
+    return colormap
+
+
+def digest_tiles(
+    filename, result_dir, output, tmp_file, drive_handler=None, legend=True
+):
+    if tmp_file.is_file():
+        output.add_live_msg(cm.download.file_exist.format(tmp_file), "warning")
+        time.sleep(2)
+        return
+
+    files = download_tiles(filename, result_dir, drive_handler)
 
-    # manually close the files
-    [src.close() for src in sources]
+    # run the merge process
+    output.add_live_msg(cm.download.merge_tile)
+
+    # merge in a hidden file and write the final file as a COG
+    merged_file = tmp_file.with_name(f".{tmp_file.name}")
+    colormap = legend_colormap() if legend else None
+    merge_tiles(files, merged_file, nodata=0, colormap=colormap)
+    cloud_optimize(merged_file, tmp_file)
+    merged_file.unlink()
 
     # delete local files
     [file.unlink() for file in files]
@@ -66,6 +78,218 @@ def digest_tiles(filename, result_dir, output, tmp_file):
     return
 
 
+def digest_stack(filename, result_dir, output, manifest, dsts, drive_handler=None):
+    """Download the tiles of a stacked export and split them in a file per layer
+
+    Args:
+        filename (str): the prefix of the tiles
+        result_dir (pathlib.Path): the destination folder
+        output (Alert): the alert displaying the progress
+        manifest (dict): the band manifest of the stack (see split_stack)
+        dsts (dict): the output file of each layer
+        drive_handler (GDrive, optional): the handler holding the listing of the Gdrive
+    """
+    if all(dst.is_file() for dst in dsts.values()):
+        output.add_live_msg(cm.download.file_exist.format(result_dir), "warning")
+        return
+
+    files = download_tiles(filename, result_dir, drive_handler)
+
+    output.add_live_msg(cm.download.merge_tile)
+
+    stack_file = result_dir / f".{filename}_stack.tif"
+    merge_tiles(files, stack_file, nodata=0)
+    [file.unlink() for file in files]
+
+    split_stack(stack_file, manifest, dsts, legend_colormap())
+    stack_file.unlink()
+
+    return
+
+
+def split_stack(
+    stack_file, manifest, dsts, colormap=None, memory_budget=pm.local_memory_budget
+):
+    """Split a stacked raster in a Cloud-Optimized GeoTIFF per layer
+
+    The stack is read once, block by block, and every layer is written at the same time.
+
+    Args:
+        stack_file (pathlib.Path): the stacked raster
+        manifest (dict): the "bands" (list of band names), "dtype" and "legend" of each layer, in
+            the order of the stack
+        dsts (dict): the output file of each layer
+        colormap (dict, optional): the colormap of the first band of the layers whose "legend"
+            is set (all of them when the key is missing)
+        memory_budget (int): the maximum number of bytes read at once
+
+    Returns:
+        (dict): the dsts
+    """
+    # the band indexes of each layer in the stack
+    indexes, first = {}, 0
+    for name, layer in manifest.items():
+        indexes[name] = slice(first, first + len(layer["bands"]))
+        first += len(layer["bands"])
+
+    with rio.open(stack_file) as src:
+        if src.count != first:
+            raise Exception(
+                f"{stack_file} has {src.count} bands, the manifest describes {first}"
+            )
+
+        tmp_files = {name: dst.with_name(f".{dst.name}") for name, dst in dsts.items()}
+        bytes_per_pixel = src.count * np.dtype(src.dtypes[0]).itemsize * 2
+
+        dests = {}
+        try:
+            for name, tmp_file in tmp_files.items():
+                layer = manifest[name]
+                profile = output_profile(
+                    src.profile, len(layer["bands"]), layer["dtype"], 0
+                )
+                profile.update(predictor=2, num_threads="ALL_CPUS", bigtiff="IF_SAFER")
+                dests[name] = rio.open(tmp_file, "w", **profile)
+                dests[name].descriptions = tuple(layer["bands"])
+
+            for window in block_windows(src.shape, bytes_per_pixel, memory_budget):
+                data = src.read(window=window)
+                for name, dest in dests.items():
+                    dest.write(
+                        data[indexes[name]].astype(manifest[name]["dtype"]),
+                        window=window,
+                    )
+
+            if colormap:
+                for name, dest in dests.items():
+                    if manifest[name].get("legend", True):
+                        dest.write_colormap(1, colormap)
+
+        finally:
+            [dest.close() for dest in dests.values()]
+
+    for name, tmp_file in tmp_files.items():
+        cloud_optimize(tmp_file, dsts[name])
+        tmp_file.unlink()
+
+    return dsts
+
+
+def merge_tiles(
+    files, dst, nodata=0, colormap=None, memory_budget=pm.local_memory_budget
+):
+    """Merge tiles aligned on the same pixel grid in a tiled GeoTIFF, block by block
+
+    The output grid is built from the bounds of the tiles and each tile is copied into its
+    window by blocks of rows, so the memory used does not depend on the size of the mosaic.
+    The tiles are expected not to overlap, as the tiles of a GEE export.
+
+    Args:
+        files (list): the tiles
+        dst (pathlib.Path): the output file
+        nodata: the nodata value of the output, the areas without tiles are set to it
+        colormap (dict, optional): the colormap of the first band
+        memory_budget (int): the maximum number of bytes read at once
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    bounds = []
+    for file in files:
+        with rio.open(file) as src:
+            bounds.append(src.bounds)
+            profile, (xres, yres) = src.profile, src.res
+
+    left = min(b.left for b in bounds)
+    top = max(b.top for b in bounds)
+    right = max(b.right for b in bounds)
+    bottom = min(b.bottom for b in bounds)
+
+    profile = output_profile(profile, profile["count"], profile["dtype"], nodata)
+    profile.update(
+        width=int(round((right - left) / xres)),
+        height=int(round((top - bottom) / yres)),
+        transform=rio.Affine(xres, 0, left, 0, -yres, top),
+        predictor=2,
+        num_threads="ALL_CPUS",
+        bigtiff="IF_SAFER",
+    )
+    bytes_per_pixel = profile["count"] * np.dtype(profile["dtype"]).itemsize
+
+    with rio.open(dst, "w", **profile) as dest:
+        for file in files:
+            with rio.open(file) as src:
+                # the position of the tile in the mosaic
+                col_off = int(round((src.bounds.left - left) / xres))
+                row_off = int(round((top - src.bounds.top) / yres))
+
+                for window in block_windows(src.shape, bytes_per_pixel, memory_budget):
+                    dest.write(
+                        src.read(window=window),
+                        window=Window(
+                            col_off + window.col_off,
+                            row_off + window.row_off,
+                            window.width,
+                            window.height,
+                        ),
+                    )
+
+        if colormap:
+            dest.write_colormap(1, colormap)
+
+    return dst
+
+
+def overview_factors(shape, size=tile_size):
+    """Return the decimation factors until the overview fits in a single tile"""
+
+    factors, factor = [], 2
+    while max(shape) / (factor // 2) > size:
+        factors.append(factor)
+        factor *= 2
+
+    return factors
+
+
+def cloud_optimize(file, dst, resampling="mode"):
+    """Write a copy of a raster as a Cloud-Optimized GeoTIFF
+
+    The overviews are built in the source file with a categorical resampling and copied with
+    the data in the COG layout (tiled, overviews before the data). The colormap is kept.
+
+    Args:
+        file (pathlib.Path): the tiled raster, its overviews are (re)built
+        dst (pathlib.Path): the output file
+        resampling (str): the rasterio Resampling of the overviews, "mode" or "nearest" for
+            the class layers
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    with rio.open(file, "r+") as src:
+        src.build_overviews(overview_factors(src.shape), Resampling[resampling])
+        src.update_tags(ns="rio_overview", resampling=resampling)
+
+    # write the COG under a temporary name so that an interrupted copy is not used
+    tmp_file = dst.with_name(f".{dst.name}.part")
+    rio.shutil.copy(
+        file,
+        tmp_file,
+        driver="GTiff",
+        copy_src_overviews=True,
+        tiled=True,
+        blockxsize=tile_size,
+        blockysize=tile_size,
+        compress="lzw",
+        predictor=2,
+        num_threads="ALL_CPUS",
+        bigtiff="IF_SAFER",
+    )
+    tmp_file.replace(dst)
+
+    return dst
+
+
 def export_legend(filename, colors, title):
     """
     Create a color list and display it in a png image.
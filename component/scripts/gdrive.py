@@ -1,13 +1,17 @@
 import json
+import threading
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urljoin
 
 import ee
-import io
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.http import BatchHttpRequest, MediaIoBaseDownload
 from google.oauth2.credentials import Credentials
 
 from apiclient import discovery
 
+from component import parameter as pm
 from component.message import cm
 from .gee import search_task
 
@@ -17,18 +21,55 @@ logging.getLogger("googleapiclient.discovery_cache").setLevel(logging.ERROR)
 
 
 class GDrive:
-    def __init__(self):
-        # Access to sepal access token
-        self.access_token = json.loads(
-            (Path.home() / ".config/earthengine/credentials").read_text()
-        ).get("access_token")
-        self.service = discovery.build(
+    """Handler of the Google Drive of the user
+
+    Args:
+        credentials (google.auth.credentials.Credentials, optional): the credentials, the sepal
+            access token is used by default
+        api_endpoint (str, optional): the root url of the Drive API, e.g. a local test server
+    """
+
+    def __init__(self, credentials=None, api_endpoint=None):
+        if credentials is None:
+            # Access to sepal access token
+            self.access_token = json.loads(
+                (Path.home() / ".config/earthengine/credentials").read_text()
+            ).get("access_token")
+            credentials = Credentials(self.access_token)
+
+        self.credentials = credentials
+        self.client_options = {"api_endpoint": api_endpoint} if api_endpoint else None
+
+        # the batch url of the discovery document ignores the api endpoint
+        self.batch_uri = (
+            urljoin(api_endpoint, "batch/drive/v3") if api_endpoint else None
+        )
+        self.service = self.build_service()
+        self._local = threading.local()
+        self._index = None
+
+        # the id of the export tasks launched (or found running) by download_to_disk by description
+        self.task_ids = {}
+
+    def build_service(self):
+        """Create a Drive service, the services and their http client are not thread safe"""
+
+        return discovery.build(
             serviceName="drive",
             version="v3",
             cache_discovery=False,
-            credentials=Credentials(self.access_token),
+            credentials=self.credentials,
+            client_options=self.client_options,
         )
 
+    def thread_service(self):
+        """Return the Drive service of the current thread"""
+
+        if getattr(self._local, "service", None) is None:
+            self._local.service = self.build_service()
+
+        return self._local.service
+
     def tasks_list(self):
         """for debugging purpose, print the list of all the tasks in gee"""
         service = self.service
@@ -58,64 +99,192 @@ class GDrive:
                 print("{0} ({1})".format(item["name"], item["id"]))
 
     def get_items(self):
-        """get all the items in the Gdrive, items will have 2 columns, 'name' and 'id'"""
+        """get all the items in the Gdrive, items will have 2 columns, 'name' and 'id'
+
+        All the pages of the listing are requested.
+        """
         service = self.service
 
         # get list of files
-        results = (
-            service.files()
-            .list(
-                q="mimeType='image/tiff' and trashed = false",
-                pageSize=1000,
-                fields="nextPageToken, files(id, name)",
+        items, page_token = [], None
+        while True:
+            results = (
+                service.files()
+                .list(
+                    q="mimeType='image/tiff' and trashed = false",
+                    pageSize=1000,
+                    fields="nextPageToken, files(id, name)",
+                    pageToken=page_token,
+                )
+                .execute()
             )
-            .execute()
-        )
-        items = results.get("files", [])
+            items += results.get("files", [])
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
 
         return items
 
-    def get_files(self, file_name):
-        """look for the file_name patern in my Gdrive files and retreive a list of Ids"""
+    def refresh(self):
+        """List the Gdrive once and index the files by name
 
+        Call it when new files are expected, e.g. after the export tasks are completed.
+        """
         items = self.get_items()
+        self._index = sorted((item["name"], item["id"]) for item in items)
+
+        return self
+
+    def get_files(self, file_name):
+        """look for the files starting with file_name in the index and retreive their Ids
+
+        The Gdrive is listed on the first call only, see refresh.
+        """
+        if self._index is None:
+            self.refresh()
+
+        # the names sharing the prefix are contiguous in the sorted index
+        start = bisect_left(self._index, (file_name,))
         files = []
-        for item in items:
-            if file_name in item["name"]:
-                files.append({"id": item["id"], "name": item["name"]})
+        for name, id_ in self._index[start:]:
+            if not name.startswith(file_name):
+                break
+            files.append({"id": id_, "name": name})
 
         return files
 
-    def download_files(self, files, local_path):
-        """download the files from gdrive to the local_path"""
+    def download_file(self, file, local_path, chunk_size=pm.drive_chunk_size):
+        """Stream a file from gdrive to the local_path
+
+        The chunks are written to a temporary file which is renamed once complete, so an
+        interrupted download never leaves a partial file with the final name.
+
+        Args:
+            file (dict): the "id" and "name" of the file
+            local_path (pathlib.Path): the destination folder
+            chunk_size (int): the number of bytes requested at once
+
+        Returns:
+            (pathlib.Path): the downloaded file
+        """
+        dst = Path(local_path) / file["name"]
+        tmp_file = dst.with_name(f".{dst.name}.part")
+
+        request = self.thread_service().files().get_media(fileId=file["id"])
+        try:
+            with tmp_file.open("wb") as f:
+                downloader = MediaIoBaseDownload(f, request, chunksize=chunk_size)
+                done = False
+                while done is False:
+                    status, done = downloader.next_chunk(num_retries=3)
+            tmp_file.replace(dst)
+        except Exception:
+            tmp_file.unlink(missing_ok=True)
+            raise
+
+        return dst
+
+    def download_files(
+        self,
+        files,
+        local_path,
+        chunk_size=pm.drive_chunk_size,
+        workers=pm.drive_workers,
+    ):
+        """download the files from gdrive to the local_path
+
+        The files are streamed to the disk on a pool of threads, each with its own service.
 
-        # create path object
+        Args:
+            files (list): the "id" and "name" of each file
+            local_path (pathlib.Path): the destination folder
+            chunk_size (int): the number of bytes requested at once
+            workers (int): the number of files downloaded at the same time
+
+        Returns:
+            (list): the downloaded files
+        """
         local_path = Path(local_path)
 
-        # open the gdrive service
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [
+                executor.submit(self.download_file, file, local_path, chunk_size)
+                for file in files
+            ]
+            return [future.result() for future in futures]
+
+    def batch_execute(self, requests):
+        """Send requests in Drive batch requests of pm.drive_batch_size calls
+
+        Args:
+            requests (dict): the requests by id
+
+        Returns:
+            (tuple): the responses by id and the exceptions of the failed requests by id
+        """
+        responses, errors = {}, {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                responses[request_id] = response
+            else:
+                errors[request_id] = exception
+
+        items = list(requests.items())
+        size = min(pm.drive_batch_size, 100)
+        for i in range(0, len(items), size):
+            if self.batch_uri:
+                batch = BatchHttpRequest(callback=callback, batch_uri=self.batch_uri)
+            else:
+                batch = self.service.new_batch_http_request(callback=callback)
+            for request_id, request in items[i : i + size]:
+                batch.add(request, request_id=request_id)
+            batch.execute()
+
+        return responses, errors
+
+    def get_metadata(self, files, fields="id, name, size, md5Checksum"):
+        """Get the metadata of files in batch requests
+
+        Args:
+            files (list): the "id" and "name" of each file
+            fields (str): the requested fields
+
+        Returns:
+            (tuple): the metadata by id and the exceptions of the failed requests by id
+        """
         service = self.service
+        requests = {
+            file["id"]: service.files().get(fileId=file["id"], fields=fields)
+            for file in files
+        }
 
-        # request the files from gdrvie in chunks
-        for file in files:
-            request = service.files().get_media(fileId=file["id"])
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-            # write them in a local based file
-            with local_path.joinpath(file["name"]).open("wb") as f:
-                f.write(fh.getvalue())
+        return self.batch_execute(requests)
 
     def delete_files(self, files):
-        """delete files from gdrive disk"""
+        """delete files from gdrive disk
+
+        The files are deleted in batch requests.
+
+        Returns:
+            (dict): the exceptions of the files that could not be deleted by id
+        """
 
         # open gdrive service
         service = self.service
 
         # remove the files
-        for file in files:
-            service.files().delete(fileId=file["id"]).execute()
+        requests = {
+            file["id"]: service.files().delete(fileId=file["id"]) for file in files
+        }
+        _, errors = self.batch_execute(requests)
+
+        # keep the index up to date
+        if self._index is not None:
+            ids = {file["id"] for file in files} - set(errors)
+            self._index = [item for item in self._index if item[1] not in ids]
+
+        return errors
 
     def download_to_disk(self, filename, image, aoi_io, output, scale=30, prefix=None):
         """download the tile to the GEE disk
@@ -148,6 +317,7 @@ class GDrive:
 
                 task = ee.batch.Export.image.toDrive(**task_config)
                 task.start()
+                self.task_ids[filename] = task.id
                 download = True
             else:
                 output.add_live_msg(cm.gdrive.already_done.format(filename), "success")
@@ -160,6 +330,7 @@ class GDrive:
         else:
             if task.state == "RUNNING":
                 output.add_live_msg(f"{filename}: {task.state}")
+                self.task_ids[filename] = task.id
                 download = True
             else:
                 download = launch_task(filename, image, aoi_io, output, scale, prefix)
@@ -1,3 +1,4 @@
+import asyncio
 import time
 
 import ee
@@ -9,28 +10,196 @@ from component.message import cm
 STATUS = "Status : {0}"
 
 
-def wait_for_completion(task_descripsion, output):
+# the operation states in the ee.batch.Task vocabulary
+TASK_STATES = {
+    "PENDING": "READY",
+    "RUNNING": "RUNNING",
+    "CANCELLING": "CANCEL_REQUESTED",
+    "SUCCEEDED": "COMPLETED",
+    "FAILED": "FAILED",
+    "CANCELLED": "CANCELLED",
+}
+
+# the states of the tasks that will not change anymore
+FINISHED_STATES = ["COMPLETED", "FAILED", "CANCELLED"]
+
+
+def list_tasks():
+    """List the tasks of the user with a single request
+
+    Returns:
+        (list): the "id", "description", "state", "progress", "created" and "error" of each task,
+            the most recent first
+    """
+    tasks = []
+    for operation in ee.data.listOperations():
+        metadata = operation.get("metadata", {})
+        tasks.append(
+            {
+                "id": operation["name"].split("/")[-1],
+                "description": metadata.get("description"),
+                "state": TASK_STATES.get(metadata.get("state"), metadata.get("state")),
+                "progress": metadata.get("progress", 0),
+                "created": metadata.get("createTime", ""),
+                "error": operation.get("error", {}).get("message"),
+            }
+        )
+
+    return sorted(tasks, key=lambda t: t["created"], reverse=True)
+
+
+class TaskMonitor:
+    """Follow GEE tasks by id with a single task listing per poll
+
+    The delay between 2 polls grows when nothing changed and is reset when a task changes.
+
+    Args:
+        task_ids (list): the ids of the tasks
+        on_change (callable, optional): called with the task dict when a task changes
+        on_finish (callable, optional): called with the task dict when a task is finished
+        min_delay (float): the first delay between 2 polls (s)
+        max_delay (float): the maximum delay between 2 polls (s)
+        backoff (float): the growth of the delay between 2 polls without changes
+    """
+
+    def __init__(
+        self,
+        task_ids,
+        on_change=None,
+        on_finish=None,
+        min_delay=2,
+        max_delay=30,
+        backoff=1.5,
+    ):
+        self.tasks = {
+            id_: {"id": id_, "state": "UNSUBMITTED", "progress": 0} for id_ in task_ids
+        }
+        self.on_change = on_change
+        self.on_finish = on_finish
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.delay = min_delay
+
+    @classmethod
+    def from_descriptions(cls, descriptions, **kwargs):
+        """Follow the most recent task of each description"""
+
+        latest = {}
+        for task in list_tasks():
+            latest.setdefault(task["description"], task["id"])
+
+        missing = [d for d in descriptions if d not in latest]
+        if missing:
+            raise Exception(f"No task found for {missing}")
+
+        return cls([latest[d] for d in descriptions], **kwargs)
+
+    @property
+    def done(self):
+        """True when all the tasks are finished"""
+
+        return all(t["state"] in FINISHED_STATES for t in self.tasks.values())
+
+    @property
+    def states(self):
+        """The state of each task by id"""
+
+        return {id_: t["state"] for id_, t in self.tasks.items()}
+
+    def poll(self):
+        """Update the tasks from a single listing
+
+        Returns:
+            (list): the tasks that changed
+        """
+        changed = []
+        for task in list_tasks():
+            current = self.tasks.get(task["id"])
+            if current is None or current["state"] in FINISHED_STATES:
+                continue
+
+            if (task["state"], task["progress"]) == (
+                current["state"],
+                current["progress"],
+            ):
+                continue
+
+            current.update(task)
+            changed.append(current)
+            if self.on_change:
+                self.on_change(current)
+            if self.on_finish and current["state"] in FINISHED_STATES:
+                self.on_finish(current)
+
+        # poll faster while the tasks are moving
+        if changed:
+            self.delay = self.min_delay
+        else:
+            self.delay = min(self.delay * self.backoff, self.max_delay)
+
+        return changed
+
+    def wait(self):
+        """Poll until all the tasks are finished
+
+        Returns:
+            (dict): the final state of each task by id
+        """
+        while not self.done:
+            time.sleep(self.delay)
+            self.poll()
+
+        return self.states
+
+    async def wait_async(self):
+        """Poll until all the tasks are finished without blocking the event loop
+
+        Returns:
+            (dict): the final state of each task by id
+        """
+        loop = asyncio.get_running_loop()
+        while not self.done:
+            await asyncio.sleep(self.delay)
+            await loop.run_in_executor(None, self.poll)
+
+        return self.states
+
+
+def wait_for_completion(task_descripsion, output, task_ids=None, on_finish=None):
     """Wait until the selected process are finished. Display some output information
 
     Args:
-        task_descripsion ([str]) : name of the running tasks
+        task_descripsion ([str]) : name of the running tasks, the most recent task of each
+            description is followed
         widget_alert (v.Alert) : alert to display the output messages
+        task_ids ([str], optional): the ids of the tasks, used instead of the descriptions
+        on_finish (callable, optional): called with the task dict as soon as a task is finished
 
-    Returns: state (str) : final state
+    Returns: state (dict) : final state of each task by id
     """
-    state = "UNSUBMITTED"
-    while not (state == "COMPLETED" or state == "FAILED"):
-        output.add_live_msg(cm.gee.status.format(state))
-        time.sleep(5)
-
-        # search for the task in task_list
-        for task in task_descripsion:
-            current_task = search_task(task)
-            state = current_task.state
-            if state == "RUNNING":
-                break
-
-    return state
+
+    def display(task):
+        name = task.get("description") or task["id"]
+        state = f"{task['state']} {task['progress']:.0%}"
+        output.add_live_msg(cm.gee.status.format(f"{name}: {state}"))
+
+    if task_ids is None:
+        monitor = TaskMonitor.from_descriptions(
+            task_descripsion, on_change=display, on_finish=on_finish
+        )
+    else:
+        monitor = TaskMonitor(task_ids, on_change=display, on_finish=on_finish)
+
+    states = monitor.wait()
+
+    # report the tasks that did not complete
+    failed = [t for t in monitor.tasks.values() if t["state"] != "COMPLETED"]
+    if failed:
+        errors = [f"{t.get('description')}: {t.get('error')}" for t in failed]
+        raise Exception(cm.gee.failed.format(", ".join(errors)))
+
+    return states
 
 
 def search_task(task_descripsion):
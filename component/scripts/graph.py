@@ -0,0 +1,182 @@
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+
+
+def aoi_key(aoi_model):
+    """Return a hash of the geometry of an AOI
+
+    The name of the AOI is not enough: a new geometry can be drawn or uploaded under the same
+    name.
+
+    Args:
+        aoi_model (AoiModel): the AOI
+
+    Returns:
+        (str): the sha1 of the GeoJSON of the AOI
+    """
+    if aoi_model.gdf is not None:
+        geometry = aoi_model.gdf.to_json()
+    else:
+        geometry = aoi_model.feature_collection.serialize()
+
+    return hashlib.sha1(geometry.encode()).hexdigest()
+
+
+def file_key(file):
+    """Return a hash of the content of a file, None if there is no file
+
+    Args:
+        file (str|pathlib.Path): the path to the file
+
+    Returns:
+        (str): the sha1 of the file content
+    """
+    if not file or not Path(file).is_file():
+        return None
+
+    return hashlib.sha1(Path(file).read_bytes()).hexdigest()
+
+
+class Node:
+    """A named step of the indicator computation
+
+    Args:
+        name (str): the name of the node
+        function (callable): called with (aoi_model, model, output, *parent_results)
+        traits (list): the IndicatorModel traits read by the function
+        parents (list): the names of the nodes whose results are used by the function
+        aoi (bool): whether the function reads the AOI
+        files (list): the traits holding the path of a file read by the function
+        cache_size (int): the number of results kept for different parameters
+    """
+
+    def __init__(
+        self, name, function, traits=(), parents=(), aoi=False, files=(), cache_size=1
+    ):
+        self.name = name
+        self.function = function
+        self.traits = list(traits)
+        self.parents = list(parents)
+        self.aoi = aoi
+        self.files = list(files)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def key(self, aoi, model, parent_keys):
+        """Return the signature of the inputs of the node
+
+        The trait values are compared through their repr so that the lists modified in place
+        (e.g. the transition matrix) are seen as changed. The files are compared through their
+        content so that a file edited under the same path is seen as changed.
+
+        Args:
+            aoi (str): the hash of the AOI geometry (see aoi_key)
+            model (IndicatorModel): the parameters of the computation
+            parent_keys (list): the signatures of the parents
+        """
+        traits = tuple((t, repr(getattr(model, t))) for t in self.traits)
+        files = tuple((t, file_key(getattr(model, t))) for t in self.files)
+        aoi = aoi if self.aoi else None
+
+        return (aoi, traits, files, tuple(parent_keys))
+
+    def get(self, key):
+        """Return the cached result of a signature, None if it was not computed"""
+
+        if key not in self.cache:
+            return None
+
+        self.cache.move_to_end(key)
+
+        return self.cache[key]
+
+    def set(self, key, result):
+        """Cache a result, the least recently used one is dropped if the cache is full"""
+
+        self.cache[key] = result
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return result
+
+
+class IndicatorGraph:
+    """Lazy dependency graph of the indicator computation
+
+    Each node is memoized on the values of the traits it reads and on the results of its
+    parents, so changing a trait only recomputes the nodes that depend on it.
+
+    Args:
+        nodes (list): the Node of the graph, parents first
+    """
+
+    def __init__(self, nodes):
+        self.nodes = OrderedDict((node.name, node) for node in nodes)
+
+        for node in nodes:
+            missing = [p for p in node.parents if p not in self.nodes]
+            if missing or node.name in node.parents:
+                raise Exception(f"The parents {missing} of {node.name} are not defined")
+
+    def traits(self, name):
+        """Return all the traits a node depends on, directly or through its parents"""
+
+        node = self.nodes[name]
+        traits = set(node.traits)
+        for parent in node.parents:
+            traits |= self.traits(parent)
+
+        return traits
+
+    def downstream(self, trait):
+        """Return the names of the nodes to recompute when a trait is changed"""
+
+        return [name for name in self.nodes if trait in self.traits(name)]
+
+    def evaluate(self, aoi_model, model, output, targets=None):
+        """Compute the requested nodes, reusing the results of the unchanged ones
+
+        Args:
+            aoi_model (AoiModel): the AOI
+            model (IndicatorModel): the parameters of the computation
+            output (Alert): the alert displaying the progress
+            targets (list, optional): the nodes to compute, all of them by default
+
+        Returns:
+            (tuple): the results of the targets by name and the names of the reused nodes
+        """
+        targets = list(self.nodes) if targets is None else targets
+        results, keys, reused = {}, {}, []
+
+        # hash the geometry once for all the nodes
+        aoi = aoi_key(aoi_model)
+
+        def visit(name):
+            if name in keys:
+                return
+
+            node = self.nodes[name]
+            [visit(parent) for parent in node.parents]
+
+            key = node.key(aoi, model, [keys[p] for p in node.parents])
+            result = node.get(key)
+            if result is None:
+                args = [results[p] for p in node.parents]
+                result = node.set(key, node.function(aoi_model, model, output, *args))
+            else:
+                reused.append(name)
+
+            keys[name], results[name] = key, result
+
+        [visit(name) for name in targets]
+
+        return {name: results[name] for name in targets}, reused
+
+    def clear(self):
+        """Drop all the cached results"""
+
+        [node.cache.clear() for node in self.nodes.values()]
+
+        return self
@@ -8,6 +8,15 @@ from component import parameter as pm
 
 
 def integrate_ndvi_climate(aoi_model, model, output):
+    vi_int = integrate_vi(aoi_model, model)
+    climate_int = integrate_climate(aoi_model, model)
+
+    return (vi_int, climate_int)
+
+
+def assessment_period(model):
+    """Return the first and last years of all the assessment periods"""
+
     # Caculate the maximum extent of assessment period from all the inputs to integrate the vi over the entire period
     start_list = [
         model.start,
@@ -19,6 +28,14 @@ def integrate_ndvi_climate(aoi_model, model, output):
     period_start = min(filter(lambda v: v is not None, start_list))
     period_end = max(filter(lambda v: v is not None, end_list))
 
+    return period_start, period_end
+
+
+def integrate_vi(aoi_model, model):
+    """Integrate the vegetation index of the sensors at the annual level"""
+
+    period_start, period_end = assessment_period(model)
+
     if "MODIS MOD13Q1" in model.sensors or "MODIS MYD13Q1" in model.sensors:
         if "MODIS MOD13Q1" in model.sensors and "MODIS MYD13Q1" in model.sensors:
             modis_vi_mod = ee.ImageCollection(
@@ -147,6 +164,14 @@ def integrate_ndvi_climate(aoi_model, model, output):
             else:
                 print(f"{model.vegetation_index} is not available as a derived index")
 
+    return integrated_vi_coll
+
+
+def integrate_climate(aoi_model, model):
+    """Integrate the precipitation at the annual level"""
+
+    period_start, period_end = assessment_period(model)
+
     # TODO: option to select multiple precipitation datasets.
     # process the climate dataset to use with the pixel restrend, RUE calculation
     precipitation = (
@@ -158,7 +183,7 @@ def integrate_ndvi_climate(aoi_model, model, output):
 
     climate_int = int_yearly_climate(precipitation, period_start, period_end)
 
-    return (integrated_vi_coll, climate_int)
+    return climate_int
 
 
 def rename_band(img, sensor):
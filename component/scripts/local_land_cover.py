@@ -0,0 +1,157 @@
+from functools import partial
+
+import numpy as np
+
+from component import parameter as pm
+from .windowed import run_windowed
+from .parallel import shared_arrays
+from .lookup_table import np_remap_table
+
+bands = ["degradation", "transition", "start", "end", "water"]
+
+
+def land_cover_tables(model):
+    """Compile the translation and transition matrices in dense look up tables
+
+    Args:
+        model (IndicatorModel): the model holding the transition matrix
+
+    Returns:
+        (tuple): the 256 entries ESA CCI to IPCC uint8 table and the 65536 entries
+            transition code to degradation uint8 table (1 degraded - 2 stable - 3 improved)
+    """
+    translation = np_remap_table(*pm.translation_matrix)
+
+    # use the byte convention, missing transitions are nodata (0)
+    degradation = [{1: 3, 0: 2, -1: 1}[int(v)] for v in model.trans_matrix_flatten]
+    transition = np_remap_table(model.lc_class_combination, degradation, 2**16)
+
+    return translation, transition
+
+
+def land_cover_block(start, end, water, transition_table):
+    """Compute the land cover bands of a block
+
+    Args:
+        start (np.ndarray): the land cover of the start year (already in the matrix classes)
+        end (np.ndarray): the land cover of the end year (already in the matrix classes)
+        water (np.ndarray): the boolean water mask
+        transition_table (np.ndarray): the transition code to degradation table
+
+    Returns:
+        (np.ndarray): the (5, rows, cols) uint16 "degradation", "transition", "start", "end"
+            and "water" bands
+    """
+    start = start.astype(np.uint16)
+    end = end.astype(np.uint16)
+    transition = start * 100 + end
+
+    return np.stack(
+        [transition_table[transition], transition, start, end, water], dtype=np.uint16
+    )
+
+
+def water_options(model):
+    """Extract the water mask options of the model as a picklable tuple"""
+
+    custom = bool(model.start_lc and model.end_lc)
+
+    return (
+        custom,
+        model.water_mask_pixel,
+        bool(model.water_mask_asset_id and model.water_mask_asset_band),
+        model.seasonality,
+    )
+
+
+def water_block(options, end, esa_end, water):
+    """Compute the water mask of a block, following the options of land_cover
+
+    Args:
+        options (tuple): the water mask options of the model (see water_options)
+        end (np.ndarray): the end land cover in the matrix classes
+        esa_end (np.ndarray): the end ESA CCI land cover (None with custom land covers)
+        water (np.ndarray): the water mask raster block (JRC seasonality or custom mask), can be None
+
+    Returns:
+        (np.ndarray): the boolean water mask
+    """
+    custom, water_mask_pixel, asset, seasonality = options
+
+    if custom and water_mask_pixel > 9:
+        mask = end == int(water_mask_pixel)
+    elif water_mask_pixel == 70:
+        mask = esa_end == 210
+    elif water is None:
+        mask = np.zeros(end.shape, dtype=bool)
+    elif asset:
+        mask = water != 0
+    else:
+        mask = water >= int(seasonality)
+
+    return mask
+
+
+def land_cover_kernel(options, translation, transition_table, start, end, water=None):
+    """Compute the land cover bands of a block read from the start, end and water rasters"""
+
+    start, end = start[0], end[0]
+    water = None if water is None else water[0]
+
+    # custom land covers are already in the matrix classes
+    esa_end = None
+    if not options[0]:
+        esa_end = end
+        start, end = translation[start], translation[end]
+
+    mask = water_block(options, end, esa_end, water)
+
+    return land_cover_block(start, end, mask, transition_table)
+
+
+def land_cover_local(
+    model,
+    start_file,
+    end_file,
+    dst,
+    water_file=None,
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Local counterpart of land_cover
+
+    The land covers are read by blocks of rows and remapped by fancy indexing in the look up
+    tables, no python loop is run on the classes.
+
+    Args:
+        model (IndicatorModel): the model holding the land cover options
+        start_file (pathlib.Path): the start year land cover GeoTIFF, ESA CCI or custom classes
+            if model.start_lc and model.end_lc are set
+        end_file (pathlib.Path): the end year land cover GeoTIFF aligned on start_file
+        dst (pathlib.Path): the output GeoTIFF
+        water_file (pathlib.Path, optional): the water mask GeoTIFF aligned on start_file
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    translation, transition_table = land_cover_tables(model)
+    files = [start_file, end_file] + ([water_file] if water_file else [])
+
+    # the 3 inputs, the 5 uint16 bands and the temporary arrays
+    bytes_per_pixel = 3 * 2 + 5 * 2 + 4 * 2
+
+    # the 65536 entries table is shared with the workers instead of being sent with every block
+    with shared_arrays(translation, transition_table, workers=workers) as tables:
+        return run_windowed(
+            partial(land_cover_kernel, water_options(model), *tables),
+            files,
+            dst,
+            bytes_per_pixel,
+            count=len(bands),
+            dtype=np.uint16,
+            band_names=bands,
+            workers=workers,
+            memory_budget=memory_budget,
+        )
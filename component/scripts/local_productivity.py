@@ -0,0 +1,1155 @@
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from component import parameter as pm
+from .windowed import map_blocks, map_windows, run_windowed
+from .parallel import shared_arrays
+
+
+def kendall_counts(stack):
+    """Count the Mann-Kendall pairs of every pixel of an annual stack
+
+    The computation is vectorized over the pixels, the only python loops are on the years.
+    Missing values (NaN) are ignored pixel by pixel.
+
+    Args:
+        stack (np.ndarray): the (years, rows, cols) stack of annual values
+
+    Returns:
+        (tuple): the S statistic, the number of valid years, the number of tied pairs and the
+            number of tied triples of each pixel
+    """
+    stack = np.asarray(stack, dtype=np.float32)
+    n_years = stack.shape[0]
+
+    # S is the sum of the signs of all the pairwise (later - earlier) differences
+    # NaN comparisons are always False so missing years are left out
+    s = np.zeros(stack.shape[1:], dtype=np.int64)
+    for lag in range(1, n_years):
+        diff = stack[lag:] - stack[:-lag]
+        s += np.count_nonzero(diff > 0, axis=0) - np.count_nonzero(diff < 0, axis=0)
+
+    n = np.count_nonzero(~np.isnan(stack), axis=0)
+
+    # count the tied pairs and triples on the sorted series (NaN are sorted last)
+    # a group of t ties contributes C(t, 2) pairs and C(t, 3) triples
+    sorted_stack = np.sort(stack, axis=0)
+    rank = np.zeros(stack.shape[1:], dtype=np.int64)
+    tied_pairs = np.zeros(stack.shape[1:], dtype=np.int64)
+    tied_triples = np.zeros(stack.shape[1:], dtype=np.int64)
+    for year in range(1, n_years):
+        rank = np.where(sorted_stack[year] == sorted_stack[year - 1], rank + 1, 0)
+        tied_pairs += rank
+        tied_triples += rank * (rank - 1) // 2
+
+    return s, n, tied_pairs, tied_triples
+
+
+def kendall_statistics(s, n, tied_pairs, tied_triples):
+    """Compute the Mann-Kendall statistics from the pairs counts (see kendall_counts)
+
+    Returns:
+        (tuple): the tau-b, S, tie-corrected variance of S and z-score of each pixel
+    """
+    n = np.asarray(n, dtype=np.float64)
+
+    # sum(t(t-1)(2t+5)) = 12 * C(t, 3) + 18 * C(t, 2)
+    var_s = (n * (n - 1) * (2 * n + 5) - (12 * tied_triples + 18 * tied_pairs)) / 18
+
+    # the years are never tied so the tau-b denominator only depends on the values ties
+    n_pairs = n * (n - 1) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tau = s / np.sqrt(n_pairs * (n_pairs - tied_pairs))
+        z_score = (s - np.sign(s)) / np.sqrt(var_s)
+
+    tau[n < 2] = np.nan
+    z_score[var_s <= 0] = np.nan
+
+    return tau, s, var_s, z_score
+
+
+def mann_kendall(stack):
+    """Compute the Mann-Kendall statistics of every pixel of an annual stack
+
+    Args:
+        stack (np.ndarray): the (years, rows, cols) stack of annual values
+
+    Returns:
+        (tuple): the tau-b, S, tie-corrected variance of S and z-score of each pixel
+    """
+    return kendall_statistics(*kendall_counts(stack))
+
+
+def vi_trend_local(vi_stack, clim_stack=None):
+    """Calculate VI trend from a local annual stack.
+
+    Local counterpart of vi_trend: the Kendall tau-b is scaled by the same z coefficient
+    as the one used on GEE so that the reclassification is identical.
+
+    Args:
+        vi_stack (np.ndarray): the (years, rows, cols) stack of annual VI of the trend period
+        clim_stack (np.ndarray, optional): not used, share the signature of the other trends
+
+    Returns:
+        (np.ndarray): the float32 z-score of each pixel
+    """
+    tau, *_ = mann_kendall(vi_stack)
+
+    return (tau * pm.z_coefficient(vi_stack.shape[0])).astype(np.float32)
+
+
+def regression_sums(vi_stack, clim_stack, sums=None):
+    """Accumulate the sums of the linear model vi = offset + scale * clim over the years
+
+    Only the years where both values are available are used. The sums of the years of the
+    stacks are reduced at once in float64 and added to the sums of the previous years, so new
+    years can be appended to existing sums.
+
+    Args:
+        vi_stack (np.ndarray): the (years, rows, cols) annual VI
+        clim_stack (np.ndarray): the (years, rows, cols) annual climate of the same years
+        sums (np.ndarray, optional): the (5, rows, cols) sums of the previous years, updated in place
+
+    Returns:
+        (np.ndarray): the (5, rows, cols) n, sum(clim), sum(vi), sum(clim * vi) and
+            sum(clim ** 2) of each pixel
+    """
+    if sums is None:
+        sums = np.zeros((5, *vi_stack.shape[1:]), dtype=np.float64)
+
+    vi = np.asarray(vi_stack, dtype=np.float32)
+    clim = np.asarray(clim_stack, dtype=np.float32)
+    valid = ~(np.isnan(vi) | np.isnan(clim))
+    x = np.where(valid, clim, 0)
+    y = np.where(valid, vi, 0)
+
+    sums[0] += np.count_nonzero(valid, axis=0)
+    sums[1] += x.sum(axis=0, dtype=np.float64)
+    sums[2] += y.sum(axis=0, dtype=np.float64)
+    sums[3] += np.einsum("ijk,ijk->jk", x, y, dtype=np.float64)
+    sums[4] += np.einsum("ijk,ijk->jk", x, x, dtype=np.float64)
+
+    return sums
+
+
+def restrend_residuals(vi_stack, clim_stack, sums):
+    """Compute the residuals (observed - predicted) of the linear model fitted on the sums
+
+    Args:
+        vi_stack (np.ndarray): the (years, rows, cols) annual VI
+        clim_stack (np.ndarray): the (years, rows, cols) annual climate of the same years
+        sums (np.ndarray): the regression sums of the same years (see regression_sums)
+
+    Returns:
+        (np.ndarray): the float32 (years, rows, cols) residuals, NaN where a value is missing
+    """
+    # the copy of the VI stack will hold the residuals
+    residuals = np.array(vi_stack, dtype=np.float32)
+    clim = np.asarray(clim_stack, dtype=np.float32)
+    residuals[np.isnan(clim)] = np.nan
+
+    n, sum_x, sum_y, sum_xy, sum_xx = sums
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x**2)
+        offset = (sum_y - scale * sum_x) / n
+
+    # residuals = vi - (offset + scale * clim)
+    residuals -= clim * scale.astype(np.float32)
+    residuals -= offset.astype(np.float32)
+
+    return residuals
+
+
+def restrend_local(vi_stack, clim_stack):
+    """Calculate the residual trend (RESTREND) from local annual stacks.
+
+    Local counterpart of restrend: the linear model vi = offset + scale * clim is fitted on every
+    pixel at once with the closed-form normal equations, the residuals (observed - predicted)
+    are then computed and their Kendall tau-b is scaled as on GEE.
+
+    Args:
+        vi_stack (np.ndarray): the (years, rows, cols) stack of annual VI of the trend period
+        clim_stack (np.ndarray): the (years, rows, cols) stack of annual climate of the same years
+
+    Returns:
+        (np.ndarray): the float32 z-score of each pixel
+    """
+    sums = regression_sums(vi_stack, clim_stack)
+    tau, *_ = mann_kendall(restrend_residuals(vi_stack, clim_stack, sums))
+
+    return (tau * pm.z_coefficient(vi_stack.shape[0])).astype(np.float32)
+
+
+def use_efficiency(vi_stack, clim_stack):
+    """Compute the annual rain use efficiency, the VI divided by the precipitations in meters"""
+
+    vi = np.asarray(vi_stack, dtype=np.float32)
+    clim = np.asarray(clim_stack, dtype=np.float32)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return vi / (clim / 1000)
+
+
+def rain_use_efficiency_trend_local(vi_stack, clim_stack):
+    """Calculate the rain use efficiency trend from local annual stacks.
+
+    Local counterpart of rain_use_efficiency_trend.
+
+    Args:
+        vi_stack (np.ndarray): the (years, rows, cols) stack of annual VI of the trend period
+        clim_stack (np.ndarray): the (years, rows, cols) stack of annual climate of the same years
+
+    Returns:
+        (np.ndarray): the float32 z-score of each pixel
+    """
+    tau, *_ = mann_kendall(use_efficiency(vi_stack, clim_stack))
+
+    return (tau * pm.z_coefficient(vi_stack.shape[0])).astype(np.float32)
+
+
+def five_levels(z_score):
+    """Reclassify a z-score using the 5 levels of the Kendall significance (0 is nodata)"""
+
+    classes = np.zeros(z_score.shape, dtype=np.uint8)
+    classes[z_score < -1.96] = 1
+    classes[(z_score < -1.28) & (z_score >= -1.96)] = 2
+    classes[(z_score >= -1.28) & (z_score <= 1.28)] = 3
+    classes[(z_score > 1.28) & (z_score <= 1.96)] = 4
+    classes[z_score > 1.96] = 5
+
+    return classes
+
+
+def three_levels(z_score):
+    """Reclassify a z-score in degraded (1), stable (2) and improved (3) (0 is nodata)"""
+
+    classes = np.zeros(z_score.shape, dtype=np.uint8)
+    classes[z_score < -1.96] = 1
+    classes[(z_score >= -1.96) & (z_score <= 1.96)] = 2
+    classes[z_score > 1.96] = 3
+
+    return classes
+
+
+def trend_method(trajectory):
+    """Return the local trend function of a trajectory method
+
+    The function is called with the VI and climate stacks and returns the z-score.
+    """
+    trajectories = [traj["value"] for traj in pm.trajectories]
+
+    if trajectory == trajectories[0]:
+        trend = vi_trend_local
+    elif trajectory == trajectories[1]:
+        trend = restrend_local
+    elif trajectory == trajectories[3]:
+        trend = rain_use_efficiency_trend_local
+    else:
+        raise NameError(f"{trajectory} is not available locally")
+
+    return trend
+
+
+def trend_bytes_per_pixel(n_years, climate=False):
+    """Return the memory needed to compute the trend of a pixel"""
+
+    # the block, its sorted copy, the lagged differences and the int64 accumulators
+    bytes_per_pixel = 3 * n_years * 4 + 6 * 8
+
+    # plus the climate block and the regression temporary arrays
+    if climate:
+        bytes_per_pixel += 4 * n_years * 4 + 6 * 8
+
+    return bytes_per_pixel
+
+
+def year_bands(years, start, end):
+    """Return the slice of the bands of an annual raster covering the start-end period"""
+
+    years = list(years)
+
+    return slice(years.index(start), years.index(end) + 1)
+
+
+def trajectory_kernel(trajectory, bands, vi, clim=None):
+    """Compute the "trajectory_5_levels" and "trajectory" bands of a block
+
+    Args:
+        trajectory (str): the trajectory method
+        bands (slice): the years of the trend period in the annual stacks
+        vi (np.ndarray): the (years, rows, cols) annual VI block
+        clim (np.ndarray, optional): the (years, rows, cols) annual climate block
+
+    Returns:
+        (np.ndarray): the (2, rows, cols) uint8 bands
+    """
+    clim = None if clim is None else np.asarray(clim[bands])
+    z_score = trend_method(trajectory)(np.asarray(vi[bands]), clim)
+
+    return np.stack([five_levels(z_score), three_levels(z_score)])
+
+
+def trajectory_block(trajectory, vi_stack, clim_stack, block):
+    """Compute the trajectory bands of a block of rows of the (shared) annual stacks"""
+
+    clim = None if clim_stack is None else clim_stack[:, block]
+
+    return trajectory_kernel(trajectory, slice(None), vi_stack[:, block], clim)
+
+
+def productivity_trajectory_local(
+    model,
+    vi_stack,
+    clim_stack=None,
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Local counterpart of productivity_trajectory
+
+    The stack is processed by blocks of rows so only the uint8 outputs are kept for the whole raster.
+    With several workers the stacks are shared with the processes instead of being pickled.
+
+    Args:
+        model (IndicatorModel): the model holding the trajectory method
+        vi_stack (np.ndarray): the (years, rows, cols) stack of annual VI of the trend period,
+            it can be a memory-mapped array
+        clim_stack (np.ndarray, optional): the (years, rows, cols) stack of annual climate of the
+            same years, required by the climate adjusted methods
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (np.ndarray): the (2, rows, cols) uint8 "trajectory_5_levels" and "trajectory" bands
+    """
+    n_years, rows, cols = vi_stack.shape
+    bytes_per_pixel = trend_bytes_per_pixel(n_years, clim_stack is not None)
+
+    trajectory = np.zeros((2, rows, cols), dtype=np.uint8)
+    with shared_arrays(vi_stack, clim_stack, workers=workers) as (vi, clim):
+        kernel = partial(trajectory_block, model.trajectory, vi, clim)
+        blocks = map_blocks(
+            kernel, (rows, cols), bytes_per_pixel, workers, memory_budget
+        )
+        for block, result in blocks:
+            trajectory[:, block] = result
+
+    return trajectory
+
+
+def productivity_trajectory_raster(
+    model,
+    vi_file,
+    years,
+    dst,
+    clim_file=None,
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Compute the productivity trajectory of annual rasters with the windowed framework
+
+    Args:
+        model (IndicatorModel): the model holding the trajectory method and period
+        vi_file (pathlib.Path): the annual VI raster, one band per year
+        years (list): the year of each band
+        dst (pathlib.Path): the output file
+        clim_file (pathlib.Path, optional): the annual climate raster aligned on vi_file with
+            the same bands
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    bands = year_bands(years, model.p_trend_start, model.p_trend_end)
+    files = [vi_file] + ([clim_file] if clim_file else [])
+
+    # the full stacks are read before selecting the period
+    bytes_per_pixel = trend_bytes_per_pixel(len(years), clim_file is not None)
+
+    return run_windowed(
+        partial(trajectory_kernel, model.trajectory, bands),
+        files,
+        dst,
+        bytes_per_pixel,
+        count=2,
+        band_names=["trajectory_5_levels", "trajectory"],
+        nan_nodata=True,
+        workers=workers,
+        memory_budget=memory_budget,
+    )
+
+
+def productivity_trajectory_store(model, store, dst, workers=1):
+    """Compute the productivity trajectory of the annual stacks of a StackStore
+
+    The blocks of the store are read in place, without copy.
+
+    Args:
+        model (IndicatorModel): the model holding the trajectory method and period
+        store (StackStore): the store of the "vi" (and "clim") annual stacks
+        dst (pathlib.Path): the output file
+        workers (int): the number of processes
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    climate = model.trajectory != pm.trajectories[0]["value"]
+    years = store.years("vi")
+    if climate and store.years("clim") != years:
+        raise Exception("The vi and clim stacks need to cover the same years")
+
+    bands = year_bands(years, model.p_trend_start, model.p_trend_end)
+
+    return store.run(
+        partial(trajectory_kernel, model.trajectory, bands),
+        ["vi", "clim"] if climate else ["vi"],
+        dst,
+        workers,
+        count=2,
+        band_names=["trajectory_5_levels", "trajectory"],
+    )
+
+
+class TrendState:
+    """Persisted per-pixel Mann-Kendall state of a trajectory, extended one year at a time
+
+    Adding a year only compares it with the previous years of each pixel: S and the ties
+    counts are updated in O(n) instead of O(n²) and the z-scores are identical to a full
+    computation. For RESTREND the regression sums are kept so the linear fit is updated in
+    O(1), but all the residuals move with the fit so their pairs are counted again.
+
+    Args:
+        trajectory (str): the trajectory method
+        start (int): the first year of the trend period
+        shape (tuple): the (rows, cols) shape of the rasters
+    """
+
+    def __init__(self, trajectory, start, shape):
+        # raise an error early for the methods that are not available locally
+        trend_method(trajectory)
+
+        self.trajectory = trajectory
+        self.start = start
+        self.end = start - 1
+
+        self.s = np.zeros(shape, dtype=np.int64)
+        self.n = np.zeros(shape, dtype=np.int64)
+        self.tied_pairs = np.zeros(shape, dtype=np.int64)
+        self.tied_triples = np.zeros(shape, dtype=np.int64)
+        self.sums = np.zeros((5, *shape)) if self.restrend else None
+
+    @property
+    def restrend(self):
+        return self.trajectory == pm.trajectories[1]["value"]
+
+    def _series(self, vi, clim):
+        """Return the values whose trend is computed"""
+
+        if self.trajectory == pm.trajectories[3]["value"]:
+            return use_efficiency(vi, clim)
+
+        return np.asarray(vi, dtype=np.float32)
+
+    def _add(self, history, value):
+        """Count the pairs formed by a new value with the previous values of the series"""
+
+        # NaN comparisons are always False so missing years are left out
+        self.s += np.count_nonzero(history < value, axis=0)
+        self.s -= np.count_nonzero(history > value, axis=0)
+
+        # a new value tied with t previous values adds t pairs and C(t, 2) triples
+        equal = np.count_nonzero(history == value, axis=0)
+        self.tied_triples += equal * (equal - 1) // 2
+        self.tied_pairs += equal
+        self.n += ~np.isnan(value)
+
+    def update(self, vi_stack, clim_stack=None):
+        """Add the years of the stacks that are not in the state yet
+
+        Args:
+            vi_stack (np.ndarray): the (years, rows, cols) annual VI from the start year to the new
+                end year
+            clim_stack (np.ndarray, optional): the annual climate of the same years, required by
+                the climate adjusted methods
+
+        Returns:
+            self
+        """
+        n_years = vi_stack.shape[0]
+        first = self.end - self.start + 1
+
+        if first > n_years:
+            raise Exception(f"The stacks need to cover the years up to {self.end}")
+
+        if self.restrend and first < n_years:
+            regression_sums(vi_stack[first:], clim_stack[first:], self.sums)
+            residuals = restrend_residuals(vi_stack, clim_stack, self.sums)
+            self.s, self.n, self.tied_pairs, self.tied_triples = kendall_counts(
+                residuals
+            )
+
+        elif not self.restrend:
+            clim = [None] * n_years if clim_stack is None else clim_stack
+            history = self._series(vi_stack[:first], clim[:first])
+            for year in range(first, n_years):
+                value = self._series(vi_stack[year], clim[year])
+                self._add(history, value)
+                history = np.concatenate([history, value[None]])
+
+        self.end = self.start + n_years - 1
+
+        return self
+
+    def z_score(self):
+        """Return the float32 z-score of each pixel, as computed by the trend method"""
+
+        tau, *_ = kendall_statistics(self.s, self.n, self.tied_pairs, self.tied_triples)
+        n_years = self.end - self.start + 1
+
+        return (tau * pm.z_coefficient(n_years)).astype(np.float32)
+
+    def save(self, file):
+        """Save the state in a .npz file"""
+
+        sums = {} if self.sums is None else {"sums": self.sums}
+        np.savez(
+            file,
+            trajectory=self.trajectory,
+            years=[self.start, self.end],
+            s=self.s.astype(np.int32),
+            n=self.n.astype(np.uint16),
+            tied_pairs=self.tied_pairs.astype(np.int32),
+            tied_triples=self.tied_triples.astype(np.int32),
+            **sums,
+        )
+
+        return file
+
+    @classmethod
+    def load(cls, file):
+        """Load a state saved with the save method"""
+
+        with np.load(file) as data:
+            start, end = data["years"].tolist()
+            state = cls(str(data["trajectory"]), start, data["s"].shape)
+            state.end = end
+            state.s = data["s"].astype(np.int64)
+            state.n = data["n"].astype(np.int64)
+            state.tied_pairs = data["tied_pairs"].astype(np.int64)
+            state.tied_triples = data["tied_triples"].astype(np.int64)
+            if state.restrend:
+                state.sums = data["sums"]
+
+        return state
+
+
+def trajectory_update_kernel(
+    trajectory, start, bands, state_dir, window, vi, clim=None
+):
+    """Extend the trend state of a block and compute its trajectory bands
+
+    Args:
+        trajectory (str): the trajectory method
+        start (int): the first year of the trend period
+        bands (slice): the years of the trend period in the annual stacks
+        state_dir (pathlib.Path): the folder of the trend states of the blocks
+        window (Window): the window of the block
+        vi (np.ndarray): the (years, rows, cols) annual VI block
+        clim (np.ndarray, optional): the (years, rows, cols) annual climate block
+
+    Returns:
+        (np.ndarray): the (2, rows, cols) uint8 bands
+    """
+    vi = vi[bands]
+    clim = None if clim is None else clim[bands]
+    file = Path(state_dir) / f"{window.row_off}_{window.col_off}.npz"
+
+    # start from scratch if the state does not match the trend period
+    state = TrendState.load(file) if file.is_file() else None
+    if (
+        state is None
+        or (state.trajectory, state.start) != (trajectory, start)
+        or state.end - state.start + 1 > vi.shape[0]
+    ):
+        state = TrendState(trajectory, start, vi.shape[1:])
+
+    z_score = state.update(vi, clim).z_score()
+    state.save(file)
+
+    return np.stack([five_levels(z_score), three_levels(z_score)])
+
+
+def productivity_trajectory_update_store(model, store, state_dir, dst, workers=1):
+    """Compute the productivity trajectory of a StackStore by extending saved trend states
+
+    The trend state of each block is saved in state_dir. When the end of the trend period
+    moves forward only the new years are added to it instead of recomputing the trend of the
+    whole period.
+
+    Args:
+        model (IndicatorModel): the model holding the trajectory method and period
+        store (StackStore): the store of the "vi" (and "clim") annual stacks
+        state_dir (pathlib.Path): the folder of the trend states
+        dst (pathlib.Path): the output file
+        workers (int): the number of processes
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    climate = model.trajectory != pm.trajectories[0]["value"]
+    years = store.years("vi")
+    if climate and store.years("clim") != years:
+        raise Exception("The vi and clim stacks need to cover the same years")
+
+    Path(state_dir).mkdir(parents=True, exist_ok=True)
+    start, end = model.p_trend_start, model.p_trend_end
+    kernel = partial(
+        trajectory_update_kernel,
+        model.trajectory,
+        start,
+        year_bands(years, start, end),
+        state_dir,
+    )
+
+    return store.run(
+        kernel,
+        ["vi", "clim"] if climate else ["vi"],
+        dst,
+        workers,
+        with_window=True,
+        count=2,
+        band_names=["trajectory_5_levels", "trajectory"],
+    )
+
+
+class StateAccumulator:
+    """Single streaming pass over the annual VI to compute the productivity state
+
+    The years of the baseline period feed a Welford mean/variance accumulator and the 3 most
+    recent years a running sum so the annual rasters can be read one at a time.
+
+    Args:
+        start (int): the first year of the state period
+        end (int): the last year of the state period
+        shape (tuple): the (rows, cols) shape of the annual rasters
+    """
+
+    def __init__(self, start, end, shape):
+        self.start = start
+        self.end = end
+
+        # Welford accumulator of the baseline period
+        self.count = np.zeros(shape, dtype=np.uint16)
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+
+        # running sum of the recent period
+        self.recent_count = np.zeros(shape, dtype=np.uint16)
+        self.recent_sum = np.zeros(shape, dtype=np.float64)
+
+    def add(self, year, vi):
+        """Feed the annual VI of a year in the accumulator, missing values (NaN) are skipped"""
+
+        vi = np.asarray(vi, dtype=np.float64)
+        valid = ~np.isnan(vi)
+
+        if self.start <= year <= self.end - 3:
+            self.count += valid
+            delta = np.where(valid, vi - self.mean, 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self.mean += np.where(valid, delta / self.count, 0)
+            self.m2 += np.where(valid, delta * (vi - self.mean), 0)
+
+        elif self.end - 2 <= year <= self.end:
+            self.recent_count += valid
+            self.recent_sum += np.where(valid, vi, 0)
+
+        return self
+
+    def z_score(self):
+        """Return the z-score of the recent mean compared to the baseline distribution"""
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # population standard deviation, as ee.Reducer.stdDev
+            sigma = np.sqrt(self.m2 / self.count)
+            recent_mean = self.recent_sum / self.recent_count
+            z_score = (recent_mean - self.mean) / (sigma / np.sqrt(3))
+
+        return z_score.astype(np.float32)
+
+    def state(self):
+        """Return the (2, rows, cols) uint8 "state_5_levels" and "state" bands"""
+
+        z_score = self.z_score()
+
+        return np.stack([five_levels(z_score), three_levels(z_score)])
+
+
+def productivity_state_local(model, annual_vi, shape):
+    """Local counterpart of productivity_state
+
+    Args:
+        model (IndicatorModel): the model holding the state period
+        annual_vi (iterable): (year, vi) pairs of annual VI rasters, they can be read lazily
+        shape (tuple): the (rows, cols) shape of the annual rasters
+
+    Returns:
+        (np.ndarray): the (2, rows, cols) uint8 "state_5_levels" and "state" bands
+    """
+    accumulator = StateAccumulator(model.p_state_start, model.p_state_end, shape)
+    for year, vi in annual_vi:
+        accumulator.add(year, vi)
+
+    return accumulator.state()
+
+
+def state_kernel(start, end, years, vi):
+    """Compute the "state_5_levels" and "state" bands of a (years, rows, cols) VI block"""
+
+    accumulator = StateAccumulator(start, end, vi.shape[1:])
+    for year, year_vi in zip(years, vi):
+        accumulator.add(year, year_vi)
+
+    return accumulator.state()
+
+
+def productivity_state_raster(
+    model, vi_file, years, dst, workers=1, memory_budget=pm.local_memory_budget
+):
+    """Compute the productivity state of an annual raster with the windowed framework
+
+    Args:
+        model (IndicatorModel): the model holding the state period
+        vi_file (pathlib.Path): the annual VI raster, one band per year
+        years (list): the year of each band
+        dst (pathlib.Path): the output file
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    # the block and the accumulators
+    bytes_per_pixel = len(years) * 4 + 5 * 8
+
+    return run_windowed(
+        partial(state_kernel, model.p_state_start, model.p_state_end, list(years)),
+        [vi_file],
+        dst,
+        bytes_per_pixel,
+        count=2,
+        band_names=["state_5_levels", "state"],
+        nan_nodata=True,
+        workers=workers,
+        memory_budget=memory_budget,
+    )
+
+
+def productivity_state_store(model, store, dst, workers=1):
+    """Compute the productivity state of the annual VI stack of a StackStore
+
+    Args:
+        model (IndicatorModel): the model holding the state period
+        store (StackStore): the store of the "vi" annual stack
+        dst (pathlib.Path): the output file
+        workers (int): the number of processes
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    return store.run(
+        partial(
+            state_kernel, model.p_state_start, model.p_state_end, store.years("vi")
+        ),
+        ["vi"],
+        dst,
+        workers,
+        count=2,
+        band_names=["state_5_levels", "state"],
+    )
+
+
+class PercentileHistogram:
+    """Mergeable fixed-resolution histograms of a value grouped by unit code
+
+    Local counterpart of ee.Reducer.percentile().group(): the memory is bounded by the number of
+    units times the number of bins whatever the number of pixels. Histograms built on different
+    blocks, processes or machines can be merged before extracting the percentiles.
+
+    Args:
+        bins (int): the number of bins of each histogram
+        vmin (float): the lower edge of the first bin, smaller values are counted in it
+        vmax (float): the upper edge of the last bin, larger values are counted in it
+    """
+
+    def __init__(self, bins=2000, vmin=-1, vmax=1):
+        self.bins = bins
+        self.vmin = vmin
+        self.vmax = vmax
+
+        # {code: counts}
+        self.counts = {}
+
+    def add(self, values, codes):
+        """Count the values of a block in the histogram of their unit code, NaN are skipped"""
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        codes = np.asarray(codes).ravel()
+
+        valid = ~np.isnan(values)
+        values, codes = values[valid], codes[valid]
+
+        # bin index of each value
+        width = (self.vmax - self.vmin) / self.bins
+        index = np.clip(
+            ((values - self.vmin) // width).astype(np.int64), 0, self.bins - 1
+        )
+
+        # count all the units at once in a flat (units x bins) array
+        units, inverse = np.unique(codes, return_inverse=True)
+        counts = np.bincount(
+            inverse.ravel() * self.bins + index, minlength=len(units) * self.bins
+        ).reshape(len(units), self.bins)
+
+        for code, count in zip(units.tolist(), counts):
+            self.counts[code] = self.counts.get(code, 0) + count
+
+        return self
+
+    def merge(self, other):
+        """Add the counts of another histogram built with the same bins"""
+
+        if (self.bins, self.vmin, self.vmax) != (other.bins, other.vmin, other.vmax):
+            raise ValueError("Only histograms with the same bins can be merged")
+
+        for code, count in other.counts.items():
+            self.counts[code] = self.counts.get(code, 0) + count
+
+        return self
+
+    def percentile(self, q=90):
+        """Return the q-th percentile of each unit
+
+        The value is linearly interpolated in the bin where the cumulative count reaches q%.
+
+        Returns:
+            (tuple): the sorted unit codes and their percentile as 2 np.ndarray
+        """
+        codes = np.array(sorted(self.counts), dtype=np.int64)
+        values = np.zeros(len(codes), dtype=np.float64)
+        width = (self.vmax - self.vmin) / self.bins
+
+        for i, code in enumerate(codes):
+            cumulative = np.cumsum(self.counts[code])
+            target = q / 100 * cumulative[-1]
+            index = int(np.searchsorted(cumulative, target))
+            previous = cumulative[index - 1] if index else 0
+            fraction = (target - previous) / (cumulative[index] - previous)
+            values[i] = self.vmin + (index + fraction) * width
+
+        return codes, values
+
+    def save(self, file):
+        """Save the histograms in a .npz file"""
+
+        codes = np.array(sorted(self.counts), dtype=np.int64)
+        counts = np.array([self.counts[c] for c in codes]).reshape(len(codes), -1)
+        np.savez(
+            file, edges=[self.bins, self.vmin, self.vmax], codes=codes, counts=counts
+        )
+
+        return file
+
+    @classmethod
+    def load(cls, file):
+        """Load histograms saved with the save method"""
+
+        with np.load(file) as data:
+            bins, vmin, vmax = data["edges"]
+            histogram = cls(int(bins), vmin, vmax)
+            histogram.counts = dict(zip(data["codes"].tolist(), data["counts"]))
+
+        return histogram
+
+
+def _period_mean(stack):
+    """NaN-aware mean of a (years, rows, cols) block without all-NaN warnings"""
+
+    stack = np.asarray(stack, dtype=np.float32)
+    valid = ~np.isnan(stack)
+    total = np.where(valid, stack, 0).sum(axis=0, dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = total / np.count_nonzero(valid, axis=0)
+
+    return mean.astype(np.float32)
+
+
+def performance_classes(ndvi_mean, units, codes, percentile_90):
+    """Reclassify the ratio of the observed VI to the 90th percentile of its unit
+
+    Args:
+        ndvi_mean (np.ndarray): the mean VI of the performance period
+        units (np.ndarray): the ecological unit codes of the same pixels
+        codes (np.ndarray): the sorted unit codes
+        percentile_90 (np.ndarray): the 90th percentile of each unit code
+
+    Returns:
+        (np.ndarray): the uint8 "performance" band, 1 is degraded, 2 is not degraded, 0 is nodata
+    """
+    performance = np.zeros(units.shape, dtype=np.uint8)
+    if not len(codes):
+        return performance
+
+    # remap the units with their 90th percentile, unknown units are left as nodata
+    index = np.clip(np.searchsorted(codes, units), 0, len(codes) - 1)
+    known = codes[index] == units
+    ecoregion_90th_percentile = np.where(known, percentile_90[index], np.nan)
+
+    # set a very small number to 0 valued pixels to prevent division by 0
+    ecoregion_90th_percentile[ecoregion_90th_percentile == 0] = 0.001
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        observed_ratio = ndvi_mean / ecoregion_90th_percentile
+
+    performance[observed_ratio >= 0.5] = 2
+    performance[observed_ratio <= 0.5] = 1
+
+    return performance
+
+
+def value_range(values):
+    """Return the NaN-aware (min, max) of some values, (inf, -inf) if they are all NaN"""
+
+    values = np.asarray(values)
+    valid = values[~np.isnan(values)]
+    if not valid.size:
+        return np.inf, -np.inf
+
+    return float(valid.min()), float(valid.max())
+
+
+def histogram_range(ranges):
+    """Merge the (min, max) of several blocks in the edges of the percentile histograms
+
+    Args:
+        ranges (iterable): the (min, max) of each block
+
+    Returns:
+        (tuple): the vmin and vmax of PercentileHistogram, (-1, 1) if all the values are NaN
+    """
+    vmin, vmax = np.inf, -np.inf
+    for block_min, block_max in ranges:
+        vmin, vmax = min(vmin, block_min), max(vmax, block_max)
+
+    if vmin > vmax:
+        return -1, 1
+
+    # a constant VI still needs bins of a non-zero width
+    if vmin == vmax:
+        vmin, vmax = vmin - 0.5, vmax + 0.5
+
+    return vmin, vmax
+
+
+def _range_block(vi_stack, block):
+    """Return the range of the mean VI of a block of rows"""
+
+    return value_range(_period_mean(vi_stack[:, block]))
+
+
+def _histogram_block(vi_range, vi_stack, lceu, block):
+    """Build the VI histograms of each unit of a block of rows"""
+
+    return PercentileHistogram(vmin=vi_range[0], vmax=vi_range[1]).add(
+        _period_mean(vi_stack[:, block]), _units(lceu[block])
+    )
+
+
+def _performance_block(codes, percentile_90, vi_stack, lceu, block):
+    """Compute the "performance" band of a block of rows"""
+
+    return performance_classes(
+        _period_mean(vi_stack[:, block]), _units(lceu[block]), codes, percentile_90
+    )
+
+
+def productivity_performance_local(
+    vi_stack,
+    lceu,
+    histogram=None,
+    vi_range=None,
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Local counterpart of productivity_performance
+
+    Pass 1 builds the VI histograms of each unit block by block, pass 2 remaps each unit to its
+    90th percentile and computes the observed ratio. With several workers the stack, the units
+    and the 90th percentile table are shared with the processes instead of being pickled.
+
+    The histogram edges are set to the range of the mean VI, found in a first pass over the
+    blocks, so that VI out of [-1, 1] (e.g. Terra NPP) are not clipped in the end bins.
+
+    Args:
+        vi_stack (np.ndarray): the (years, rows, cols) stack of annual VI of the performance period
+        lceu (np.ndarray): the (rows, cols) ecological unit codes, the missing (NaN) and 0 codes
+            are grouped in the -1 unit as on GEE
+        histogram (PercentileHistogram, optional): histograms of the whole AOI, for example
+            merged from several tiles. If set pass 1 is skipped.
+        vi_range (tuple, optional): the (min, max) of the mean VI. If set the range pass is
+            skipped.
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (np.ndarray): the uint8 "performance" band
+    """
+    n_years, rows, cols = vi_stack.shape
+
+    # the block, its mask and the float64 sums
+    bytes_per_pixel = 2 * n_years * 4 + 4 * 8
+
+    with shared_arrays(vi_stack, lceu, workers=workers) as (vi, units):
+        if histogram is None:
+            if vi_range is None:
+                kernel = partial(_range_block, vi)
+                blocks = map_blocks(
+                    kernel, (rows, cols), bytes_per_pixel, workers, memory_budget
+                )
+                vi_range = histogram_range(r for _, r in blocks)
+
+            histogram = PercentileHistogram(vmin=vi_range[0], vmax=vi_range[1])
+            kernel = partial(_histogram_block, vi_range, vi, units)
+            blocks = map_blocks(
+                kernel, (rows, cols), bytes_per_pixel, workers, memory_budget
+            )
+            for _, block_histogram in blocks:
+                histogram.merge(block_histogram)
+
+        codes, percentile_90 = histogram.percentile(90)
+
+        performance = np.zeros((rows, cols), dtype=np.uint8)
+        with shared_arrays(codes, percentile_90, workers=workers) as table:
+            kernel = partial(_performance_block, *table, vi, units)
+            blocks = map_blocks(
+                kernel, (rows, cols), bytes_per_pixel, workers, memory_budget
+            )
+            for block, result in blocks:
+                performance[block] = result
+
+    return performance
+
+
+def _units(lceu):
+    """Fill the missing ecological units with -1 as on GEE
+
+    ee.Image(-1).where(lceu, lceu) keeps the masked pixels and the 0 codes at -1, where() taking
+    0 as false.
+    """
+    lceu = np.asarray(lceu)
+
+    return np.where(np.isnan(lceu) | (lceu == 0), -1, lceu).astype(np.int64)
+
+
+def range_kernel(bands, vi, lceu):
+    """Return the range of the mean VI of a block"""
+
+    return value_range(_period_mean(vi[bands]))
+
+
+def histogram_kernel(bands, vi_range, vi, lceu):
+    """Build the VI histograms of each unit of a block"""
+
+    histogram = PercentileHistogram(vmin=vi_range[0], vmax=vi_range[1])
+
+    return histogram.add(_period_mean(vi[bands]), _units(lceu[0]))
+
+
+def performance_kernel(bands, codes, percentile_90, vi, lceu):
+    """Compute the "performance" band of a block"""
+
+    return performance_classes(
+        _period_mean(vi[bands]), _units(lceu[0]), codes, percentile_90
+    )
+
+
+def productivity_performance_raster(
+    model,
+    vi_file,
+    years,
+    lceu_file,
+    dst,
+    histogram=None,
+    vi_range=None,
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Compute the productivity performance of an annual raster with the windowed framework
+
+    As in productivity_performance_local the histogram edges are set to the range of the mean
+    VI found in a first pass.
+
+    Args:
+        model (IndicatorModel): the model holding the performance period
+        vi_file (pathlib.Path): the annual VI raster, one band per year
+        years (list): the year of each band
+        lceu_file (pathlib.Path): the ecological units raster aligned on vi_file
+        dst (pathlib.Path): the output file
+        histogram (PercentileHistogram, optional): histograms of the whole AOI. If set pass 1
+            is skipped.
+        vi_range (tuple, optional): the (min, max) of the mean VI. If set the range pass is
+            skipped.
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    bands = year_bands(years, model.p_performance_start, model.p_performance_end)
+    files = [vi_file, lceu_file]
+
+    # the block, its mask, the units and the float64 sums
+    bytes_per_pixel = 2 * len(years) * 4 + 6 * 8
+
+    # pass 1: merge the histograms of all the blocks
+    if histogram is None:
+        if vi_range is None:
+            blocks = map_windows(
+                partial(range_kernel, bands),
+                files,
+                bytes_per_pixel,
+                nan_nodata=True,
+                workers=workers,
+                memory_budget=memory_budget,
+            )
+            vi_range = histogram_range(r for _, r in blocks)
+
+        histogram = PercentileHistogram(vmin=vi_range[0], vmax=vi_range[1])
+        blocks = map_windows(
+            partial(histogram_kernel, bands, vi_range),
+            files,
+            bytes_per_pixel,
+            nan_nodata=True,
+            workers=workers,
+            memory_budget=memory_budget,
+        )
+        for _, block_histogram in blocks:
+            histogram.merge(block_histogram)
+
+    # pass 2: remap the units to their 90th percentile
+    codes, percentile_90 = histogram.percentile(90)
+
+    with shared_arrays(codes, percentile_90, workers=workers) as table:
+        return run_windowed(
+            partial(performance_kernel, bands, *table),
+            files,
+            dst,
+            bytes_per_pixel,
+            band_names=["performance"],
+            nan_nodata=True,
+            workers=workers,
+            memory_budget=memory_budget,
+        )
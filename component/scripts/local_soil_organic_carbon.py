@@ -0,0 +1,376 @@
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import rasterio as rio
+
+from component import parameter as pm
+from .windowed import (
+    check_alignment,
+    map_blocks,
+    map_windows,
+    output_profile,
+    run_windowed,
+)
+from .parallel import shared_arrays
+from .lookup_table import np_remap_table
+
+
+def soc_factor_tables():
+    """Compile the IPCC stock change factors in look up tables indexed by the transition code
+
+    The 333 and -333 conversion factors are replaced by the climate coefficient at
+    computation time so they are stored as an exponent of the coefficient.
+
+    Returns:
+        (tuple): the float32 product of the 3 factors (NaN for unknown transitions) and the int8
+            exponent of the climate coefficient
+    """
+    codes = pm.IPCC_lc_change_matrix
+    conversion = np.array(pm.c_conversion_factor, dtype=np.float64)
+
+    exponent = np.sign(conversion) * (np.abs(conversion) == 333)
+    base = np.where(exponent != 0, 1, conversion)
+    base = base * pm.management_factor * pm.input_factor
+
+    base = np_remap_table(codes, base, 2**16, np.float32, np.nan)
+    exponent = np_remap_table(codes, exponent, 2**16, np.int8)
+
+    return base, exponent
+
+
+class SocState:
+    """Compact per-pixel state of the soil organic carbon computation
+
+    Args:
+        soc (np.ndarray): the initial soil organic carbon stock, NaN where missing
+        lc (np.ndarray): the land cover of the first year in IPCC classes, 0 where missing
+        climate_coef (float|np.ndarray): the climate conversion coefficient
+    """
+
+    base_factor, climate_exponent = soc_factor_tables()
+
+    # the bands of a saved state
+    bands = ["stock", "initial", "change", "transition", "years", "lc"]
+
+    def __init__(self, soc, lc, climate_coef):
+        lc = np.asarray(lc, dtype=np.uint8)
+
+        self.climate_coef = np.broadcast_to(
+            np.asarray(climate_coef, dtype=np.float32), lc.shape
+        )
+        self.initial = np.asarray(soc, dtype=np.float32)
+        self.stock = np.where(lc == 0, np.nan, self.initial).astype(np.float32)
+        self.change = np.zeros(lc.shape, dtype=np.float32)
+
+        # the stable transition of the first year
+        self.transition = lc.astype(np.uint16) * 101
+        self.years = np.ones(lc.shape, dtype=np.uint8)
+        self.lc = lc
+
+    def step(self, lc):
+        """Move the state to the next year using its land cover in IPCC classes"""
+
+        lc = np.asarray(lc, dtype=np.uint8)
+        changed = lc != self.lc
+
+        # years since the last transition
+        self.years = np.where(changed, 1, np.minimum(self.years, 254) + 1).astype(
+            np.uint8
+        )
+
+        # only update the transition and the yearly change where a change occurred
+        self.transition[changed] = (
+            self.lc[changed].astype(np.uint16) * 100 + lc[changed]
+        )
+        code = self.transition[changed]
+        factor = self.base_factor[code] * self.climate_coef[changed] ** (
+            self.climate_exponent[code]
+        )
+        self.change[changed] = self.stock[changed] * (1 - factor) / 20
+
+        # the stock stops changing 20 years after the transition
+        self.change[self.years > 20] = 0
+
+        self.stock -= self.change
+        self.stock[lc == 0] = np.nan
+        self.lc = lc
+
+        return self
+
+    def soc_class(self):
+        """Return the soc sub-indicator from the percent change since the first year
+
+        1 degraded - 2 stable - 3 improved, 0 is nodata
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percent_change = (self.stock - self.initial) / self.initial * 100
+
+        soc_class = np.zeros(percent_change.shape, dtype=np.uint8)
+        soc_class[percent_change > 10] = 3
+        soc_class[(percent_change < 10) & (percent_change > -10)] = 2
+        soc_class[percent_change < -10] = 1
+
+        return soc_class
+
+    def to_array(self):
+        """Return the state as a (6, rows, cols) float32 array (see bands)"""
+
+        return np.stack(
+            [
+                self.stock,
+                self.initial,
+                self.change,
+                self.transition,
+                self.years,
+                self.lc,
+            ],
+            dtype=np.float32,
+        )
+
+    @classmethod
+    def from_array(cls, data, climate_coef):
+        """Restore a state saved with to_array"""
+
+        stock, initial, change, transition, years, lc = data
+
+        state = cls(initial, lc, climate_coef)
+        state.stock = np.array(stock, dtype=np.float32)
+        state.change = np.array(change, dtype=np.float32)
+        state.transition = transition.astype(np.uint16)
+        state.years = years.astype(np.uint8)
+
+        return state
+
+
+def _soc_result(state, checkpoint):
+    """Return the soc class of a state, followed by the state bands if it is checkpointed"""
+
+    soc_class = state.soc_class()
+    if not checkpoint:
+        return soc_class
+
+    return np.concatenate([soc_class[None], state.to_array()], dtype=np.float32)
+
+
+def soc_kernel(climate_coef, soc, land_covers, coef=None, checkpoint=False):
+    """Compute the soc sub-indicator of a block
+
+    Args:
+        climate_coef (float): the climate conversion coefficient, ignored if coef is set
+        soc (np.ndarray): the (1, rows, cols) initial soil organic carbon stock
+        land_covers (np.ndarray): the (years, rows, cols) ESA CCI land covers
+        coef (np.ndarray, optional): the (1, rows, cols) per pixel climate conversion coefficient
+        checkpoint (bool): also return the bands of the final state
+
+    Returns:
+        (np.ndarray): the uint8 "soc" band, or the (7, rows, cols) float32 "soc" and state bands
+    """
+    translation = np_remap_table(*pm.translation_matrix)
+    climate_coef = climate_coef if coef is None else coef[0]
+
+    soc = np.array(soc[0], dtype=np.float32)
+    soc[soc == pm.int_16_min] = np.nan
+
+    state = SocState(soc, translation[land_covers[0]], climate_coef)
+    for land_cover in land_covers[1:]:
+        state.step(translation[land_cover])
+
+    return _soc_result(state, checkpoint)
+
+
+def soc_resume_kernel(climate_coef, first_band, state, land_covers, coef=None):
+    """Resume the soc computation of a block from its saved state
+
+    Args:
+        climate_coef (float): the climate conversion coefficient, ignored if coef is set
+        first_band (int): the index of the first year that is not in the state
+        state (np.ndarray): the (6, rows, cols) saved state (see SocState.bands)
+        land_covers (np.ndarray): the (years, rows, cols) ESA CCI land covers of the period
+        coef (np.ndarray, optional): the (1, rows, cols) per pixel climate conversion coefficient
+
+    Returns:
+        (np.ndarray): the (7, rows, cols) float32 "soc" and state bands
+    """
+    translation = np_remap_table(*pm.translation_matrix)
+    climate_coef = climate_coef if coef is None else coef[0]
+
+    state = SocState.from_array(state, climate_coef)
+    for land_cover in land_covers[first_band:]:
+        state.step(translation[land_cover])
+
+    return _soc_result(state, True)
+
+
+def soc_block(climate_coef, soc, coef, land_covers, block):
+    """Compute the soc sub-indicator of a block of rows of the (shared) arrays"""
+
+    return soc_kernel(
+        climate_coef,
+        soc[None, block],
+        np.stack([np.asarray(lc[block]) for lc in land_covers]),
+        None if coef is None else coef[None, block],
+    )
+
+
+def soil_organic_carbon_local(
+    soc, land_covers, climate_coef, workers=1, memory_budget=pm.local_memory_budget
+):
+    """Local counterpart of soil_organic_carbon
+
+    The yearly land covers are walked once by blocks of rows, only the compact state of the
+    current block is kept in memory (never a year-by-pixel stack). With several workers the
+    inputs are shared with the processes instead of being pickled.
+
+    Args:
+        soc (np.ndarray): the (rows, cols) initial soil organic carbon stock, NaN where missing
+        land_covers (list): the (rows, cols) ESA CCI land covers of every year of the period,
+            they can be memory-mapped arrays
+        climate_coef (float|np.ndarray): the climate conversion coefficient, a single value or
+            a (rows, cols) array
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (np.ndarray): the uint8 "soc" sub-indicator
+    """
+    rows, cols = soc.shape
+    coef = climate_coef if np.ndim(climate_coef) == 2 else None
+
+    # the state, the land cover blocks and the temporary masks
+    bytes_per_pixel = 5 * 4 + 2 + 1 + 3 * 1 + 2 * 4 + len(land_covers)
+
+    soc_class = np.zeros((rows, cols), dtype=np.uint8)
+    # the per pixel coefficients are shared with the other arrays
+    climate_coef = None if coef is not None else climate_coef
+
+    with shared_arrays(soc, coef, *land_covers, workers=workers) as shared:
+        kernel = partial(soc_block, climate_coef, shared[0], shared[1], shared[2:])
+        blocks = map_blocks(
+            kernel, (rows, cols), bytes_per_pixel, workers, memory_budget
+        )
+        for block, result in blocks:
+            soc_class[block] = result
+
+    return soc_class
+
+
+def checkpoint_year(model, checkpoint, years):
+    """Return the last year of a local soc checkpoint if it can be used to resume the period
+
+    Args:
+        model (IndicatorModel): the model holding the soc period and climate coefficient
+        checkpoint (pathlib.Path): the checkpoint raster
+        years (list): the years of the land covers of the period
+
+    Returns:
+        (int): the last computed year of the checkpoint, None if it doesn't match the model
+    """
+    if not Path(checkpoint).is_file():
+        return None
+
+    with rio.open(checkpoint) as src:
+        tags = src.tags()
+
+    # the checkpoint can only move forward in the same period with the same coefficient
+    year = int(tags.get("year", 0))
+    if int(tags.get("start", 0)) != model.p_soc_t_start:
+        return None
+    if float(tags.get("conversion_coef", 0)) != (model.conversion_coef or -1):
+        return None
+    if year not in years:
+        return None
+
+    return year
+
+
+def soil_organic_carbon_raster(
+    model,
+    soc_file,
+    land_cover_file,
+    dst,
+    coef_file=None,
+    checkpoint=None,
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Compute the soc sub-indicator of local rasters with the windowed framework
+
+    When a checkpoint file is set, the state of the last year (stock, transition, years since
+    transition...) is saved in it. If it already holds the state of an earlier year of the
+    same period, the computation resumes from it instead of replaying all the years.
+
+    Args:
+        model (IndicatorModel): the model holding the soc period and climate coefficient
+        soc_file (pathlib.Path): the initial soil organic carbon stock raster
+        land_cover_file (pathlib.Path): the ESA CCI land covers aligned on soc_file, one band
+            per year of the period
+        dst (pathlib.Path): the output file
+        coef_file (pathlib.Path, optional): the per pixel climate conversion coefficient raster,
+            used when model.conversion_coef is not set
+        checkpoint (pathlib.Path, optional): the float32 state raster to resume from and update
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    coef_files = [coef_file] if coef_file else []
+
+    with rio.open(land_cover_file) as src:
+        n_years = src.count
+
+    # the land cover block, the state and the temporary masks
+    bytes_per_pixel = n_years + 5 * 4 + 2 + 1 + 3 * 1 + 2 * 4
+
+    if checkpoint is None:
+        return run_windowed(
+            partial(soc_kernel, model.conversion_coef),
+            [soc_file, land_cover_file] + coef_files,
+            dst,
+            bytes_per_pixel,
+            band_names=["soc"],
+            workers=workers,
+            memory_budget=memory_budget,
+        )
+
+    years = list(range(model.p_soc_t_start, model.p_soc_t_start + n_years))
+    last_year = checkpoint_year(model, checkpoint, years)
+
+    if last_year:
+        files = [checkpoint, land_cover_file] + coef_files
+        first_band = years.index(last_year) + 1
+        kernel = partial(soc_resume_kernel, model.conversion_coef, first_band)
+    else:
+        files = [soc_file, land_cover_file] + coef_files
+        kernel = partial(soc_kernel, model.conversion_coef, checkpoint=True)
+
+    # plus the saved state and the float32 output
+    bytes_per_pixel += 2 * 7 * 4
+    blocks = map_windows(
+        kernel, files, bytes_per_pixel, workers=workers, memory_budget=memory_budget
+    )
+
+    # the checkpoint can be an input so the new one replaces it at the end
+    profile = check_alignment(files)
+    tmp_file = Path(checkpoint).with_suffix(".tmp.tif")
+    state_profile = output_profile(profile, len(SocState.bands), np.float32, None)
+
+    with rio.open(dst, "w", **output_profile(profile)) as dest, rio.open(
+        tmp_file, "w", **state_profile
+    ) as state_dest:
+        for window, result in blocks:
+            dest.write(result[:1].astype(np.uint8), window=window)
+            state_dest.write(result[1:], window=window)
+
+        dest.descriptions = ("soc",)
+        state_dest.descriptions = tuple(SocState.bands)
+        state_dest.update_tags(
+            start=model.p_soc_t_start,
+            year=years[-1],
+            conversion_coef=model.conversion_coef or -1,
+        )
+
+    tmp_file.replace(checkpoint)
+
+    return dst
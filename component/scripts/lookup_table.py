@@ -0,0 +1,336 @@
+from functools import partial
+
+import ee
+import numpy as np
+import rasterio as rio
+
+from component import parameter as pm
+from .windowed import run_windowed
+
+
+def np_remap_table(from_, to_, size=256, dtype=np.uint8, default=0):
+    """Compile remap lists in a dense array indexed by the original values
+
+    Args:
+        from_ (list): the original values, they need to be smaller than size
+        to_ (list): the new values
+        size (int): the number of entries of the table (256 for uint8 inputs, 65536 for uint16)
+        dtype (np.dtype): the type of the new values
+        default: the value of the entries missing from from_
+
+    Returns:
+        (np.ndarray): the look up table, use it with np.take or fancy indexing
+    """
+    lut = np.full(size, default, dtype=dtype)
+    lut[np.asarray(from_, dtype=np.int64)] = to_
+
+    return lut
+
+
+def ee_lookup_table(matrix):
+    """Compile a look up table matrix in the from/to lists of ee.Image.remap
+
+    Args:
+        matrix (list): the [a, b, c, value] rows of the look up table
+
+    Returns:
+        (tuple): the a*100 + b*10 + c codes and their values
+    """
+    from_ = [a * 100 + b * 10 + c for a, b, c, _ in matrix]
+    to_ = [value for *_, value in matrix]
+
+    return from_, to_
+
+
+def np_lookup_table(matrix):
+    """Compile a look up table matrix in a dense uint8 array indexed by a << 4 | b << 2 | c
+
+    The 3 inputs are classes between 0 and 3 so they fit in 2 bits each.
+
+    Args:
+        matrix (list): the [a, b, c, value] rows of the look up table
+
+    Returns:
+        (np.ndarray): the 64 values of the look up table, 0 for the missing combinations
+    """
+    lut = np.zeros(64, dtype=np.uint8)
+    for a, b, c, value in matrix:
+        lut[a << 4 | b << 2 | c] = value
+
+    return lut
+
+
+# compile the look up tables once
+ee_lookup_tables = {
+    "GPGv2": ee_lookup_table(pm.productivity_gpgv2_matrix),
+    "GPGv1": ee_lookup_table(pm.productivity_gpgv1_matrix),
+    "indicator": ee_lookup_table(pm.indicator_matrix),
+}
+
+np_lookup_tables = {
+    "GPGv2": np_lookup_table(pm.productivity_gpgv2_matrix),
+    "GPGv1": np_lookup_table(pm.productivity_gpgv1_matrix),
+    "indicator": np_lookup_table(pm.indicator_matrix),
+}
+
+
+def ee_combine(name, a, b, c):
+    """Combine 3 class images with a single remap of their packed code
+
+    Args:
+        name (str): the name of the look up table
+        a, b, c (ee.Image): the class images in the order of the look up table columns
+
+    Returns:
+        (ee.Image): the combined uint8 image, 0 where the combination is not in the table
+    """
+    from_, to_ = ee_lookup_tables[name]
+    code = a.multiply(100).add(b.multiply(10)).add(c)
+
+    return code.remap(from_, to_, 0).unmask(0).uint8()
+
+
+def np_combine(name, a, b, c):
+    """Combine 3 class arrays with a single take on their packed uint8 index
+
+    Args:
+        name (str): the name of the look up table
+        a, b, c (np.ndarray): the class arrays (0 to 3) in the order of the look up table columns
+
+    Returns:
+        (np.ndarray): the combined uint8 array, 0 where the combination is not in the table
+    """
+    index = np.left_shift(a, 4, dtype=np.uint8)
+    index |= np.left_shift(b, 2, dtype=np.uint8)
+    index |= np.asarray(c, dtype=np.uint8)
+
+    return np.take(np_lookup_tables[name], index)
+
+
+def productivity_final_local(trajectory, performance, state, lookup_table="GPGv2"):
+    """Local counterpart of productivity_final and productivity_final_GPG1
+
+    Args:
+        trajectory (np.ndarray): the "trajectory" band
+        performance (np.ndarray): the "performance" band
+        state (np.ndarray): the "state" band
+        lookup_table (str): the name of the productivity look up table (GPGv2 or GPGv1)
+
+    Returns:
+        (np.ndarray): the uint8 productivity sub-indicator
+    """
+    return np_combine(lookup_table, trajectory, state, performance)
+
+
+def indicator_15_3_1_local(productivity, degradation, soc, water):
+    """Local counterpart of indicator_15_3_1
+
+    Args:
+        productivity (np.ndarray): the productivity sub-indicator
+        degradation (np.ndarray): the land cover "degradation" band
+        soc (np.ndarray): the soc sub-indicator
+        water (np.ndarray): the water mask, water pixels are set to 0
+
+    Returns:
+        (np.ndarray): the uint8 indicator
+    """
+    indicator = np_combine("indicator", productivity, degradation, soc)
+    indicator[np.asarray(water, dtype=bool)] = 0
+
+    return indicator
+
+
+def productivity_final_kernel(lookup_table, trajectory, performance, state):
+    """Combine the trajectory, performance and state rasters blocks"""
+
+    return productivity_final_local(
+        trajectory[-1], performance[-1], state[-1], lookup_table
+    )
+
+
+def indicator_15_3_1_kernel(productivity, land_cover, soc):
+    """Combine the productivity, land cover and soc rasters blocks"""
+
+    return indicator_15_3_1_local(productivity[0], land_cover[0], soc[0], land_cover[4])
+
+
+def productivity_final_raster(
+    trajectory_file,
+    performance_file,
+    state_file,
+    dst,
+    lookup_table="GPGv2",
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Compute the productivity sub-indicator from the local productivity metrics rasters
+
+    The last band of each raster is used ("trajectory", "performance" and "state").
+    """
+    return run_windowed(
+        partial(productivity_final_kernel, lookup_table),
+        [trajectory_file, performance_file, state_file],
+        dst,
+        bytes_per_pixel=5 * 2,
+        band_names=["productivity"],
+        workers=workers,
+        memory_budget=memory_budget,
+    )
+
+
+def indicator_15_3_1_raster(
+    productivity_file,
+    land_cover_file,
+    soc_file,
+    dst,
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Compute the indicator from the local productivity, land cover and soc rasters"""
+
+    return run_windowed(
+        indicator_15_3_1_kernel,
+        [productivity_file, land_cover_file, soc_file],
+        dst,
+        bytes_per_pixel=1 + 5 * 2 + 1 + 2,
+        band_names=["indicator_15_3_1"],
+        workers=workers,
+        memory_budget=memory_budget,
+    )
+
+
+# the position of the sub-indicators (0 to 3) in the packed byte, 2 bits each
+packed_shifts = {"productivity": 6, "land_cover": 4, "soc": 2, "indicator": 0}
+
+
+def ee_pack(productivity, degradation, soc, indicator):
+    """Pack the sub-indicators and the indicator in a single uint8 image, 2 bits each
+
+    The masked pixels of a layer are packed as 0 (nodata) so they don't hide the other layers.
+
+    Args:
+        productivity (ee.Image): the productivity sub-indicator
+        degradation (ee.Image): the land cover "degradation" band
+        soc (ee.Image): the soc sub-indicator
+        indicator (ee.Image): the indicator
+
+    Returns:
+        (ee.Image): the "packed" uint8 image, decode it with PackedLayers
+    """
+    layers = [productivity, degradation, soc, indicator]
+    packed = ee.Image(0)
+    for layer, shift in zip(layers, packed_shifts.values()):
+        packed = packed.bitwiseOr(layer.unmask(0).uint8().leftShift(shift))
+
+    return packed.rename("packed").uint8()
+
+
+def np_pack(productivity, degradation, soc, indicator):
+    """Local counterpart of ee_pack"""
+
+    layers = [productivity, degradation, soc, indicator]
+    packed = np.zeros(np.shape(productivity), dtype=np.uint8)
+    for layer, shift in zip(layers, packed_shifts.values()):
+        packed |= np.left_shift(layer, shift, dtype=np.uint8)
+
+    return packed
+
+
+class PackedLayers:
+    """Decoder of the packed sub-indicators
+
+    The packed array is kept as is (e.g. a np.memmap or a shared array) and a layer is only
+    decoded when it is requested, from the requested region. Pass an out array to decode a
+    layer without allocating memory.
+
+    Args:
+        packed (np.ndarray): the packed uint8 array
+    """
+
+    names = list(packed_shifts)
+
+    def __init__(self, packed):
+        self.packed = packed
+
+    @classmethod
+    def from_file(cls, file, window=None):
+        """Read the packed band of a raster, or a window of it"""
+
+        with rio.open(file) as src:
+            return cls(src.read(1, window=window))
+
+    def layer(self, name, key=..., out=None):
+        """Decode a layer
+
+        Args:
+            name (str): the layer, one of "productivity", "land_cover", "soc" and "indicator"
+            key (slice, optional): the region of the packed array to decode
+            out (np.ndarray, optional): the uint8 array receiving the layer
+
+        Returns:
+            (np.ndarray): the uint8 layer (0 to 3)
+        """
+        out = np.right_shift(self.packed[key], packed_shifts[name], out=out)
+
+        return np.bitwise_and(out, 3, out=out)
+
+    def __getitem__(self, name):
+        return self.layer(name)
+
+
+def packed_kernel(productivity, land_cover, soc, indicator):
+    """Pack the productivity, land cover, soc and indicator rasters blocks"""
+
+    return np_pack(productivity[0], land_cover[0], soc[0], indicator[0])
+
+
+def unpack_kernel(name, packed):
+    """Decode a layer of the packed raster blocks"""
+
+    return PackedLayers(packed[0]).layer(name)
+
+
+def packed_raster(
+    productivity_file,
+    land_cover_file,
+    soc_file,
+    indicator_file,
+    dst,
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Pack the local sub-indicators and indicator rasters in a single uint8 raster"""
+
+    return run_windowed(
+        packed_kernel,
+        [productivity_file, land_cover_file, soc_file, indicator_file],
+        dst,
+        bytes_per_pixel=1 + 5 * 2 + 1 + 1 + 1,
+        band_names=["packed"],
+        workers=workers,
+        memory_budget=memory_budget,
+    )
+
+
+def unpack_raster(packed_file, dsts, workers=1, memory_budget=pm.local_memory_budget):
+    """Decode a packed raster in a raster per layer
+
+    Args:
+        packed_file (pathlib.Path): the packed raster
+        dsts (dict): the output file of the layers to decode by name
+
+    Returns:
+        (dict): the dsts
+    """
+    for name, dst in dsts.items():
+        run_windowed(
+            partial(unpack_kernel, name),
+            [packed_file],
+            dst,
+            bytes_per_pixel=2,
+            band_names=[name],
+            workers=workers,
+            memory_budget=memory_budget,
+        )
+
+    return dsts
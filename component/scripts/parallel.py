@@ -0,0 +1,164 @@
+import mmap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArray:
+    """Read-only array shared with the worker processes instead of being pickled
+
+    Memory-mapped arrays are reopened from their file in each worker, the other arrays are
+    copied once in a multiprocessing.shared_memory block. Only the handle (name, shape, dtype)
+    is pickled with the tasks.
+
+    Args:
+        array (np.ndarray): the array to share, it can be a np.memmap
+    """
+
+    def __init__(self, array):
+        self.shape = array.shape
+        self.dtype = np.dtype(array.dtype)
+        self.filename = None
+        self.offset = 0
+        self.name = None
+        self._shm = None
+        self._owner = False
+        self._array = None
+
+        # only the arrays mapped from the start of their buffer can be reopened
+        if (
+            isinstance(array, np.memmap)
+            and isinstance(array.base, mmap.mmap)
+            and array.flags.c_contiguous
+        ):
+            self.filename, self.offset = array.filename, array.offset
+        else:
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=max(1, array.nbytes)
+            )
+            self._owner = True
+            self.name = self._shm.name
+            np.ndarray(self.shape, self.dtype, buffer=self._shm.buf)[...] = array
+
+    def __getstate__(self):
+        return {
+            "shape": self.shape,
+            "dtype": self.dtype,
+            "filename": self.filename,
+            "offset": self.offset,
+            "name": self.name,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+        self._owner = False
+        self._array = None
+
+    @property
+    def array(self):
+        """The shared data as a read-only np.ndarray, attached on first access"""
+
+        if self._array is None:
+            if self.filename is not None:
+                self._array = np.memmap(
+                    self.filename, self.dtype, "r", self.offset, self.shape
+                )
+            else:
+                if self._shm is None:
+                    self._shm = _attach(self.name)
+                self._array = np.ndarray(self.shape, self.dtype, buffer=self._shm.buf)
+                self._array.flags.writeable = False
+
+        return self._array
+
+    def __array__(self, dtype=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __getitem__(self, key):
+        return self.array[key]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def close(self):
+        """Detach the array and free the shared memory block if it was created here"""
+
+        self._array = None
+        if self._shm is not None:
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _attach(name):
+    """Attach an existing shared memory block without registering it for cleanup"""
+
+    # the block is owned (and unlinked) by the parent process
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+@contextmanager
+def shared_arrays(*arrays, workers=1):
+    """Share arrays with the worker processes for the duration of the context
+
+    The arrays are returned unchanged when a single process is used, None values are kept.
+
+    Args:
+        arrays (np.ndarray): the read-only arrays used by the kernels
+        workers (int): the number of processes
+
+    Returns:
+        (list): the SharedArray (or the original array) of each input
+    """
+    if workers <= 1:
+        yield list(arrays)
+        return
+
+    shared = [None if array is None else SharedArray(array) for array in arrays]
+    try:
+        yield shared
+    finally:
+        [array.close() for array in shared if array is not None]
+
+
+def ordered_map(function, items, workers=1):
+    """Apply a function to every item in a process pool and yield the results in order
+
+    The number of tasks in flight is bounded to twice the number of workers so the results
+    waiting for the writer never exceed a few blocks.
+
+    Args:
+        function (callable): picklable function, use functools.partial to bind its parameters
+        items (iterable): the arguments of each call
+        workers (int): the number of processes, the items are processed in this process if 1
+
+    Returns:
+        (generator): the result of each item, in order
+    """
+    if workers <= 1:
+        yield from map(function, items)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(function, item))
+            if len(futures) >= 2 * workers:
+                yield futures.popleft().result()
+
+        while futures:
+            yield futures.popleft().result()
@@ -4,6 +4,7 @@ import ee
 # import json
 
 from component import parameter as pm
+from .lookup_table import ee_combine
 
 
 def productivity_trajectory(
@@ -249,173 +250,29 @@ def productivity_state(aoi_model, model, integrated_annual_vi, output):
 
 
 def productivity_final(trajectory, performance, state, output):
-    trajectory_class = trajectory.select("trajectory")
-    performance_class = performance.select("performance")
-    state_class = state.select("state")
+    """Combine the productivity metrics with the GPGv2 look up table"""
 
-    productivity = (
-        ee.Image(0)
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(1)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(1)).And(performance_class.eq(2)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(2)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(2)).And(performance_class.eq(2)),
-            2,
-        )
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(3)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(3)).And(performance_class.eq(2)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(1)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(1)).And(performance_class.eq(2)),
-            2,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(2)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(2)).And(performance_class.eq(2)),
-            2,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(3)).And(performance_class.eq(1)),
-            2,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(3)).And(performance_class.eq(2)),
-            2,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(1)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(1)).And(performance_class.eq(2)),
-            3,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(2)).And(performance_class.eq(1)),
-            3,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(2)).And(performance_class.eq(2)),
-            3,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(3)).And(performance_class.eq(1)),
-            3,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(3)).And(performance_class.eq(2)),
-            3,
-        )
-        .rename("productivity")
+    productivity = ee_combine(
+        "GPGv2",
+        trajectory.select("trajectory"),
+        state.select("state"),
+        performance.select("performance"),
     )
 
-    return productivity.uint8()
+    return productivity.rename("productivity")
 
 
 def productivity_final_GPG1(trajectory, performance, state, output):
-    trajectory_class = trajectory.select("trajectory")
-    performance_class = performance.select("performance")
-    state_class = state.select("state")
+    """Combine the productivity metrics with the GPGv1 look up table"""
 
-    productivity = (
-        ee.Image(0)
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(1)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(1)).And(performance_class.eq(2)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(2)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(2)).And(performance_class.eq(2)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(3)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(1).And(state_class.eq(3)).And(performance_class.eq(2)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(1)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(1)).And(performance_class.eq(2)),
-            2,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(2)).And(performance_class.eq(1)),
-            2,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(2)).And(performance_class.eq(2)),
-            2,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(3)).And(performance_class.eq(1)),
-            2,
-        )
-        .where(
-            trajectory_class.eq(2).And(state_class.eq(3)).And(performance_class.eq(2)),
-            2,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(1)).And(performance_class.eq(1)),
-            1,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(1)).And(performance_class.eq(2)),
-            3,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(2)).And(performance_class.eq(1)),
-            3,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(2)).And(performance_class.eq(2)),
-            3,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(3)).And(performance_class.eq(1)),
-            3,
-        )
-        .where(
-            trajectory_class.eq(3).And(state_class.eq(3)).And(performance_class.eq(2)),
-            3,
-        )
-        .rename("productivity")
+    productivity = ee_combine(
+        "GPGv1",
+        trajectory.select("trajectory"),
+        state.select("state"),
+        performance.select("performance"),
     )
 
-    return productivity.uint8()
+    return productivity.rename("productivity")
 
 
 def vi_trend(start, end, integrated_annual_vi):
@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from zipfile import ZipFile
 
 import ee
@@ -15,14 +17,32 @@ from component.message import cm
 
 from .gdrive import GDrive
 from .gee import wait_for_completion
-from .download import digest_tiles
+from .download import digest_tiles, digest_stack, cloud_optimize, legend_colormap
+from .direct_download import aoi_profile, download_direct, ee_tile_url
+from .lookup_table import ee_combine, ee_pack
+from .graph import Node, IndicatorGraph
 from .integration import *
 from .productivity import *
 from .soil_organic_carbon import *
 from .land_cover import *
 
 
-def download_maps(aoi_model, model, output):
+def download_maps(aoi_model, model, output, stacked=False, packed=False, direct=False):
+    """Export the result layers to the Gdrive, download them and merge their tiles
+
+    Args:
+        aoi_model (AoiModel): the AOI
+        model (IndicatorModel): the model holding the result layers
+        output (Alert): the alert displaying the progress
+        stacked (bool): export all the layers in a single stacked image split locally
+        packed (bool): replace the land cover, soc, productivity and indicator layers by a
+            single uint8 "packed" layer holding their classes on 2 bits each (see PackedLayers)
+        direct (bool): download the pixels of each layer with direct requests instead of
+            exporting them to the Gdrive
+
+    Returns:
+        (tuple): the merged file of each layer
+    """
     # create a result folder including the data parameters
     # create the aoi and parameter folder if not existing
     aoi_dir = pm.result_dir / su.normalize_str(aoi_model.name)
@@ -48,49 +68,193 @@ def download_maps(aoi_model, model, output):
         f"indicator_15_3_1": model.indicator_15_3_1,
     }
 
+    # the land cover is reduced to its degradation band in the packed layer
+    if packed:
+        core = ["land_cover", "soc", "productivity_indicator", "indicator_15_3_1"]
+        layers = {name: layer for name, layer in layers.items() if name not in core}
+        layers["packed"] = ee_pack(
+            model.productivity,
+            model.land_cover.select("degradation"),
+            model.soc,
+            model.indicator_15_3_1,
+        )
+
     # load the drive_handler
-    drive_handler = GDrive()
+    drive_handler = None if direct else GDrive()
 
     # clip the images if it's an administrative layer and keep the bounding box if not
     if aoi_model.feature_collection:
         geom = aoi_model.feature_collection.geometry()
         layers = {name: layer.clip(geom) for name, layer in layers.items()}
 
-    # download all files
-    downloads = any(
-        [
-            drive_handler.download_to_disk(
-                name, layer, aoi_model, output, scale, f"{pattern}_{name}"
+    dsts = {name: result_dir / f"{pattern}_{name}_merge.tif" for name in layers}
+    if direct:
+        download_layers(layers, dsts, aoi_model, scale, output)
+        exports = []
+    elif stacked:
+        export_stack(layers, pattern, dsts, aoi_model, scale, drive_handler, output)
+        exports = ["stack"]
+    else:
+        export_layers(layers, pattern, dsts, aoi_model, scale, drive_handler, output)
+        exports = list(layers)
+
+    # remove the files of all the exports from drive at once
+    if exports:
+        output.add_live_msg(cm.download.remove_gdrive)
+        files = [
+            f for name in exports for f in drive_handler.get_files(f"{pattern}_{name}")
+        ]
+        errors = drive_handler.delete_files(files)
+        if errors:
+            names = [f["name"] for f in files if f["id"] in errors]
+            msg = cm.gdrive.error.not_deleted.format(len(names), ", ".join(names))
+            output.add_live_msg(msg, "warning")
+
+    # display msg
+    output.add_live_msg(cm.download.completed, "success")
+
+    return tuple(dsts.values())
+
+
+def export_layers(layers, pattern, dsts, aoi_model, scale, drive_handler, output):
+    """Export each layer in its own task and digest it as soon as its task is finished"""
+
+    # launch the exports
+    for name, layer in layers.items():
+        drive_handler.download_to_disk(
+            name, layer, aoi_model, output, scale, f"{pattern}_{name}"
+        )
+
+    # digest each layer as soon as its own task is finished while the others keep running
+    task_layers = {id_: name for name, id_ in drive_handler.task_ids.items()}
+    with ThreadPoolExecutor(max_workers=len(layers)) as executor:
+        futures = []
+
+        def digest(name):
+            future = executor.submit(
+                digest_tiles,
+                f"{pattern}_{name}",
+                dsts[name].parent,
+                output,
+                dsts[name],
+                drive_handler,
+                name != "packed",
+            )
+            futures.append(future)
+
+        def on_finish(task):
+            if task["state"] == "COMPLETED":
+                name = task_layers[task["id"]]
+                output.add_live_msg(cm.download.layer_ready.format(name))
+
+                # list the new files of the layer
+                drive_handler.refresh()
+                digest(name)
+
+        # the layers already available in the drive don't need to wait
+        [digest(name) for name in layers if name not in drive_handler.task_ids]
+
+        if task_layers:
+            wait_for_completion(
+                list(layers), output, list(task_layers), on_finish=on_finish
             )
+        output.add_live_msg(cm.gee.tasks_completed, "success")
+
+        # raise the errors of the merges
+        [future.result() for future in futures]
+
+    return dsts
+
+
+def export_stack(layers, pattern, dsts, aoi_model, scale, drive_handler, output):
+    """Export all the layers in a single uint16 stacked image and split it locally
+
+    The upstream maps shared by the layers are evaluated once and a single set of tiles goes
+    through the Gdrive. The band manifest of the stack is saved next to the results.
+    """
+    manifest = layer_manifest(layers)
+    manifest_file = next(iter(dsts.values())).with_name(f"{pattern}_stack.json")
+    manifest_file.write_text(json.dumps(manifest, indent=2))
+
+    # prefix the band names to keep them unique
+    stack = ee.Image.cat(
+        [
+            layer.rename([f"{name}_{b}" for b in manifest[name]["bands"]]).uint16()
             for name, layer in layers.items()
         ]
     )
 
-    # I assume that they are always launch at the same time
-    # If not it's going to crash
-    if downloads:
-        wait_for_completion([name for name in layers], output)
+    drive_handler.download_to_disk(
+        "stack", stack, aoi_model, output, scale, f"{pattern}_stack"
+    )
+    if drive_handler.task_ids:
+        wait_for_completion(["stack"], output, list(drive_handler.task_ids.values()))
+        drive_handler.refresh()
     output.add_live_msg(cm.gee.tasks_completed, "success")
 
-    # digest the tiles
-    for name in layers:
-        digest_tiles(
-            f"{pattern}_{name}",
-            result_dir,
-            output,
-            result_dir / f"{pattern}_{name}_merge.tif",
-        )
+    result_dir = manifest_file.parent
+    digest_stack(f"{pattern}_stack", result_dir, output, manifest, dsts, drive_handler)
 
-    output.add_live_msg(cm.download.remove_gdrive)
+    return dsts
 
-    # remove the files from drive
-    for name in layers:
-        drive_handler.delete_files(drive_handler.get_files(f"{pattern}_{name}"))
 
-    # display msg
-    output.add_live_msg(cm.download.completed, "success")
+def layer_manifest(layers):
+    """Return the band names and local type of each layer
+
+    Args:
+        layers (dict): the ee.Image of each layer
+
+    Returns:
+        (dict): the "bands", "dtype" and "legend" (the first band holds legend classes) of each
+            layer
+    """
+    # the bands of each layer, in a single request
+    bands = ee.Dictionary(
+        {name: layer.bandNames() for name, layer in layers.items()}
+    ).getInfo()
+
+    # the land cover transition codes need 16 bits, the other layers are classes
+    # the packed layer holds bit fields, not legend classes
+    return {
+        name: {
+            "bands": bands[name],
+            "dtype": "uint16" if name == "land_cover" else "uint8",
+            "legend": name != "packed",
+        }
+        for name in layers
+    }
 
-    return tuple([result_dir / f"{pattern}_{name}_merge.tif" for name in layers])
+
+def download_layers(layers, dsts, aoi_model, scale, output):
+    """Download the pixels of each layer with direct requests, without the Gdrive
+
+    The AOI is split in request-sized tiles fetched in parallel (see download_direct).
+    """
+    manifest = layer_manifest(layers)
+    bounds = aoi_model.gdf.total_bounds
+
+    for name, layer in layers.items():
+        dst = dsts[name]
+        if dst.is_file():
+            output.add_live_msg(cm.download.file_exist.format(dst), "warning")
+            continue
+
+        output.add_live_msg(cm.download.direct.format(name))
+        bands, dtype = manifest[name]["bands"], manifest[name]["dtype"]
+        profile = aoi_profile(bounds, scale, len(bands), dtype)
+
+        # download in a hidden file and write the final file as a COG
+        tmp_file = dst.with_name(f".{dst.name}")
+        download_direct(
+            partial(ee_tile_url, layer, profile),
+            profile,
+            tmp_file,
+            colormap=legend_colormap() if manifest[name]["legend"] else None,
+        )
+        cloud_optimize(tmp_file, dst)
+        tmp_file.unlink()
+
+    return dsts
 
 
 def display_maps(aoi_model, model, m, output):
@@ -161,45 +325,162 @@ def display_maps(aoi_model, model, m, output):
     return
 
 
-def compute_indicator_maps(aoi_model, model, output):
-    # raise an error if the years are not in the right order
-    if not (model.start < model.end):
-        raise Exception(cm.error.wrong_year)
+# the traits setting the years integrated in the annual stacks
+period_traits = [
+    "start",
+    "end",
+    "trend_start",
+    "trend_end",
+    "state_start",
+    "state_end",
+    "performance_start",
+    "performance_end",
+]
 
-    # compute intermediary maps
-    vi_int, climate_int = integrate_ndvi_climate(aoi_model, model, output)
-    model.productivity_trend = productivity_trajectory(
-        model, vi_int, climate_int, output
-    )
-    model.productivity_performance = productivity_performance(
-        aoi_model, model, vi_int, climate_int, output
-    )
-    model.productivity_state = productivity_state(aoi_model, model, vi_int, output)
 
-    # compute result maps
-    model.land_cover = land_cover(model, aoi_model, output)
-    model.soc = soil_organic_carbon(model, aoi_model, output)
+def _productivity(aoi_model, model, output, trajectory, performance, state):
+    """Combine the productivity metrics with the selected look up table"""
+
     if model.productivity_lookup_table == "GPGv2":
-        model.productivity = productivity_final(
-            model.productivity_trend,
-            model.productivity_performance,
-            model.productivity_state,
-            output,
-        )
+        return productivity_final(trajectory, performance, state, output)
     else:
-        model.productivity = productivity_final_GPG1(
-            model.productivity_trend,
-            model.productivity_performance,
-            model.productivity_state,
-            output,
-        )
+        return productivity_final_GPG1(trajectory, performance, state, output)
 
-    # sum up in a map
-    model.indicator_15_3_1 = indicator_15_3_1(
-        model.productivity, model.land_cover, model.soc, output
-    )
 
-    return
+def indicator_graph(cache_size=1):
+    """Build the dependency graph of the indicator maps
+
+    Args:
+        cache_size (int): the number of results kept by each node
+
+    Returns:
+        (IndicatorGraph): the graph of the intermediary and result maps
+    """
+    nodes = [
+        Node(
+            "vi",
+            lambda a, m, o: integrate_vi(a, m),
+            ["sensors", "vegetation_index", "threshold", *period_traits],
+            aoi=True,
+        ),
+        Node(
+            "climate",
+            lambda a, m, o: integrate_climate(a, m),
+            period_traits,
+            aoi=True,
+        ),
+        Node(
+            "trajectory",
+            lambda a, m, o, vi, clim: productivity_trajectory(m, vi, clim, o),
+            ["trajectory", "start", "end", "trend_start", "trend_end"],
+            ["vi", "climate"],
+        ),
+        Node(
+            "performance",
+            lambda a, m, o, vi, clim: productivity_performance(a, m, vi, clim, o),
+            [
+                "lceu",
+                "sensors",
+                "start",
+                "end",
+                "performance_start",
+                "performance_end",
+                "landcover_t_start",
+            ],
+            ["vi", "climate"],
+            aoi=True,
+        ),
+        Node(
+            "state",
+            lambda a, m, o, vi: productivity_state(a, m, vi, o),
+            ["start", "end", "state_start", "state_end"],
+            ["vi"],
+            aoi=True,
+        ),
+        Node(
+            "land_cover",
+            lambda a, m, o: land_cover(m, a, o),
+            [
+                "start",
+                "end",
+                "landcover_t_start",
+                "landcover_t_end",
+                "start_lc",
+                "start_lc_band",
+                "end_lc",
+                "end_lc_band",
+                "transition_matrix",
+                "custom_matrix_file",
+                "water_mask_pixel",
+                "water_mask_asset_id",
+                "water_mask_asset_band",
+                "seasonality",
+            ],
+            aoi=True,
+            files=["custom_matrix_file"],
+        ),
+        Node(
+            "soc",
+            lambda a, m, o: soil_organic_carbon(m, a, o),
+            [
+                "start",
+                "end",
+                "soc_t_start",
+                "soc_t_end",
+                "conversion_coef",
+                "soc_checkpoint",
+            ],
+            aoi=True,
+        ),
+        Node(
+            "productivity",
+            _productivity,
+            ["productivity_lookup_table"],
+            ["trajectory", "performance", "state"],
+        ),
+        Node(
+            "indicator",
+            lambda a, m, o, prod, lc, soc: indicator_15_3_1(prod, lc, soc, o),
+            parents=["productivity", "land_cover", "soc"],
+        ),
+    ]
+
+    for node in nodes:
+        node.cache_size = cache_size
+
+    return IndicatorGraph(nodes)
+
+
+# the graph is kept between the runs so that the unchanged maps are reused
+maps_graph = indicator_graph()
+
+# the model trait set by each node
+graph_outputs = {
+    "trajectory": "productivity_trend",
+    "performance": "productivity_performance",
+    "state": "productivity_state",
+    "land_cover": "land_cover",
+    "soc": "soc",
+    "productivity": "productivity",
+    "indicator": "indicator_15_3_1",
+}
+
+
+def compute_indicator_maps(aoi_model, model, output, graph=None):
+    # raise an error if the years are not in the right order
+    if not (model.start < model.end):
+        raise Exception(cm.error.wrong_year)
+
+    # compute only the maps whose parameters changed since the last run
+    graph = graph or maps_graph
+    results, reused = graph.evaluate(aoi_model, model, output)
+    if reused:
+        output.add_live_msg(cm.gee.reused.format(", ".join(reused)))
+
+    for name, trait in graph_outputs.items():
+        setattr(model, trait, results[name])
+
+    return reused
 
 
 def compute_lc_transition_stats(aoi_model, model):
@@ -367,39 +648,8 @@ def indicator_15_3_1(productivity, landcover, soc, output):
     water = landcover.select("water")
     landcover = landcover.select("degradation")
 
-    indicator = (
-        ee.Image(0)
-        .where(productivity.eq(3).And(landcover.eq(3)).And(soc.eq(3)), 3)
-        .where(productivity.eq(3).And(landcover.eq(3)).And(soc.eq(2)), 3)
-        .where(productivity.eq(3).And(landcover.eq(3)).And(soc.eq(1)), 1)
-        .where(productivity.eq(3).And(landcover.eq(2)).And(soc.eq(3)), 3)
-        .where(productivity.eq(3).And(landcover.eq(2)).And(soc.eq(2)), 3)
-        .where(productivity.eq(3).And(landcover.eq(2)).And(soc.eq(1)), 1)
-        .where(productivity.eq(3).And(landcover.eq(1)).And(soc.eq(3)), 1)
-        .where(productivity.eq(3).And(landcover.eq(1)).And(soc.eq(2)), 1)
-        .where(productivity.eq(3).And(landcover.eq(1)).And(soc.eq(1)), 1)
-        .where(productivity.eq(2).And(landcover.eq(3)).And(soc.eq(3)), 3)
-        .where(productivity.eq(2).And(landcover.eq(3)).And(soc.eq(2)), 3)
-        .where(productivity.eq(2).And(landcover.eq(3)).And(soc.eq(1)), 1)
-        .where(productivity.eq(2).And(landcover.eq(2)).And(soc.eq(3)), 3)
-        .where(productivity.eq(2).And(landcover.eq(2)).And(soc.eq(2)), 2)
-        .where(productivity.eq(2).And(landcover.eq(2)).And(soc.eq(1)), 1)
-        .where(productivity.eq(2).And(landcover.eq(1)).And(soc.eq(3)), 1)
-        .where(productivity.eq(2).And(landcover.eq(1)).And(soc.eq(2)), 1)
-        .where(productivity.eq(2).And(landcover.eq(1)).And(soc.eq(1)), 1)
-        .where(productivity.eq(1).And(landcover.eq(3)).And(soc.eq(3)), 1)
-        .where(productivity.eq(1).And(landcover.eq(3)).And(soc.eq(2)), 1)
-        .where(productivity.eq(1).And(landcover.eq(3)).And(soc.eq(1)), 1)
-        .where(productivity.eq(1).And(landcover.eq(2)).And(soc.eq(3)), 1)
-        .where(productivity.eq(1).And(landcover.eq(2)).And(soc.eq(2)), 1)
-        .where(productivity.eq(1).And(landcover.eq(2)).And(soc.eq(1)), 1)
-        .where(productivity.eq(1).And(landcover.eq(1)).And(soc.eq(3)), 1)
-        .where(productivity.eq(1).And(landcover.eq(1)).And(soc.eq(2)), 1)
-        .where(productivity.eq(1).And(landcover.eq(1)).And(soc.eq(1)), 1)
-        .where(productivity.eq(1).And(landcover.lt(1)).And(soc.lt(1)), 1)
-        .where(productivity.lt(1).And(landcover.eq(1)).And(soc.lt(1)), 1)
-        .where(productivity.lt(1).And(landcover.lt(1)).And(soc.eq(1)), 1)
-    )
+    # one out all out rule
+    indicator = ee_combine("indicator", productivity, landcover, soc)
 
     return indicator.where(water, 0).uint8()
 
@@ -1,11 +1,113 @@
+import hashlib
+import json
+
 import ee
 
 from component import parameter as pm
+from .graph import aoi_key
 
 
 def soil_organic_carbon(model, aoi_model, output):
-    """Calculate soil organic carbon indicator"""
+    """Calculate soil organic carbon indicator
+
+    If model.soc_checkpoint is set the computation is resumed from this asset instead of
+    replaying every year from the start of the period (see export_soc_checkpoint).
+    """
+
+    checkpoint = None
+    if model.soc_checkpoint:
+        checkpoint = ee.Image(model.soc_checkpoint)
+
+    state = soil_organic_carbon_state(model, aoi_model, checkpoint)
+
+    # Compute soc percent change for the analysis period
+    soc_percent_change = (
+        state.select("stock")
+        .subtract(state.select("initial"))
+        .divide(state.select("initial"))
+        .multiply(100)
+    )
+
+    # use the bytes convention
+    # 1 degraded - 2 stable - 3 improved
+    soc_class = (
+        ee.Image(0)
+        .where(soc_percent_change.gt(10), 3)
+        .where(soc_percent_change.lt(10).And(soc_percent_change.gt(-10)), 2)
+        .where(soc_percent_change.lt(-10), 1)
+        .rename("soc")
+        .uint8()
+    )
+
+    return soc_class
+
 
+def soc_land_cover_key():
+    """Return a hash of the land cover inputs of the soil organic carbon
+
+    The land cover collection, its translation to the IPCC classes and the stock change factors
+    of the transitions.
+    """
+    inputs = [
+        pm.land_cover_ic,
+        pm.translation_matrix,
+        pm.IPCC_lc_change_matrix,
+        pm.c_conversion_factor,
+        pm.management_factor,
+        pm.input_factor,
+    ]
+
+    return hashlib.sha1(json.dumps(inputs).encode()).hexdigest()
+
+
+def soc_checkpoint_year(model, aoi_model, checkpoint):
+    """Return the last year of a soc checkpoint if it can be used to resume the model period
+
+    Args:
+        model (IndicatorModel): the model holding the soc period and climate coefficient
+        aoi_model (AoiModel): the model holding the AOI
+        checkpoint (ee.Image): the checkpoint asset
+
+    Returns:
+        (int): the last computed year of the checkpoint, None if it doesn't match the model
+    """
+    properties = ["start", "year", "conversion_coef", "aoi", "land_cover"]
+    info = checkpoint.toDictionary(properties).getInfo()
+
+    lc_year_end = min(
+        max(model.p_soc_t_end, pm.land_cover_first_year), pm.land_cover_max_year
+    )
+
+    # the checkpoint can only move forward in the same period with the same coefficient, AOI
+    # and land cover inputs
+    if info.get("aoi") != aoi_key(aoi_model):
+        return None
+    if info.get("land_cover") != soc_land_cover_key():
+        return None
+    if info.get("start") != model.p_soc_t_start:
+        return None
+    if info.get("conversion_coef") != (model.conversion_coef or -1):
+        return None
+    if not (model.p_soc_t_start + 1 <= info.get("year", 0) <= lc_year_end):
+        return None
+
+    return info["year"]
+
+
+def soil_organic_carbon_state(model, aoi_model, checkpoint=None):
+    """Compute the per pixel state of the soil organic carbon at the end of the period
+
+    Args:
+        model (IndicatorModel): the model holding the soc period and climate coefficient
+        aoi_model (AoiModel): the model holding the AOI
+        checkpoint (ee.Image, optional): a state computed for an earlier end year of the same
+            period, the computation is resumed from its last year if it matches the model
+
+    Returns:
+        (ee.Image): the "stock", "initial", "change", "transition" and "years" (since the last
+            transition) bands with the "start", "year", "conversion_coef", "aoi" and
+            "land_cover" properties (see soc_checkpoint_year)
+    """
     soc = ee.Image(pm.soc).clip(aoi_model.feature_collection.geometry().bounds())
     soc = soc.updateMask(soc.neq(pm.int_16_min))
 
@@ -26,73 +128,83 @@ def soil_organic_carbon(model, aoi_model, output):
     else:
         climate_conversion_coef = model.conversion_coef
 
-    # compute the soc change for the first two years
+    # resume from the checkpoint or compute the soc change for the first two years
+    first_year = None
+    if checkpoint is not None:
+        first_year = soc_checkpoint_year(model, aoi_model, checkpoint)
 
-    lc_time0 = (
-        landcover.filter(
-            ee.Filter.calendarRange(model.p_soc_t_start, model.p_soc_t_start, "year")
-        )
-        .first()
-        .remap(pm.translation_matrix[0], pm.translation_matrix[1])
-    )
+    if first_year:
+        soc = checkpoint.select("initial")
+        stock = checkpoint.select("stock")
+        organic_carbon_change = checkpoint.select("change")
+        lc_transition = checkpoint.select("transition")
+        lc_transition_time = checkpoint.select("years")
 
-    lc_time1 = (
-        landcover.filter(
-            ee.Filter.calendarRange(
-                model.p_soc_t_start + 1, model.p_soc_t_start + 1, "year"
-            )
-        )
-        .first()
-        .remap(pm.translation_matrix[0], pm.translation_matrix[1])
-    )
+    else:
+        first_year = model.p_soc_t_start + 1
 
-    # compute transition map for the first two years(1st two digit for baseline land cover, 2nd two digits for target land cover)
-    lc_transition = lc_time0.multiply(100).add(lc_time1)
+        # compute the soc change for the first two years
 
-    # compute raster to register years since transition for the first and second year
-    lc_transition_time = ee.Image(2).where(lc_time0.neq(lc_time1), 1)
+        lc_time0 = (
+            landcover.filter(
+                ee.Filter.calendarRange(
+                    model.p_soc_t_start, model.p_soc_t_start, "year"
+                )
+            )
+            .first()
+            .remap(pm.translation_matrix[0], pm.translation_matrix[1])
+        )
 
-    # store change factor for land use
-    # 333 and -333 will be recoded using the chosen climate coef.
-    lc_transition_climate_coef_tmp = lc_transition.remap(
-        pm.IPCC_lc_change_matrix, pm.c_conversion_factor
-    )
-    lc_transition_climate_coef = lc_transition_climate_coef_tmp.where(
-        lc_transition_climate_coef_tmp.eq(333), climate_conversion_coef
-    ).where(
-        lc_transition_climate_coef_tmp.eq(-333),
-        ee.Image(1).divide(climate_conversion_coef),
-    )
+        lc_time1 = (
+            landcover.filter(
+                ee.Filter.calendarRange(
+                    model.p_soc_t_start + 1, model.p_soc_t_start + 1, "year"
+                )
+            )
+            .first()
+            .remap(pm.translation_matrix[0], pm.translation_matrix[1])
+        )
 
-    # store change factor for management regime
-    lc_transition_management_factor = lc_transition.remap(
-        pm.IPCC_lc_change_matrix, pm.management_factor
-    )
+        # compute transition map for the first two years(1st two digit for baseline land cover, 2nd two digits for target land cover)
+        lc_transition = lc_time0.multiply(100).add(lc_time1)
 
-    # store change factor for input of organic matter
-    lc_transition_organic_factor = lc_transition.remap(
-        pm.IPCC_lc_change_matrix, pm.input_factor
-    )
+        # compute raster to register years since transition for the first and second year
+        lc_transition_time = ee.Image(2).where(lc_time0.neq(lc_time1), 1)
 
-    organic_carbon_change = soc.subtract(
-        soc.multiply(lc_transition_climate_coef)
-        .multiply(lc_transition_management_factor)
-        .multiply(lc_transition_organic_factor)
-    ).divide(20)
+        # store change factor for land use
+        # 333 and -333 will be recoded using the chosen climate coef.
+        lc_transition_climate_coef_tmp = lc_transition.remap(
+            pm.IPCC_lc_change_matrix, pm.c_conversion_factor
+        )
+        lc_transition_climate_coef = lc_transition_climate_coef_tmp.where(
+            lc_transition_climate_coef_tmp.eq(333), climate_conversion_coef
+        ).where(
+            lc_transition_climate_coef_tmp.eq(-333),
+            ee.Image(1).divide(climate_conversion_coef),
+        )
 
-    # compute final soc for the period
-    soc_time1 = soc.subtract(organic_carbon_change)
+        # store change factor for management regime
+        lc_transition_management_factor = lc_transition.remap(
+            pm.IPCC_lc_change_matrix, pm.management_factor
+        )
 
-    # add to land cover and soc to stacks from both dates for the first period
-    lc_images = ee.Image(lc_time0).addBands(lc_time1)
+        # store change factor for input of organic matter
+        lc_transition_organic_factor = lc_transition.remap(
+            pm.IPCC_lc_change_matrix, pm.input_factor
+        )
 
-    soc_images = ee.Image(soc).addBands(soc_time1)
+        organic_carbon_change = soc.subtract(
+            soc.multiply(lc_transition_climate_coef)
+            .multiply(lc_transition_management_factor)
+            .multiply(lc_transition_organic_factor)
+        ).divide(20)
 
-    # Compute the soc change for the rest of  the years
-    # years = ee.List.sequence(1, model.end - model.start)
-    # soc_images = years.itterate(compute_soc, soc_images)
+        # compute the soc of the second year
+        stock = soc.subtract(organic_carbon_change)
 
-    for year in range(model.p_soc_t_start + 1, lc_year_end):
+    # Compute the soc change for the rest of the years
+    # only the stock of the previous year is needed
+    for year in range(first_year, lc_year_end):
         lc_time0 = (
             landcover.filter(ee.Filter.calendarRange(year, year, "year"))
             .first()
@@ -136,43 +248,62 @@ def soil_organic_carbon(model, aoi_model, output):
             pm.IPCC_lc_change_matrix, pm.input_factor
         )
 
-        year_index = year - model.p_soc_t_start
-
         organic_carbon_change = organic_carbon_change.where(
             lc_time0.neq(lc_time1),
-            soc_images.select(year_index)
-            .subtract(
-                soc_images.select(year_index)
-                .multiply(lc_transition_climate_coef)
+            stock.subtract(
+                stock.multiply(lc_transition_climate_coef)
                 .multiply(lc_transition_management_factor)
                 .multiply(lc_transition_organic_factor)
-            )
-            .divide(20),
+            ).divide(20),
         ).where(lc_transition_time.gt(20), 0)
 
-        soc_final = soc_images.select(year_index).subtract(organic_carbon_change)
+        stock = stock.subtract(organic_carbon_change)
 
-        lc_images = lc_images.addBands(lc_time1)
+    state = (
+        ee.Image.cat(
+            stock, soc, organic_carbon_change, lc_transition, lc_transition_time
+        )
+        .rename(["stock", "initial", "change", "transition", "years"])
+        .toFloat()
+        .set(
+            {
+                "start": model.p_soc_t_start,
+                "year": max(first_year, lc_year_end),
+                "conversion_coef": model.conversion_coef or -1,
+                "aoi": aoi_key(aoi_model),
+                "land_cover": soc_land_cover_key(),
+            }
+        )
+    )
 
-        soc_images = soc_images.addBands(soc_final)
+    return state
 
-    # Compute soc percent change for the analysis period
-    soc_percent_change = (
-        soc_images.select(lc_year_end - model.p_soc_t_start)
-        .subtract(soc_images.select(0))
-        .divide(soc_images.select(0))
-        .multiply(100)
-    )
 
-    # use the bytes convention
-    # 1 degraded - 2 stable - 3 improved
-    soc_class = (
-        ee.Image(0)
-        .where(soc_percent_change.gt(10), 3)
-        .where(soc_percent_change.lt(10).And(soc_percent_change.gt(-10)), 2)
-        .where(soc_percent_change.lt(-10), 1)
-        .rename("soc")
-        .uint8()
+def export_soc_checkpoint(model, aoi_model, asset_id, scale=None):
+    """Export the soil organic carbon state of the model period as an asset
+
+    Set model.soc_checkpoint to the asset id to resume the next computations from it.
+
+    Args:
+        model (IndicatorModel): the model holding the soc period and climate coefficient
+        aoi_model (AoiModel): the model holding the AOI
+        asset_id (str): the destination asset
+        scale (int, optional): the export scale, the one of the soc dataset by default
+
+    Returns:
+        (ee.batch.Task): the started export task
+    """
+    state = soil_organic_carbon_state(model, aoi_model)
+    scale = scale or ee.Image(pm.soc).projection().nominalScale().getInfo()
+
+    task = ee.batch.Export.image.toAsset(
+        image=state,
+        description=asset_id.split("/")[-1],
+        assetId=asset_id,
+        region=aoi_model.feature_collection.geometry().bounds(),
+        scale=scale,
+        maxPixels=1e13,
     )
+    task.start()
 
-    return soc_class
+    return task
@@ -0,0 +1,260 @@
+import json
+import hashlib
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import rasterio as rio
+from rasterio.crs import CRS
+from rasterio.windows import Window
+from sepal_ui.scripts import utils as su
+
+from component import parameter as pm
+from .parallel import ordered_map
+from .windowed import write_blocks
+
+
+def stack_key(aoi_name, sensors, vegetation_index, threshold):
+    """Return the key of the annual stacks computed with the same inputs
+
+    Args:
+        aoi_name (str): the name of the AOI
+        sensors (list): the sensors used to compute the VI
+        vegetation_index (str): the vegetation index
+        threshold (float): the VI threshold
+
+    Returns:
+        (str): the AOI name followed by a hash of the other parameters
+    """
+    params = json.dumps([sorted(sensors or []), vegetation_index, threshold])
+    digest = hashlib.sha1(params.encode()).hexdigest()[:10]
+
+    return f"{su.normalize_str(aoi_name)}_{digest}"
+
+
+class StackStore:
+    """Chunked memory-mapped store of the annual VI and climate stacks
+
+    The raster is split in square blocks. Each block of each variable ("vi", "clim") is a raw
+    float32 file holding its years one after the other, i.e. a (years, rows, cols) C-ordered
+    array, so the temporal reductions of a block read a single contiguous file. New years are
+    appended at the end of the block files and the blocks are opened as read-only np.memmap.
+    Missing values are stored as NaN.
+
+    Args:
+        root (pathlib.Path): the folder of the store
+        profile (dict, optional): the rasterio profile of the grid, required to create a new store
+        block_size (int): the size of the square blocks of a new store
+    """
+
+    def __init__(self, root, profile=None, block_size=512):
+        self.root = Path(root)
+        meta_file = self.root / "meta.json"
+
+        if meta_file.is_file():
+            self.meta = json.loads(meta_file.read_text())
+        elif profile is None:
+            raise Exception(f"There is no stack store in {self.root}")
+        else:
+            self.meta = {
+                "shape": [profile["height"], profile["width"]],
+                "block_size": block_size,
+                "transform": list(profile["transform"])[:6],
+                "crs": profile["crs"].to_wkt() if profile["crs"] else None,
+                "years": {},
+            }
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._save_meta()
+
+        if profile is not None:
+            self.check_grid(profile)
+
+    @classmethod
+    def from_models(cls, aoi_model, model, profile=None):
+        """Open (or create) the store of the annual stacks of a run in pm.stack_dir"""
+
+        key = stack_key(
+            aoi_model.name, model.sensors, model.vegetation_index, model.threshold
+        )
+
+        return cls(pm.stack_dir / key, profile)
+
+    def _save_meta(self):
+        """Write the metadata next to the blocks"""
+
+        # replace the file at once so that a reader never sees a partial file
+        tmp_file = self.root / "meta.json.tmp"
+        tmp_file.write_text(json.dumps(self.meta))
+        tmp_file.replace(self.root / "meta.json")
+
+    @property
+    def profile(self):
+        """The rasterio profile of the grid of the store"""
+
+        rows, cols = self.meta["shape"]
+        crs = self.meta["crs"]
+
+        return {
+            "height": rows,
+            "width": cols,
+            "transform": rio.Affine(*self.meta["transform"]),
+            "crs": CRS.from_wkt(crs) if crs else None,
+        }
+
+    def check_grid(self, profile):
+        """Check that a rasterio profile is aligned on the grid of the store"""
+
+        grid = [profile["height"], profile["width"]]
+        grid += list(profile["transform"])[:6]
+        if grid != self.meta["shape"] + self.meta["transform"]:
+            raise Exception(
+                f"The raster is not aligned with the stack store {self.root}"
+            )
+
+        return self
+
+    def years(self, name):
+        """Return the stored years of a variable"""
+
+        return self.meta["years"].get(name, [])
+
+    def has(self, name, year):
+        """Check if a year of a variable is stored"""
+
+        return year in self.years(name)
+
+    def windows(self):
+        """Return the window of each block, row by row"""
+
+        rows, cols = self.meta["shape"]
+        size = self.meta["block_size"]
+        for row in range(0, rows, size):
+            for col in range(0, cols, size):
+                yield Window(col, row, min(size, cols - col), min(size, rows - row))
+
+    def _block_file(self, name, window):
+        return self.root / name / f"{window.row_off}_{window.col_off}.f32"
+
+    def block(self, name, window):
+        """Open a block of a variable without copying it
+
+        Args:
+            name (str): the variable
+            window (Window): the window of the block, as returned by windows
+
+        Returns:
+            (np.memmap): the read-only (years, rows, cols) float32 block
+        """
+        shape = (len(self.years(name)), window.height, window.width)
+        file = self._block_file(name, window)
+
+        # the file and the metadata need to agree, otherwise the years would be misaligned
+        size = file.stat().st_size if file.is_file() else 0
+        if size != np.prod(shape) * 4:
+            raise Exception(
+                f"The block {file} holds {size} bytes instead of the {shape} float32 stack"
+            )
+
+        return np.memmap(file, np.float32, "r", shape=shape)
+
+    def _append(self, name, years, blocks):
+        """Append the (years, rows, cols) data of each (window, data) pair to the block files"""
+
+        stored = self.years(name)
+        if stored and min(years) <= stored[-1]:
+            raise Exception(
+                f"The years of {name} need to be added after {stored[-1]}, got {years}"
+            )
+
+        (self.root / name).mkdir(exist_ok=True)
+        for window, data in blocks:
+            file = self._block_file(name, window)
+            size = len(stored) * window.height * window.width * 4
+            if (file.stat().st_size if file.is_file() else 0) < size:
+                raise Exception(f"The block {file} is missing some of the stored years")
+
+            # drop the data of an interrupted append, its years are not in the metadata
+            with file.open("ab") as f:
+                f.truncate(size)
+                np.ascontiguousarray(data, dtype=np.float32).tofile(f)
+
+        self.meta["years"][name] = stored + list(years)
+        self._save_meta()
+
+        return self
+
+    def add_year(self, name, year, array):
+        """Append the (rows, cols) array of a year to a variable"""
+
+        array = np.asarray(array)
+        blocks = ((w, array[(None, *w.toslices())]) for w in self.windows())
+
+        return self._append(name, [year], blocks)
+
+    def add_raster(self, name, file, years):
+        """Append an annual raster (one band per year) to a variable
+
+        The years that are already stored are skipped. The raster is read block by block so the
+        memory used does not depend on its size.
+
+        Args:
+            name (str): the variable
+            file (pathlib.Path): the raster aligned on the store
+            years (list): the year of each band
+        """
+        with rio.open(file) as src:
+            self.check_grid(src.profile)
+
+        new = [(i + 1, y) for i, y in enumerate(years) if not self.has(name, y)]
+        if not new:
+            return self
+
+        indexes, new_years = zip(*new)
+
+        def blocks():
+            with rio.open(file) as src:
+                for window in self.windows():
+                    data = src.read(list(indexes), window=window).astype(np.float32)
+                    if src.nodata is not None:
+                        data[data == src.nodata] = np.nan
+                    yield window, data
+
+        return self._append(name, new_years, blocks())
+
+    def map_blocks(self, kernel, names, workers=1, with_window=False):
+        """Run a kernel on every block of the store
+
+        Each worker opens its blocks itself so only the results go through the process pool.
+
+        Args:
+            kernel (callable): picklable function called with the (years, rows, cols) block of
+                each variable
+            names (list): the variables
+            workers (int): the number of processes
+            with_window (bool): pass the window of the block as first argument of the kernel
+
+        Returns:
+            (generator): the (window, result) of each block, in order
+        """
+        run = partial(_run_store_block, kernel, self, names, with_window)
+
+        yield from ordered_map(run, self.windows(), workers)
+
+    def run(self, kernel, names, dst, workers=1, with_window=False, **kwargs):
+        """Run a kernel on every block of the store and write the results in a tiled GeoTIFF
+
+        The kwargs are the options of windowed.write_blocks (count, dtype, band_names...).
+        """
+        blocks = self.map_blocks(kernel, names, workers, with_window)
+
+        return write_blocks(blocks, dst, self.profile, **kwargs)
+
+
+def _run_store_block(kernel, store, names, with_window, window):
+    """Open the blocks of a window, run the kernel on them and return the window with the result"""
+
+    blocks = [store.block(name, window) for name in names]
+    if with_window:
+        blocks.insert(0, window)
+
+    return window, kernel(*blocks)
@@ -0,0 +1,149 @@
+from contextlib import contextmanager
+
+import ee
+import pandas as pd
+
+from component import parameter as pm
+from component.message import cm
+
+from .run_15_3_1 import indicator_graph
+
+
+@contextmanager
+def model_parameters(model, parameters):
+    """Set some traits of the model for the duration of the context
+
+    Args:
+        model (IndicatorModel): the model to update
+        parameters (dict): the trait values
+
+    Returns:
+        (IndicatorModel): the updated model, the original values are restored on exit
+    """
+    unknown = [name for name in parameters if not model.has_trait(name)]
+    if unknown:
+        raise Exception(f"{unknown} are not parameters of the indicator model")
+
+    backup = {name: getattr(model, name) for name in parameters}
+    try:
+        [setattr(model, name, value) for name, value in parameters.items()]
+        yield model
+    finally:
+        [setattr(model, name, value) for name, value in backup.items()]
+
+
+def sweep_indicators(aoi_model, model, combinations, output):
+    """Compute the indicator of every parameter combination
+
+    The combinations are evaluated with a single dependency graph that keeps the result of each
+    node for all of them, so the intermediary maps shared by several combinations (e.g. the
+    annual stacks of different trajectory methods) are only built once.
+
+    Args:
+        aoi_model (AoiModel): the AOI
+        model (IndicatorModel): the base parameters
+        combinations (list): the dict of the traits to change for each combination
+        output (Alert): the alert displaying the progress
+
+    Returns:
+        (list): the indicator ee.Image of each combination
+    """
+    graph = indicator_graph(cache_size=max(1, len(combinations)))
+
+    indicators = []
+    for i, parameters in enumerate(combinations):
+        with model_parameters(model, parameters):
+            if not (model.start < model.end):
+                raise Exception(cm.error.wrong_year)
+
+            results, reused = graph.evaluate(
+                aoi_model, model, output, targets=["indicator"]
+            )
+
+        indicators.append(results["indicator"])
+        if reused:
+            msg = cm.gee.reused.format(", ".join(reused))
+            output.add_live_msg(f"{i + 1}/{len(combinations)}: {msg}")
+
+    return indicators
+
+
+def sweep_area_tables(aoi_model, model, combinations, indicators):
+    """Compute the area of the indicator classes of every combination
+
+    The class masks of all the indicators computed at the same scale are stacked in one image
+    so the server evaluates the intermediary maps they share only once. The scale depends on the
+    sensors so the combinations changing them are reduced in one request per scale.
+
+    Args:
+        aoi_model (AoiModel): the AOI
+        model (IndicatorModel): the base parameters
+        combinations (list): the dict of the traits to change for each combination
+        indicators (list): the indicator ee.Image of each combination
+
+    Returns:
+        (list): the area (ha) of each class of each indicator as pd.DataFrame
+    """
+    scales = []
+    for parameters in combinations:
+        with model_parameters(model, parameters):
+            scales.append(model.scale)
+
+    pixel_area = ee.Image.pixelArea().divide(10000)
+
+    areas = {}
+    for scale in sorted(set(scales)):
+        bands = [
+            pixel_area.updateMask(indicators[i].eq(code)).rename(f"{i}_{code}")
+            for i in range(len(indicators))
+            if scales[i] == scale
+            for code in pm.degradation_class
+        ]
+
+        areas.update(
+            ee.Image(bands)
+            .reduceRegion(
+                **{
+                    "reducer": ee.Reducer.sum(),
+                    "geometry": aoi_model.feature_collection.geometry().bounds(),
+                    "scale": scale,
+                    "maxPixels": 1e13,
+                    "bestEffort": True,
+                    "tileScale": 2,
+                }
+            )
+            .getInfo()
+        )
+
+    tables = []
+    for i in range(len(indicators)):
+        data = [
+            [label, areas.get(f"{i}_{code}") or 0]
+            for code, label in pm.degradation_class.items()
+        ]
+        tables.append(pd.DataFrame(data, columns=["Indicator 15.3.1", "Area"]))
+
+    return tables
+
+
+def parameter_sweep(aoi_model, model, combinations, output):
+    """Run the indicator over many parameter combinations
+
+    Args:
+        aoi_model (AoiModel): the AOI
+        model (IndicatorModel): the base parameters
+        combinations (list): the dict of the traits to change for each combination, e.g.
+            [{"trajectory": "ndvi_trend"}, {"trajectory": "p_res_trend", "lceu": "aez"}]
+        output (Alert): the alert displaying the progress
+
+    Returns:
+        (list): the "parameters", "indicator" (ee.Image) and "area" (pd.DataFrame) of each
+            combination
+    """
+    indicators = sweep_indicators(aoi_model, model, combinations, output)
+    tables = sweep_area_tables(aoi_model, model, combinations, indicators)
+
+    return [
+        {"parameters": parameters, "indicator": indicator, "area": table}
+        for parameters, indicator, table in zip(combinations, indicators, tables)
+    ]
@@ -0,0 +1,267 @@
+from functools import partial
+
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+
+from component import parameter as pm
+from .parallel import ordered_map
+
+# size of the internal tiles of the outputs
+tile_size = 256
+
+
+def row_blocks(shape, bytes_per_pixel, memory_budget=pm.local_memory_budget):
+    """Split a raster in blocks of full rows that fit in the memory budget
+
+    When several tiles of rows fit in the budget, the blocks are aligned on the internal tiles
+    of the outputs.
+
+    Args:
+        shape (tuple): the (rows, cols) shape of the raster
+        bytes_per_pixel (int): the number of bytes needed to process a single pixel
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (generator): the row slices of each block
+    """
+    rows, cols = shape
+    block_rows = max(1, min(rows, memory_budget // max(1, cols * bytes_per_pixel)))
+    if block_rows > tile_size:
+        block_rows -= block_rows % tile_size
+
+    for row in range(0, rows, block_rows):
+        yield slice(row, min(row + block_rows, rows))
+
+
+def block_windows(
+    shape, bytes_per_pixel, memory_budget=pm.local_memory_budget, region=None
+):
+    """Same as row_blocks but return rasterio windows
+
+    Args:
+        region (Window, optional): only split this window of the raster
+    """
+    region = region or Window(0, 0, shape[1], shape[0])
+    shape = (int(region.height), int(region.width))
+    for block in row_blocks(shape, bytes_per_pixel, memory_budget):
+        yield Window(
+            region.col_off,
+            region.row_off + block.start,
+            shape[1],
+            block.stop - block.start,
+        )
+
+
+def check_alignment(files):
+    """Check that all the rasters share the same grid and return the profile of the first one"""
+
+    with rio.open(files[0]) as src:
+        profile = src.profile.copy()
+        grid = (src.shape, src.transform, src.crs)
+
+    for file in files[1:]:
+        with rio.open(file) as src:
+            if (src.shape, src.transform, src.crs) != grid:
+                raise Exception(f"{file} is not aligned with {files[0]}")
+
+    return profile
+
+
+def read_block(files, window, nan_nodata=False):
+    """Read all the bands of a window in each file
+
+    Args:
+        files (list): the raster files
+        window (Window): the window to read
+        nan_nodata (bool): cast the data to float32 and replace the nodata value by NaN
+
+    Returns:
+        (list): the (bands, rows, cols) array of each file
+    """
+    arrays = []
+    for file in files:
+        with rio.open(file) as src:
+            data = src.read(window=window)
+            if nan_nodata:
+                data = data.astype(np.float32)
+                if src.nodata is not None:
+                    data[data == src.nodata] = np.nan
+        arrays.append(data)
+
+    return arrays
+
+
+def _run_block(kernel, files, nan_nodata, window):
+    """Read a window, run the kernel on it and return the window with the result"""
+
+    return window, kernel(*read_block(files, window, nan_nodata))
+
+
+def map_windows(
+    kernel,
+    files,
+    bytes_per_pixel,
+    nan_nodata=False,
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Run a kernel on every block of aligned rasters
+
+    The blocks are dispatched to a process pool when workers > 1, each worker reads its own
+    windows so only the results are sent back. The number of blocks in flight is bounded and
+    the results are yielded in order so they can be written by a single writer.
+
+    Args:
+        kernel (callable): picklable function called with the (bands, rows, cols) array of each
+            file, use functools.partial to bind its parameters
+        files (list): the aligned raster files
+        bytes_per_pixel (int): the number of bytes needed by the kernel to process a single pixel
+        nan_nodata (bool): cast the data to float32 and replace the nodata value by NaN
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (generator): the (window, result) of each block, in order
+    """
+    profile = check_alignment(files)
+    shape = (profile["height"], profile["width"])
+    windows = block_windows(shape, bytes_per_pixel, memory_budget)
+    run = partial(_run_block, kernel, files, nan_nodata)
+
+    yield from ordered_map(run, windows, workers)
+
+
+def _run_slice(kernel, block):
+    """Run the kernel on a row slice and return the slice with the result"""
+
+    return block, kernel(block)
+
+
+def map_blocks(
+    kernel, shape, bytes_per_pixel, workers=1, memory_budget=pm.local_memory_budget
+):
+    """Run a kernel on every block of rows of in-memory arrays
+
+    The kernel reads its inputs itself, share them with parallel.shared_arrays so that only the
+    row slices and the results go through the process pool.
+
+    Args:
+        kernel (callable): picklable function called with the row slice of the block
+        shape (tuple): the (rows, cols) shape of the arrays
+        bytes_per_pixel (int): the number of bytes needed by the kernel to process a single pixel
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (generator): the (row slice, result) of each block, in order
+    """
+    blocks = row_blocks(shape, bytes_per_pixel, memory_budget)
+
+    yield from ordered_map(partial(_run_slice, kernel), blocks, workers)
+
+
+def run_windowed(
+    kernel,
+    files,
+    dst,
+    bytes_per_pixel,
+    count=1,
+    dtype=np.uint8,
+    nodata=0,
+    band_names=None,
+    colormap=None,
+    nan_nodata=False,
+    workers=1,
+    memory_budget=pm.local_memory_budget,
+):
+    """Run a kernel on every block of aligned rasters and write the results in a tiled GeoTIFF
+
+    Args:
+        kernel (callable): picklable function called with the (bands, rows, cols) array of each
+            file and returning a (count, rows, cols) or (rows, cols) array
+        files (list): the aligned raster files
+        dst (pathlib.Path): the output file
+        bytes_per_pixel (int): the number of bytes needed by the kernel to process a single pixel
+        count (int): the number of output bands
+        dtype (np.dtype): the output type
+        nodata: the output nodata value
+        band_names (list, optional): the description of the output bands
+        colormap (dict, optional): the colormap of the first band
+        nan_nodata (bool): cast the data to float32 and replace the nodata value by NaN
+        workers (int): the number of processes
+        memory_budget (int): the maximum number of bytes used by a single block
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    profile = check_alignment(files)
+    blocks = map_windows(
+        kernel, files, bytes_per_pixel, nan_nodata, workers, memory_budget
+    )
+
+    return write_blocks(
+        blocks, dst, profile, count, dtype, nodata, band_names, colormap
+    )
+
+
+def output_profile(profile, count=1, dtype=np.uint8, nodata=0):
+    """Return a copy of a rasterio profile set to write a tiled LZW GeoTIFF"""
+
+    profile = profile.copy()
+    profile.update(
+        driver="GTiff",
+        count=count,
+        dtype=dtype,
+        nodata=nodata,
+        tiled=True,
+        blockxsize=tile_size,
+        blockysize=tile_size,
+        compress="lzw",
+    )
+
+    return profile
+
+
+def write_blocks(
+    blocks,
+    dst,
+    profile,
+    count=1,
+    dtype=np.uint8,
+    nodata=0,
+    band_names=None,
+    colormap=None,
+):
+    """Write the (window, result) blocks of a kernel in a tiled GeoTIFF
+
+    Args:
+        blocks (iterable): the (window, result) pairs, the results are (count, rows, cols) or
+            (rows, cols) arrays
+        dst (pathlib.Path): the output file
+        profile (dict): the rasterio profile of the grid (width, height, crs and transform)
+        count (int): the number of output bands
+        dtype (np.dtype): the output type
+        nodata: the output nodata value
+        band_names (list, optional): the description of the output bands
+        colormap (dict, optional): the colormap of the first band
+
+    Returns:
+        (pathlib.Path): the dst file
+    """
+    profile = output_profile(profile, count, dtype, nodata)
+
+    # the results are written in order by this single writer
+    with rio.open(dst, "w", **profile) as dest:
+        for window, result in blocks:
+            dest.write(
+                np.asarray(result, dtype=dtype).reshape(count, -1, window.width),
+                window=window,
+            )
+
+        if band_names:
+            dest.descriptions = tuple(band_names)
+        if colormap:
+            dest.write_colormap(1, colormap)
+
+    return dst
@@ -251,7 +251,7 @@ class InputTile(sw.Tile):
                 self.alert.check_input(self.model.vegetation_index, cm.error.no_vi),
                 self.alert.check_input(self.model.trajectory, cm.error.no_traj),
                 self.alert.check_input(self.model.lceu, cm.error.no_lceu),
-                self.alert.check_input(self.model.sensors, "no sensors"),
+                self.alert.check_input(self.model.sensors, cm.error.no_sensors),
             ]
         ):
             return
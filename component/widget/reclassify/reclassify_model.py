@@ -1,5 +1,6 @@
 from traitlets import Unicode, Any, Dict, List, Bool, Int
 from pathlib import Path
+from functools import partial
 from natsort import natsorted
 
 import pandas as pd
@@ -14,12 +15,36 @@ from sepal_ui.model import Model
 from sepal_ui.scripts import gee
 from sepal_ui.scripts import utils as su
 from component.message import cm
+from component import parameter as pm
+from component.scripts.windowed import block_windows
+from component.scripts.parallel import ordered_map
 
 import ee
 
 __all__ = ["ReclassifyModel"]
 
 
+def _unique_block(file, band, window):
+    """Return the unique values of a block of a raster band"""
+
+    with rio.open(file) as src:
+        return np.unique(src.read(band, window=window))
+
+
+def _reclassify_block(file, band, from_, to_, window):
+    """Reclassify a block of a raster band, the values missing from the sorted from_ are set to 0"""
+
+    with rio.open(file) as src:
+        raw = src.read(band, window=window)
+
+    if not len(from_):
+        return window, np.zeros(raw.shape, dtype=np.uint8)
+
+    index = np.clip(np.searchsorted(from_, raw), 0, len(from_) - 1)
+
+    return window, np.where(from_[index] == raw, to_[index], 0).astype(np.uint8)
+
+
 class ReclassifyModel(Model):
     """
     Reclassification model to store information about the current reclassification and share them within your app. save all the input and output of the reclassification + the the matrix to move from one to another. It is embeding 2 backends, one based on GEE that will use assets as in/out and another based on python that will use local files as in/out. The model can handle both vector and raster data, the format and name of the output will be determined from the the input format/name. The developer will still have the possiblity to choose where to save the outputs (folder name).
@@ -305,12 +330,18 @@ class ReclassifyModel(Model):
         def _local_image():
             with rio.open(self.src_local) as src:
                 bounds = self.get_aoi().total_bounds if self.get_aoi() else src.bounds
-                data = src.read(
-                    self.band, window=from_bounds(*bounds, transform=src.transform)
-                )
-                count = np.bincount(data.flatten())
+                window = from_bounds(*bounds, transform=src.transform)
+                window = window.round_offsets().round_lengths()
+                windows = block_windows(src.shape, 8, region=window)
+
+            # merge the unique values of each block
+            blocks = ordered_map(
+                partial(_unique_block, self.src_local, self.band),
+                windows,
+                pm.local_workers,
+            )
 
-            return np.nonzero(count != 0)[0].tolist()
+            return np.unique(np.concatenate(list(blocks))).tolist()
 
         def _local_vector():
             gdf = gpd.read_file(self.src_local)
@@ -464,41 +495,51 @@ class ReclassifyModel(Model):
                 self.dst_dir / f"{Path(self.src_local).stem}_reclass.tif"
             )
 
+            # sort the matrix to remap the values with a binary search
+            matrix = sorted((int(k), int(v)) for k, v in self.matrix.items())
+            from_ = np.array([k for k, _ in matrix], dtype=np.int64)
+            to_ = np.array([v for _, v in matrix], dtype=np.int64)
+
             with rio.open(self.src_local) as src:
                 bounds = self.get_aoi().total_bounds if self.get_aoi() else src.bounds
                 window = from_bounds(*bounds, transform=src.transform)
-                raw = src.read(self.band, window=window)
-
-                data = np.zeros_like(raw, dtype=np.int64)
-
-                for old_val, new_val in matrix.items():
-                    data += (raw == old_val) * new_val
-
-                if self.save:
-                    profile = src.profile
-                    profile.update(
-                        driver="GTiff",
-                        count=1,
-                        compress="lzw",
-                        dtype=np.uint8,
-                        height=window.height,
-                        width=window.width,
-                        transform=src.window_transform(window),
-                    )
-
-                    with rio.open(self.dst_local, "w", **profile) as dst:
-                        dst.write(data.astype(np.uint8), 1, window=window)
-
-                        # add the colors to the image
-                        colormap = {0: (0, 0, 0)}
-                        for code, item in self.dst_class.items():
-                            colormap[code] = tuple(
-                                int(c * 255) for c in to_rgba(item[1])
-                            )
-                        dst.write_colormap(self.band, colormap)
-
-                    # Save raster in memory
-                    self.dst_local_memory = data
+                window = window.round_offsets().round_lengths()
+                windows = block_windows(src.shape, 8, region=window)
+
+                profile = src.profile
+                profile.update(
+                    driver="GTiff",
+                    count=1,
+                    compress="lzw",
+                    dtype=np.uint8,
+                    height=window.height,
+                    width=window.width,
+                    transform=src.window_transform(window),
+                )
+
+            # the blocks are reclassified and gathered in order
+            data = np.zeros((window.height, window.width), dtype=np.uint8)
+            blocks = ordered_map(
+                partial(_reclassify_block, self.src_local, self.band, from_, to_),
+                windows,
+                pm.local_workers,
+            )
+            for block, result in blocks:
+                row = block.row_off - window.row_off
+                data[row : row + block.height] = result
+
+            if self.save:
+                with rio.open(self.dst_local, "w", **profile) as dst:
+                    dst.write(data, 1)
+
+                    # add the colors to the image
+                    colormap = {0: (0, 0, 0)}
+                    for code, item in self.dst_class.items():
+                        colormap[code] = tuple(int(c * 255) for c in to_rgba(item[1]))
+                    dst.write_colormap(1, colormap)
+
+                # Save raster in memory
+                self.dst_local_memory = data
 
             return self.dst_local
 